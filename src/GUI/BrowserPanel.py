@@ -0,0 +1,268 @@
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThreadPool, QTimer, QFileSystemWatcher, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QPixmap
+from PyQt6.QtWidgets import QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QListView, QFileDialog
+
+from ..thumbindex import ThumbnailIndex, list_images
+from .worker import EditWorker
+
+CELL_SPACING = 28  # room under the thumbnail for the file name
+CACHED_PIXMAPS = 512  # thumbnails kept as pixmaps, the rest are read back from the index when scrolled to
+POLL_MS = 3000  # rescan of the shown folder, the directory watcher misses files rewritten in place
+RESCAN_DELAY_MS = 300  # a copy into the folder fires many directoryChanged, rescan once after the last
+
+
+class ThumbnailModel(QAbstractListModel):
+    # images of one folder. data() asks for a thumbnail through request(path) the first time
+    # the view paints a cell, and the view only paints the cells that are visible
+    def __init__(self, request, icon_size: int, parent=None):
+        super().__init__(parent)
+        self.request = request
+        self.paths = []
+        self.keys = {}
+        self._rows = {}
+        self._pixmaps = OrderedDict()
+        self._sizes = {}
+        self._failed = set()
+        self._placeholder = QPixmap(icon_size, icon_size)
+        self._placeholder.fill(QColor(60, 60, 60))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        path = self.paths[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(path)
+        if role == Qt.ItemDataRole.DecorationRole:
+            pixmap = self._pixmaps.get(path)
+            if pixmap is not None:
+                self._pixmaps.move_to_end(path)
+                return pixmap
+            if path not in self._failed:
+                self.request(path)
+            return self._placeholder
+        if role == Qt.ItemDataRole.ToolTipRole:
+            size = self._sizes.get(path)
+            return f"{path}\n{size[0]} x {size[1]}" if size else path
+        if role == Qt.ItemDataRole.UserRole:
+            return path
+        return None
+
+    def row(self, path: str):
+        return self._rows.get(path)
+
+    def set_images(self, images: dict) -> list:
+        # images is {path: file_key} from list_images. returns the paths already shown whose file changed
+        changed = [p for p in self.paths if p in images and images[p] != self.keys[p]]
+        for path in changed:
+            self._forget(path)
+        if set(images) != set(self.paths):
+            self.beginResetModel()
+            for path in set(self.paths) - set(images):
+                self._forget(path)
+            self.paths = sorted(images, key=lambda p: os.path.basename(p).casefold())
+            self._rows = {path: row for row, path in enumerate(self.paths)}
+            self.keys = dict(images)
+            self.endResetModel()
+        else:
+            self.keys = dict(images)
+            for path in changed:
+                index = self.index(self._rows[path])
+                self.dataChanged.emit(index, index)
+        return changed
+
+    def set_thumbnail(self, path: str, pixmap, full_size=None):
+        # pixmap None marks a file that can't be read, it isn't asked for again until it changes
+        row = self._rows.get(path)
+        if row is None:
+            return
+        if pixmap is None:
+            self._failed.add(path)
+        else:
+            self._pixmaps[path] = pixmap
+            self._sizes[path] = full_size
+            while len(self._pixmaps) > CACHED_PIXMAPS:
+                self._pixmaps.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def _forget(self, path: str):
+        self._pixmaps.pop(path, None)
+        self._sizes.pop(path, None)
+        self._failed.discard(path)
+
+
+class BrowserPanel(QDockWidget):
+    """
+    Thumbnails of the images in a folder, a grid when docked at a side and a filmstrip
+    at the top or bottom. Double click opens the image.
+
+    Thumbnails come from a ThumbnailIndex, so a folder seen before fills in from disk
+    without decoding. Only cells the view paints ask for one, newest request first, and
+    requests for cells scrolled away before their turn are dropped. The folder is
+    watched and changed files get a new thumbnail.
+    """
+
+    imageActivated = pyqtSignal(str)
+
+    def __init__(self, parent=None, index: ThumbnailIndex = None):
+        super().__init__("Browser", parent)
+        if index is None:
+            try:
+                index = ThumbnailIndex()
+            except sqlite3.Error as e:
+                logging.warning("thumbnail index unavailable (%s), thumbnails won't be kept", e)
+                index = ThumbnailIndex(":memory:")
+        self.index = index
+        self.folder = None
+        # paths waiting for a thumbnail, most recently painted last. path -> file key of running jobs
+        self._wanted = OrderedDict()
+        self._running = {}
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(os.cpu_count() or 1)
+
+        content = QWidget()
+        layout = QVBoxLayout(content)
+        controls = QHBoxLayout()
+        folder_button = QPushButton("Folder...")
+        folder_button.clicked.connect(self.choose_folder)
+        controls.addWidget(folder_button)
+        self.folder_label = QLabel()
+        controls.addWidget(self.folder_label, 1)
+        layout.addLayout(controls)
+
+        size = self.index.size
+        self.model = ThumbnailModel(self.request, size, self)
+        self.view = QListView()
+        self.view.setViewMode(QListView.ViewMode.IconMode)
+        self.view.setMovement(QListView.Movement.Static)
+        self.view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.view.setIconSize(QSize(size, size))
+        self.view.setGridSize(QSize(size + 16, size + CELL_SPACING))
+        # all cells have the same size, so the layout doesn't have to ask every row for its data
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.view.setModel(self.model)
+        self.view.activated.connect(self.on_activated)
+        layout.addWidget(self.view)
+        self.setWidget(content)
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_rescan)
+        self.rescan_timer = QTimer(self)
+        self.rescan_timer.setSingleShot(True)
+        self.rescan_timer.setInterval(RESCAN_DELAY_MS)
+        self.rescan_timer.timeout.connect(self.rescan)
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(POLL_MS)
+        self.poll_timer.timeout.connect(self.rescan)
+        self.pump_timer = QTimer(self)
+        self.pump_timer.setSingleShot(True)
+        self.pump_timer.timeout.connect(self.pump)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+        self.dockLocationChanged.connect(self.on_location_changed)
+
+    def choose_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Browse folder", self.folder or "")
+        if folder:
+            self.set_folder(folder)
+
+    def set_folder(self, folder: str):
+        if self.watcher.directories():
+            self.watcher.removePaths(self.watcher.directories())
+        # jobs of the old folder that haven't started yet are dropped, running ones finish into the void
+        self.pool.clear()
+        self._wanted.clear()
+        self.folder = folder
+        self.folder_label.setText(folder)
+        self.folder_label.setToolTip(folder)
+        self.watcher.addPath(folder)
+        self.model.set_images(list_images(folder))
+        self.view.scrollToTop()
+        logging.info("browsing %s, %d images", folder, self.model.rowCount())
+
+    def schedule_rescan(self, _path=None):
+        self.rescan_timer.start()
+
+    def rescan(self):
+        if self.folder is None:
+            return
+        if not os.path.isdir(self.folder):
+            logging.info("browsed folder %s is gone", self.folder)
+            self.model.set_images({})
+            return
+        changed = self.model.set_images(list_images(self.folder))
+        if changed:
+            logging.debug("browser: %d changed files", len(changed))
+
+    def request(self, path: str):
+        # called from the model while painting, the jobs start once the paint is done
+        if path in self._running:
+            return
+        self._wanted[path] = None
+        self._wanted.move_to_end(path)
+        if not self.pump_timer.isActive():
+            self.pump_timer.start(0)
+
+    def pump(self):
+        viewport = self.view.viewport().rect()
+        while self._wanted and len(self._running) < self.pool.maxThreadCount():
+            path, _ = self._wanted.popitem()
+            row = self.model.row(path)
+            if row is None or not self.view.visualRect(self.model.index(row)).intersects(viewport):
+                # scrolled away, painting the cell again asks again
+                continue
+            self._running[path] = self.model.keys[path]
+            worker = EditWorker(self._thumbnailJob, self.index, path)
+            worker.signals.finished.connect(self.on_thumbnail)
+            worker.signals.failed.connect(lambda message, path=path: self.on_thumbnail_failed(path, message))
+            self.pool.start(worker)
+
+    @staticmethod
+    def _thumbnailJob(worker, index, path):
+        try:
+            data, full_size = index.thumbnail(path)
+        except OSError as e:
+            # not an image after all, or gone. a folder can be full of those, so it's not an error
+            logging.debug("no thumbnail for %s: %s", path, e)
+            return path, None, None
+        # QImage can be made off the GUI thread, QPixmap can't
+        return path, QImage.fromData(data), full_size
+
+    def on_thumbnail(self, result):
+        path, image, full_size = result
+        key = self._running.pop(path, None)
+        if key is not None and key == self.model.keys.get(path):
+            self.model.set_thumbnail(path, QPixmap.fromImage(image) if image is not None else None, full_size)
+        elif path in self.model.keys:
+            # the file changed while its thumbnail was made
+            self.request(path)
+        self.pump()
+
+    def on_thumbnail_failed(self, path, message):
+        self._running.pop(path, None)
+        self.model.set_thumbnail(path, None)
+        self.pump()
+
+    def on_activated(self, index):
+        self.imageActivated.emit(self.model.data(index, Qt.ItemDataRole.UserRole))
+
+    def on_visibility_changed(self, visible: bool):
+        # nothing to poll while hidden, the directory watcher still catches added and removed files
+        if visible:
+            self.rescan()
+            self.poll_timer.start()
+        else:
+            self.poll_timer.stop()
+
+    def on_location_changed(self, area):
+        # a single row along the top or bottom of the window, a wrapping grid at the sides
+        filmstrip = area in (Qt.DockWidgetArea.TopDockWidgetArea, Qt.DockWidgetArea.BottomDockWidgetArea)
+        self.view.setWrapping(not filmstrip)
@@ -1,7 +1,14 @@
 import logging
 
-from PyQt6.QtCore import Qt
-from PyQt6.QtWidgets import QDialog, QGridLayout, QLineEdit, QPushButton, QComboBox, QSlider
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QDialog, QGridLayout, QLineEdit, QPushButton, QComboBox, QSlider, QCheckBox, QWidget, QFormLayout, QLabel,
+    QHBoxLayout
+)
+
+from ..filters import FILTER_REGISTRY
+
+PREVIEW_DEBOUNCE_MS = 80  # wait for the slider to rest this long before re-rendering the preview
 
 
 class FilterForm(QDialog):
@@ -10,7 +17,7 @@ class FilterForm(QDialog):
         super().__init__(parent)
         self.main_window = main_window
         self.editor = editor
-        self.setWindowTitle("Add filter")
+        self.setWindowTitle("Add filter to selection" if getattr(main_window, "selection", None) else "Add filter")
         self.resize(300,100)
         layout = QGridLayout()
         layout.setContentsMargins(15, 15, 15, 15)
@@ -18,6 +25,9 @@ class FilterForm(QDialog):
         layout.setVerticalSpacing(10)
         self.combobox = QComboBox(self)
         self.combobox.addItems(["Blur", "Contour", "Detail", "Sharpen"])
+        # array filters from the registry, shown by title ("unsharp_mask" -> "Unsharp Mask")
+        self.array_filters = {name.replace("_", " ").title(): name for name in FILTER_REGISTRY}
+        self.combobox.addItems(list(self.array_filters))
         self.combobox.currentTextChanged.connect(self.on_filter_change)
         layout.addWidget(self.combobox, 0, 0)
 
@@ -32,9 +42,29 @@ class FilterForm(QDialog):
         layout.addWidget(self.intensity_slider, 1, 0)
         self.intensity_slider.valueChanged.connect(self.update_intensity_qlineedit)
 
+        # sliders for the parameters of array filters, rebuilt on filter change
+        self.params_widget = QWidget()
+        self.params_layout = QFormLayout(self.params_widget)
+        self.params_layout.setContentsMargins(0, 0, 0, 0)
+        self.param_sliders = {}
+        layout.addWidget(self.params_widget, 2, 0, 1, 3)
+        self.params_widget.hide()
+
+        # live preview: re-render a downscaled preview as the settings change, history isn't touched
+        self.preview_checkbox = QCheckBox("Live preview")
+        self.preview_checkbox.setChecked(True)
+        self.preview_checkbox.toggled.connect(self.on_preview_toggled)
+        layout.addWidget(self.preview_checkbox, 3, 0, 1, 3)
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.intensity_slider.valueChanged.connect(self.schedule_preview)
+        self.combobox.currentTextChanged.connect(self.schedule_preview)
+
         self.apply_button = QPushButton("Apply Filter")
         self.apply_button.clicked.connect(self.apply_filter)
-        layout.addWidget(self.apply_button, 2, 0, 1, 3)
+        layout.addWidget(self.apply_button, 4, 0, 1, 3)
 
         self.setLayout(layout)
         logging.debug("filter form initialized")
@@ -42,18 +72,83 @@ class FilterForm(QDialog):
     def update_intensity_qlineedit(self, value):
         self.int_label.setText(str(value))
 
-    def apply_filter(self):
+    def current_operation(self):
+        # (op, kwargs) for the current settings, limited to the selection if there is one
         selected_filter = self.combobox.currentText()
         if selected_filter.lower() == "blur":
-            intensity = self.intensity_slider.value()
-            logging.debug(f"applying {selected_filter} with intensity {intensity}")
-            self.editor.apply_blur(intensity)
+            op, kwargs = "apply_blur", {"intensity": self.intensity_slider.value()}
+        elif selected_filter in self.array_filters:
+            op, kwargs = "apply_filter", {"filter_name": self.array_filters[selected_filter], **self.param_values()}
         else:
-            logging.debug(f"applying {selected_filter} filter")
-            self.editor.apply_filter(selected_filter)
-        self.main_window.renderImage()
+            op, kwargs = "apply_filter", {"filter_name": selected_filter}
+        selection = getattr(self.main_window, "selection", None)
+        if selection is not None:
+            kwargs["box"] = selection
+        return op, kwargs
+
+    def param_values(self) -> dict:
+        return {name: self.slider_value(param, slider) for name, (param, slider, _) in self.param_sliders.items()}
+
+    @staticmethod
+    def slider_value(param, slider):
+        value = param.minimum + slider.value() * param.step
+        return round(value, 6) if isinstance(param.step, float) else value
+
+    def build_param_sliders(self, name):
+        while self.params_layout.rowCount():
+            self.params_layout.removeRow(0)
+        self.param_sliders = {}
+        spec = FILTER_REGISTRY.get(name)
+        if spec is None or not spec.params:
+            self.params_widget.hide()
+            return
+        for param in spec.params:
+            # sliders are integer, a step of 0.1 maps position 15 to 1.5 (+ minimum)
+            slider = QSlider(Qt.Orientation.Horizontal)
+            slider.setMinimum(0)
+            slider.setMaximum(round((param.maximum - param.minimum) / param.step))
+            slider.setValue(round((param.default - param.minimum) / param.step))
+            value_label = QLabel(str(param.default))
+            row = QHBoxLayout()
+            row.addWidget(slider)
+            row.addWidget(value_label)
+            self.params_layout.addRow(param.label, row)
+            self.param_sliders[param.name] = (param, slider, value_label)
+            slider.valueChanged.connect(
+                lambda _, p=param, s=slider, l=value_label: l.setText(str(self.slider_value(p, s)))
+            )
+            slider.valueChanged.connect(self.schedule_preview)
+        self.params_widget.show()
+
+    def schedule_preview(self, *args):
+        if self.preview_checkbox.isChecked():
+            self.preview_timer.start()
+
+    def update_preview(self):
+        op, kwargs = self.current_operation()
+        self.main_window.showLivePreview(op, **kwargs)
+
+    def on_preview_toggled(self, checked):
+        if checked:
+            self.update_preview()
+        else:
+            self.preview_timer.stop()
+            self.main_window.endLivePreview()
+
+    def done(self, result):
+        # closing the form without applying throws the preview away
+        self.preview_timer.stop()
+        self.main_window.endLivePreview()
+        super().done(result)
+
+    def apply_filter(self):
+        self.preview_timer.stop()
+        op, kwargs = self.current_operation()
+        logging.debug("applying %s: %s %s", self.combobox.currentText(), op, kwargs)
+        self.main_window.applyOperation(op, **kwargs)
 
     def on_filter_change(self, value):
+        self.build_param_sliders(self.array_filters.get(value))
         if value.lower() == "blur":
             self.int_label.show()
             self.intensity_slider.show()
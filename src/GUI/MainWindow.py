@@ -1,19 +1,34 @@
 import logging
+import os
 import sys
+from multiprocessing import get_context
 
 from PyQt6 import QtWidgets
-from PyQt6.QtCore import Qt
-from PyQt6.QtGui import QPalette, QColor, QAction
+from PyQt6.QtCore import Qt, QThreadPool
+from PyQt6.QtGui import QPalette, QColor, QAction, QActionGroup, QPen
 from PyQt6.QtWidgets import (
     QDockWidget, QWidget, QVBoxLayout, QLabel, QApplication,
-    QFileDialog, QMessageBox, QGraphicsScene, QGraphicsPixmapItem, QPushButton
+    QFileDialog, QMessageBox, QGraphicsScene, QGraphicsRectItem, QPushButton, QProgressBar, QTabBar,
+    QProgressDialog
 )
 
+from .BrowserPanel import BrowserPanel
 from .FilterForm import FilterForm
+from .PerformancePanel import PerformancePanel
 from .ResizeForm import ResizeForm
-from ..tools import Editor
+from ..batch import expand_inputs, load_recipe, run_batch
+from ..documents import MemoryGovernor
+from ..instrument import instrumented
+from ..saving import DEFAULT_PRESET, PRESETS, save_image
 from .TextForm import TextInputDialog
 from .graphicsview import GraphicsView
+from .display import DisplayBuffer, ImageCanvasItem, prepare_region
+from .document import DocumentTab
+from .worker import EditWorker
+
+SAVE_PROGRESS_STEP = 1024 * 1024  # report save progress every this many bytes written
+# files a macro is replayed on when given a folder
+MACRO_INPUT_PATTERNS = ("*.png", "*.jpg", "*.jpeg", "*.bmp", "*.tif", "*.tiff", "*.webp")
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -23,30 +38,181 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setWindowTitle("Image Editor")
         self.resize(800, 600)
 
-        self.editor = Editor()
-
-
+        # one tab per open image, each with its own editor, history and workers (see document.py).
+        # editor, edit_queue etc. below are the shown tab's. Inactive tabs give memory back
+        # to the governor when all of them together go over its budget
+        self.governor = MemoryGovernor()
+        self.document = None
+        # saves encode on the thread pool too, see saveImage
+        self.save_preset = DEFAULT_PRESET
+        self.save_worker = None
 
         self.scene = QGraphicsScene()
         logging.debug(f"scene: {self.scene}")
+        self.image_item = ImageCanvasItem()
+        self.scene.addItem(self.image_item)
+        # (x0, y0, x1, y1) in image pixels, filters only touch this region while it's set
+        self.selection = None
+        self.selection_item = None
 
         self.view = GraphicsView(self.scene, self)
         logging.debug(f"view: {self.view}")
 
         self.view.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.setCentralWidget(self.view)
+        self.tab_bar = QTabBar()
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setMovable(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.currentChanged.connect(self.onTabChanged)
+        self.tab_bar.tabCloseRequested.connect(self.closeDocument)
+        central = QWidget()
+        central_layout = QVBoxLayout(central)
+        central_layout.setContentsMargins(0, 0, 0, 0)
+        central_layout.setSpacing(0)
+        central_layout.addWidget(self.tab_bar)
+        central_layout.addWidget(self.view)
+        self.setCentralWidget(central)
 
         self.initsidebar()
+        self.initperformancepanel()
+        self.initbrowserpanel()
         self.initmenubar()
         self.initdarktheme()
         self.initStatusbar()
+        self.newDocument()
 
         logging.debug("initialized MainWindow")
-        self.image_item = None
 
         self.setAttribute(Qt.WidgetAttribute.WA_TranslucentBackground)
         self.setAttribute(Qt.WidgetAttribute.WA_TransparentForMouseEvents, False)
 
+    # the shown document's parts
+    @property
+    def editor(self):
+        return self.document.editor
+
+    @property
+    def edit_queue(self):
+        # edits run on a worker thread, see applyOperation
+        return self.document.edit_queue
+
+    @property
+    def preview_renderer(self):
+        # throwaway previews, e.g. while dragging the blur slider
+        return self.document.preview_renderer
+
+    @property
+    def display_buffer(self):
+        return self.document.display_buffer
+
+    @property
+    def preview_buffer(self):
+        return self.document.preview_buffer
+
+    def newDocument(self):
+        doc = DocumentTab(parent=self)
+        doc.edit_queue.progress.connect(self._documentSlot(doc, self.onEditProgress))
+        doc.edit_queue.finished.connect(self._documentSlot(doc, self.onEditFinished, self.onBackgroundEditFinished))
+        doc.edit_queue.failed.connect(self._documentSlot(doc, self.onEditFailed, self.onBackgroundEditFailed))
+        doc.edit_queue.cancelled.connect(self._documentSlot(doc, self.onEditCancelled))
+        doc.preview_renderer.ready.connect(self._documentSlot(doc, self.onLivePreviewReady))
+        self.governor.add(doc)
+        index = self.tab_bar.addTab(doc.title)
+        self.tab_bar.setTabData(index, doc)
+        self.tab_bar.setCurrentIndex(index)
+        if self.document is not doc:
+            # the very first tab doesn't change the current index
+            self.switchDocument(doc)
+        return doc
+
+    def _documentSlot(self, doc, slot, background=None):
+        # a document's worker signals reach slot while it's the shown one, background(doc, ...) otherwise
+        def call(*args):
+            if doc is self.document:
+                slot(*args)
+            elif background is not None:
+                background(doc, *args)
+        return call
+
+    def onTabChanged(self, index):
+        if index >= 0:
+            self.switchDocument(self.tab_bar.tabData(index))
+
+    def switchDocument(self, doc):
+        if doc is self.document:
+            return
+        old = self.document
+        if old is not None:
+            old.preview_renderer.cancel()
+            old.transform = None if self.view.fit_to_window else self.view.transform()
+            old.scroll = (self.view.horizontalScrollBar().value(), self.view.verticalScrollBar().value())
+        self.clearSelection()
+        self.document = doc
+        self.governor.touch(doc)
+        self.showDocument()
+        self.governor.enforce()
+
+    def showDocument(self):
+        # put the current document on screen. Recently used ones still have their display
+        # buffer, hibernated ones are decoded again on the worker first
+        doc = self.document
+        self.clearOverlays()
+        self.path_label.setText(self.editor.path or "Image not loaded")
+        if not self.editor.image:
+            self.image_item.set_buffer(None)
+        elif self.edit_queue.busy:
+            self.showPreview()
+        elif self.display_buffer.pixels is not None:
+            self.image_item.set_buffer(self.display_buffer)
+        elif not self.editor.loaded:
+            self.image_item.set_buffer(None)
+            self.edit_queue.submit("load", {})
+        else:
+            self.editor.take_dirty_box()
+            self.showRegion(prepare_region(self.editor.display_image()))
+        rect = self.image_item.sceneBoundingRect()
+        self.scene.setSceneRect(rect)
+        if doc.transform is not None:
+            self.view.setTransform(doc.transform)
+            self.view.fit_to_window = False
+            self.view.horizontalScrollBar().setValue(doc.scroll[0])
+            self.view.verticalScrollBar().setValue(doc.scroll[1])
+        elif self.image_item.buffer is not None:
+            self.view.fit_item(self.image_item)
+        self.recordAction.setChecked(self.editor.recording)
+        busy = self.edit_queue.busy or self.save_worker is not None
+        self.status_progress.setVisible(busy)
+        self.cancel_button.setVisible(busy)
+        self.update_undo_redo_actions()
+
+    def closeDocument(self, index=None):
+        index = self.tab_bar.currentIndex() if index is None else index
+        doc = self.tab_bar.tabData(index)
+        if doc.busy:
+            QMessageBox.warning(self, "Busy", "Wait for the running edit to finish")
+            return
+        doc.preview_renderer.cancel()
+        self.governor.remove(doc)
+        if self.tab_bar.count() == 1:
+            # always keep one tab around. it's added at the end, index stays valid
+            self.newDocument()
+        self.tab_bar.removeTab(index)
+        doc.editor.close()
+
+    def onBackgroundEditFinished(self, doc, region):
+        # keep the buffer of a document edited in the background current, so switching to it is instant
+        if region is not None:
+            try:
+                doc.display_buffer.apply(*region)
+            except ValueError:
+                # doesn't fit (dropped or resized meanwhile), rebuilt when the tab is shown
+                doc.display_buffer = DisplayBuffer()
+        self.governor.enforce()
+
+    def onBackgroundEditFailed(self, doc, message):
+        QMessageBox.warning(self, "Error", f"Edit of {doc.title} failed: {message}")
+
     def initsidebar(self):
         sidebar = QDockWidget("Tools", self)
         sidebar.setFeatures(QDockWidget.DockWidgetFeature.NoDockWidgetFeatures)
@@ -73,17 +239,40 @@ class MainWindow(QtWidgets.QMainWindow):
         self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, sidebar)
         logging.debug("initialized sidebar")
 
+    def initperformancepanel(self):
+        # hidden until View > Performance, operations are only timed while its Record box is ticked
+        self.performance_panel = PerformancePanel(self)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.performance_panel)
+        self.performance_panel.hide()
+
+    def initbrowserpanel(self):
+        # hidden until File > Browse folder or View > Browser, thumbnails are only made while it's shown
+        self.browser_panel = BrowserPanel(self)
+        self.browser_panel.imageActivated.connect(self.openPath)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.browser_panel)
+        self.browser_panel.hide()
+
     def initmenubar(self):
         menubar = self.menuBar()
         fileMenu = menubar.addMenu("File")
         EditMenu = menubar.addMenu("Edit")
+        ViewMenu = menubar.addMenu("View")
+        MacroMenu = menubar.addMenu("Macro")
 
         openAction = QAction("Open", self)
         openAction.triggered.connect(self.openImage) # type: ignore # pycharm doesn't like that line, so I had to silence it
 
+        browseAction = QAction("Browse folder...", self)
+        browseAction.setShortcut("Ctrl+B")
+        browseAction.triggered.connect(self.browseFolder)
+
         saveAction = QAction("Save", self)
         saveAction.triggered.connect(self.saveImage) # type: ignore
 
+        closeAction = QAction("Close", self)
+        closeAction.setShortcut("Ctrl+W")
+        closeAction.triggered.connect(lambda: self.closeDocument())
+
         resizeAction = QAction("Resize", self)
         resizeAction.triggered.connect(self.showResizeForm) # type: ignore
 
@@ -93,6 +282,13 @@ class MainWindow(QtWidgets.QMainWindow):
         selectionAction = QAction("Selection", self)
         selectionAction.triggered.connect(lambda x: self.view.set_selection_mode(True))
 
+        cropAction = QAction("Crop to selection", self)
+        cropAction.triggered.connect(self.cropToSelection)
+
+        clearSelectionAction = QAction("Clear selection", self)
+        clearSelectionAction.setShortcut("Ctrl+Shift+A")
+        clearSelectionAction.triggered.connect(self.clearSelection)
+
         AddTextAction = QAction("Add text", self)
         AddTextAction.triggered.connect(self.showTextForm)
 
@@ -105,16 +301,51 @@ class MainWindow(QtWidgets.QMainWindow):
         self.redoAction.triggered.connect(self.redo)
 
         fileMenu.addAction(openAction)
+        fileMenu.addAction(browseAction)
         fileMenu.addAction(saveAction)
+        fileMenu.addAction(closeAction)
+        # encoder speed/size trade-off used by Save, see saving.SAVE_PRESETS
+        qualityMenu = fileMenu.addMenu("Save preset")
+        presetGroup = QActionGroup(self)
+        for preset in PRESETS:
+            presetAction = QAction(preset.capitalize(), self, checkable=True)
+            presetAction.setChecked(preset == self.save_preset)
+            presetAction.triggered.connect(lambda checked, p=preset: setattr(self, "save_preset", p))
+            presetGroup.addAction(presetAction)
+            qualityMenu.addAction(presetAction)
         fileMenu.addSeparator()
         fileMenu.addAction("Exit", self.close)
         EditMenu.addAction(FilterFormAction)
         EditMenu.addAction(resizeAction)
         EditMenu.addAction(selectionAction)
+        EditMenu.addAction(cropAction)
+        EditMenu.addAction(clearSelectionAction)
         EditMenu.addAction(AddTextAction)
         EditMenu.addSeparator()
         EditMenu.addAction(self.undoAction)
         EditMenu.addAction(self.redoAction)
+
+        fitAction = QAction("Fit to window", self)
+        fitAction.setShortcut("Ctrl+0")
+        fitAction.triggered.connect(self.fitToWindow)
+        actualSizeAction = QAction("Actual size", self)
+        actualSizeAction.setShortcut("Ctrl+1")
+        actualSizeAction.triggered.connect(self.actualSize)
+        ViewMenu.addAction(fitAction)
+        ViewMenu.addAction(actualSizeAction)
+        ViewMenu.addSeparator()
+        ViewMenu.addAction(self.browser_panel.toggleViewAction())
+        ViewMenu.addAction(self.performance_panel.toggleViewAction())
+
+        # operations of the current tab are recorded while checked, see macro.py
+        self.recordAction = QAction("Record macro", self, checkable=True)
+        self.recordAction.setShortcut("Ctrl+Shift+R")
+        self.recordAction.triggered.connect(self.toggleRecording)
+        replayAction = QAction("Replay macro on folder...", self)
+        replayAction.triggered.connect(self.replayMacro)
+        MacroMenu.addAction(self.recordAction)
+        MacroMenu.addAction(replayAction)
+        self.replay_worker = None
         logging.debug("initialized menubar")
 
         # ensure actions reflect current editor state
@@ -136,25 +367,199 @@ class MainWindow(QtWidgets.QMainWindow):
     def openImage(self):
         path, _ = QFileDialog.getOpenFileName(self, "Open Image", "", "Images (*.png *.jpg *.jpeg *.bmp)")
         if path:
-            self.path_label.setText(path)
-            self.editor.open(path)
-            self.renderImage()
+            self.openPath(path)
+
+    def openPath(self, path: str):
+        for index in range(self.tab_bar.count()):
+            if self.tab_bar.tabToolTip(index) == path:
+                # already open (e.g. double clicked again in the browser), show that tab
+                self.tab_bar.setCurrentIndex(index)
+                return
+        if self.editor.image or self.edit_queue.busy:
+            # every image gets its own tab, only an empty one is reused
+            self.newDocument()
+        self.path_label.setText(path)
+        # only the header is read here. the exif thumbnail and a draft decode show up
+        # right away, the full decode runs on the worker and replaces them when done
+        self.editor.open(path)
+        index = self.tab_bar.currentIndex()
+        self.tab_bar.setTabText(index, self.document.title)
+        self.tab_bar.setTabToolTip(index, path)
+        # shown through onLivePreviewReady, dropped once the load finishes (see onEditFinished)
+        self.preview_renderer.request_opened(self.previewSize())
+        self.edit_queue.submit("load", {})
+        self.status_progress.show()
+        self.cancel_button.show()
+        self.update_undo_redo_actions()
+
+    def browseFolder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Browse folder", self.browser_panel.folder or "")
+        if folder:
+            self.browser_panel.show()
+            self.browser_panel.set_folder(folder)
 
+    @instrumented("MainWindow.renderImage", image_of=lambda window: window.editor.image)
     def renderImage(self):
         logging.debug("rendering image")
-        pixmap = self.editor.to_qpixmap()
-        if pixmap:
-            self.scene.clear()
-            self.image_item = QGraphicsPixmapItem(pixmap)
-            self.scene.addItem(self.image_item)
-            self.view.fitInView(self.image_item, Qt.AspectRatioMode.KeepAspectRatio)
+        if self.editor.image:
+            self.editor.commit()
+            # only the region edits touched since the last render is converted and repainted
+            box = self.editor.take_dirty_box()
+            if box or self.image_item.buffer is not self.display_buffer:
+                self.showRegion(prepare_region(self.editor.display_image(), box) if box else None)
         # update undo/redo action states after any render (which follows edits)
         self.update_undo_redo_actions()
 
+    def showRegion(self, region):
+        # region is (box, array) from prepare_region, None when only switching back from a preview
+        self.clearOverlays()
+        if region is not None:
+            box = self.display_buffer.apply(*region)
+        if self.image_item.buffer is not self.display_buffer:
+            self.image_item.set_buffer(self.display_buffer)
+        elif region is not None:
+            self.image_item.update_region(box)
+        self.fitScene()
+
+    def showPreviewRegion(self, region, factor: float):
+        # factor < 1 means a downscaled preview, the item scales it back up so scene
+        # coordinates stay in full-resolution image pixels (text placement relies on that)
+        self.clearOverlays()
+        self.preview_buffer.apply(*region)
+        self.image_item.set_buffer(self.preview_buffer, factor)
+        self.fitScene()
+
+    def clearOverlays(self):
+        # drop temporary items (e.g. text shown where it was placed) once the image has caught up
+        for item in self.scene.items():
+            if item not in (self.image_item, self.selection_item) and item.parentItem() is None:
+                self.scene.removeItem(item)
+
+    def fitScene(self):
+        # refit only when the image size changes, so repaints of small edits stay small
+        # and the user's zoom survives them
+        rect = self.image_item.sceneBoundingRect()
+        if rect != self.scene.sceneRect():
+            self.scene.setSceneRect(rect)
+            self.view.fit_item(self.image_item)
+            # a selection made on the old size doesn't mean anything any more
+            self.clearSelection()
+
+    def handle_selection(self, rect):
+        # called by GraphicsView with the selected QRect in scene (= image) coordinates
+        if not self.editor.image:
+            return
+        width, height = self.editor.image.size
+        box = (max(0, rect.left()), max(0, rect.top()),
+               min(width, rect.right() + 1), min(height, rect.bottom() + 1))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            self.clearSelection()
+            return
+        logging.debug("selection: %s", box)
+        self.selection = box
+        if self.selection_item is None:
+            self.selection_item = QGraphicsRectItem()
+            pen = QPen(QColor(66, 133, 244), 0, Qt.PenStyle.DashLine)  # width 0: one device pixel at any zoom
+            self.selection_item.setPen(pen)
+            self.selection_item.setZValue(1)
+            self.scene.addItem(self.selection_item)
+        self.selection_item.setRect(box[0], box[1], box[2] - box[0], box[3] - box[1])
+        self.status_bar.showMessage(f"Selection {box[2] - box[0]}x{box[3] - box[1]} at {box[0]}, {box[1]}")
+
+    def clearSelection(self):
+        self.selection = None
+        if self.selection_item is not None:
+            self.scene.removeItem(self.selection_item)
+            self.selection_item = None
+            self.status_bar.clearMessage()
+
+    def cropToSelection(self):
+        if self.selection is None:
+            QMessageBox.warning(self, "No Selection", "Select a region first (Edit > Selection)")
+            return
+        box = self.selection
+        self.clearSelection()
+        self.applyOperation("crop", box=box)
+
+    def fitToWindow(self):
+        if self.image_item.buffer is not None:
+            self.view.fit_item(self.image_item)
+
+    def actualSize(self):
+        self.view.resetTransform()
+        self.view.fit_to_window = False
+
+    def previewSize(self):
+        # viewport size in device pixels, the resolution previews are rendered at
+        ratio = self.view.devicePixelRatioF()
+        size = self.view.viewport().size()
+        return max(1, int(size.width() * ratio)), max(1, int(size.height() * ratio))
+
+    def applyOperation(self, op: str, key=None, **kwargs):
+        """
+        Progressive edit: the operation is first run on a viewport-sized proxy and shown
+        right away, then applied to the full-resolution image on a worker thread
+        (see EditQueue). The full result replaces the preview when it's ready.
+        """
+        self.preview_renderer.cancel()
+        self.edit_queue.submit(op, kwargs, key)
+        self.status_progress.show()
+        self.cancel_button.show()
+        self.update_undo_redo_actions()
+        self.showPreview()
+
+    def showPreview(self):
+        # preview of the running operation plus everything queued behind it, rendered on the
+        # worker pool: decoding or building the proxy would otherwise stall the GUI
+        self.preview_renderer.request(self.edit_queue.operations(), self.previewSize())
+
+    def showLivePreview(self, op: str, **kwargs):
+        # preview op on top of the pending edits without touching the image or history
+        self.preview_renderer.request(self.edit_queue.operations() + [(op, kwargs)], self.previewSize())
+
+    def endLivePreview(self):
+        self.preview_renderer.cancel()
+        if self.edit_queue.busy:
+            self.showPreview()
+        elif self.display_buffer.pixels is not None:
+            self.showRegion(None)
+
+    def onLivePreviewReady(self, region, factor):
+        self.showPreviewRegion(region, factor)
+
+    def onEditProgress(self, percent, message):
+        self.status_progress.setValue(percent)
+        self.status_progress.setFormat(f"{message} %p%")
+
+    def onEditDone(self):
+        if self.save_worker is None:
+            self.status_progress.hide()
+            self.cancel_button.hide()
+        self.update_undo_redo_actions()
+        self.governor.enforce()
+
+    def onEditFinished(self, region):
+        # a preview still in flight would paint over the finished image
+        self.preview_renderer.cancel()
+        self.showRegion(region)
+        self.onEditDone()
+
+    def onEditFailed(self, message):
+        self.preview_renderer.cancel()
+        QMessageBox.warning(self, "Error", f"Edit failed: {message}")
+        self.renderImage()
+        self.onEditDone()
+
+    def onEditCancelled(self):
+        self.preview_renderer.cancel()
+        logging.debug("edit cancelled, showing rolled back image")
+        self.renderImage()
+        self.onEditDone()
+
     def resizeEvent(self, event):
         super().resizeEvent(event)
-        if self.image_item is not None and  not self.image_item.pixmap().isNull():
-            self.view.fitInView(self.image_item, Qt.AspectRatioMode.KeepAspectRatio)
+        if self.image_item.buffer is not None and self.view.fit_to_window:
+            self.view.fit_item(self.image_item)
 
     def showResizeForm(self):
         if not self.editor.image:
@@ -203,29 +608,169 @@ class MainWindow(QtWidgets.QMainWindow):
             QMessageBox.warning(self, "Error", "Invalid width or height")
             return
 
-        self.editor.resize(w, h)
-        self.renderImage()
         form.close()
+        self.applyOperation("resize", width=w, height=h, resample=form.resample, reducing_gap=form.reducing_gap)
 
     def initStatusbar(self):
         self.status_bar = self.statusBar()
         self.path_label = QLabel("Image not loaded")
         self.status_bar.addPermanentWidget(self.path_label)
+        self.status_progress = QProgressBar()
+        self.status_progress.setMaximumWidth(200)
+        self.status_progress.hide()
+        self.status_bar.addPermanentWidget(self.status_progress)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancelJobs)
+        self.cancel_button.hide()
+        self.status_bar.addPermanentWidget(self.cancel_button)
 
     def saveImage(self):
         if not self.editor.image:
             QMessageBox.warning(self, "No Image", "Open an image first")
             return
-        path, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "Images (*.png *.jpg *.jpeg *.bmp)")
+        path, _ = QFileDialog.getSaveFileName(self, "Save Image", "", "Images (*.png *.jpg *.jpeg *.bmp *.webp *.tif)")
+        if path:
+            if self.edit_queue.busy:
+                QMessageBox.warning(self, "Busy", "Wait for the running edit to finish")
+                return
+            if self.save_worker is not None:
+                QMessageBox.warning(self, "Busy", "Wait for the running save to finish")
+                return
+            self.editor.commit()
+            # encoded from a snapshot, edits made while the file is being written don't end up in it
+            image = self.editor.image.copy()
+            self.save_worker = EditWorker(self._saveJob, image, path, self.save_preset)
+            self.save_worker.signals.progress.connect(self.onSaveProgress)
+            self.save_worker.signals.finished.connect(self.onSaveFinished)
+            self.save_worker.signals.failed.connect(self.onSaveFailed)
+            self.save_worker.signals.cancelled.connect(self.onSaveDone)
+            self.status_progress.setRange(0, 0)  # encoders don't know their output size, just show activity
+            self.status_progress.show()
+            self.cancel_button.show()
+            QThreadPool.globalInstance().start(self.save_worker)
+
+    @staticmethod
+    def _saveJob(worker, image, path, preset):
+        # runs on the thread pool, progress comes from the bytes the encoder has written
+        reported = 0
+
+        def progress(written):
+            nonlocal reported
+            worker.check_cancelled()
+            if written - reported >= SAVE_PROGRESS_STEP:
+                reported = written
+                worker.report(-1, f"saving {written / (1024 * 1024):.0f} MiB")
+
+        return save_image(image, path, preset, progress)
+
+    def onSaveProgress(self, percent, message):
+        self.status_bar.showMessage(message)
+
+    def onSaveDone(self, *args):
+        self.save_worker = None
+        self.status_progress.setRange(0, 100)
+        self.status_bar.clearMessage()
+        if not self.edit_queue.busy:
+            self.status_progress.hide()
+            self.cancel_button.hide()
+
+    def onSaveFinished(self, path):
+        self.onSaveDone()
+        QMessageBox.information(self, "Saved", f"Saved to: {path}")
+
+    def onSaveFailed(self, message):
+        self.onSaveDone()
+        QMessageBox.warning(self, "Error", f"Save failed: {message}")
+
+    def toggleRecording(self, checked):
+        if checked:
+            self.editor.start_recording()
+            self.status_bar.showMessage("Recording macro")
+            return
+        macro = self.editor.stop_recording()
+        self.status_bar.clearMessage()
+        if not macro:
+            QMessageBox.information(self, "Macro", "Nothing was recorded")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save Macro", "macro.json", "Macros (*.json)")
         if path:
-            self.editor.save(path)
-            QMessageBox.information(self, "Saved", f"Saved to: {path}")
+            try:
+                macro.save(path)
+            except OSError as e:
+                QMessageBox.warning(self, "Error", f"Could not save macro: {e}")
+
+    def replayMacro(self):
+        if self.replay_worker is not None:
+            QMessageBox.warning(self, "Busy", "A macro is already being replayed")
+            return
+        path, _ = QFileDialog.getOpenFileName(self, "Open Macro", "", "Macros (*.json *.yaml *.yml)")
+        if not path:
+            return
+        try:
+            operations = load_recipe(path)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            QMessageBox.warning(self, "Error", f"Could not read macro: {e}")
+            return
+        in_dir = QFileDialog.getExistingDirectory(self, "Images to replay the macro on")
+        if not in_dir:
+            return
+        inputs = expand_inputs([os.path.join(in_dir, pattern) for pattern in MACRO_INPUT_PATTERNS])
+        if not inputs:
+            QMessageBox.warning(self, "No Images", f"No images found in {in_dir}")
+            return
+        out_dir = QFileDialog.getExistingDirectory(self, "Folder for the results")
+        if not out_dir:
+            return
+
+        self.replay_dialog = QProgressDialog(f"Replaying macro on {len(inputs)} images", "Cancel", 0, 100, self)
+        self.replay_dialog.setWindowTitle("Macro")
+        self.replay_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        self.replay_dialog.setMinimumDuration(0)
+        self.replay_worker = EditWorker(self._replayJob, operations, inputs, out_dir)
+        self.replay_dialog.canceled.connect(self.replay_worker.cancel)
+        self.replay_worker.signals.progress.connect(self.onReplayProgress)
+        self.replay_worker.signals.finished.connect(self.onReplayFinished)
+        self.replay_worker.signals.failed.connect(self.onReplayFailed)
+        self.replay_worker.signals.cancelled.connect(self.onReplayDone)
+        QThreadPool.globalInstance().start(self.replay_worker)
+
+    @staticmethod
+    def _replayJob(worker, operations, inputs, out_dir):
+        # runs on the thread pool, the images themselves are processed by batch's process pool
+        def progress(done, total):
+            worker.check_cancelled()
+            worker.report(int(done * 100 / total), f"{done}/{total} images")
+
+        # spawned, forking a process with Qt threads running isn't safe
+        return run_batch(operations, inputs, out_dir, resume=False, progress=progress, mp_context=get_context("spawn"))
+
+    def onReplayProgress(self, percent, message):
+        self.replay_dialog.setValue(percent)
+        self.replay_dialog.setLabelText(f"Replaying macro: {message}")
+
+    def onReplayDone(self, *args):
+        self.replay_worker = None
+        self.replay_dialog.reset()
+
+    def onReplayFinished(self, stats):
+        self.onReplayDone()
+        QMessageBox.information(self, "Macro", f"Processed {stats['processed']} images "
+                                               f"({stats['failed']} failed) in {stats['seconds']:.1f}s")
+
+    def onReplayFailed(self, message):
+        self.onReplayDone()
+        QMessageBox.warning(self, "Error", f"Macro replay failed: {message}")
+
+    def cancelJobs(self):
+        self.edit_queue.cancel()
+        if self.save_worker is not None:
+            self.save_worker.cancel()
 
     # undo/redo helpers
     def update_undo_redo_actions(self):
         try:
-            can_undo = self.editor.can_undo()
-            can_redo = self.editor.can_redo()
+            can_undo = self.editor.can_undo() and not self.edit_queue.busy
+            can_redo = self.editor.can_redo() and not self.edit_queue.busy
         except Exception:
             can_undo = False
             can_redo = False
@@ -233,9 +778,13 @@ class MainWindow(QtWidgets.QMainWindow):
         self.redoAction.setEnabled(can_redo)
 
     def undo(self):
+        if self.edit_queue.busy:
+            return
         if self.editor.undo():
             self.renderImage()
 
     def redo(self):
+        if self.edit_queue.busy:
+            return
         if self.editor.redo():
             self.renderImage()
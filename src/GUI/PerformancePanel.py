@@ -0,0 +1,111 @@
+import logging
+
+from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtWidgets import (
+    QDockWidget, QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QPushButton, QTableWidget, QTableWidgetItem,
+    QHeaderView, QFileDialog, QMessageBox
+)
+
+from ..instrument import recorder
+
+REFRESH_MS = 500  # how often the table is rebuilt while visible and recording
+COLUMNS = ("Operation", "Calls", "Total ms", "Mean ms", "Max ms", "CPU ms", "Py heap peak", "Size", "Mode")
+
+
+def _format_bytes(n) -> str:
+    if n is None:
+        return ""
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+class PerformancePanel(QDockWidget):
+    # per operation timings from instrument.recorder, recording is off until the checkbox is ticked
+    def __init__(self, parent=None):
+        super().__init__("Performance", parent)
+        content = QWidget()
+        layout = QVBoxLayout(content)
+
+        controls = QHBoxLayout()
+        self.record_checkbox = QCheckBox("Record")
+        self.record_checkbox.setChecked(recorder.enabled)
+        self.record_checkbox.toggled.connect(self.on_record_toggled)
+        controls.addWidget(self.record_checkbox)
+        # tracemalloc slows every python allocation down, so it's a separate switch
+        self.alloc_checkbox = QCheckBox("Track allocations")
+        self.alloc_checkbox.setChecked(recorder.track_allocations)
+        self.alloc_checkbox.toggled.connect(self.on_record_toggled)
+        controls.addWidget(self.alloc_checkbox)
+        controls.addStretch()
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        controls.addWidget(clear_button)
+        export_button = QPushButton("Export trace")
+        export_button.clicked.connect(self.export)
+        controls.addWidget(export_button)
+        layout.addLayout(controls)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.horizontalHeaderItem(COLUMNS.index("Py heap peak")).setToolTip(
+            "Peak of Python objects and NumPy arrays (tracemalloc), PIL's pixel buffers aren't counted")
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        layout.addWidget(self.table)
+        self.setWidget(content)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(REFRESH_MS)
+        self.timer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.on_visibility_changed)
+
+    def on_record_toggled(self, _checked=None):
+        if self.record_checkbox.isChecked():
+            recorder.disable()  # so a change of the allocation switch takes effect
+            recorder.enable(allocations=self.alloc_checkbox.isChecked())
+        else:
+            recorder.disable()
+        logging.info("performance recording %s", "on" if recorder.enabled else "off")
+        self.refresh()
+
+    def on_visibility_changed(self, visible: bool):
+        # nothing to poll while hidden
+        if visible:
+            self.refresh()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def refresh(self):
+        rows = recorder.summary()
+        self.table.setRowCount(len(rows))
+        for row, s in enumerate(rows):
+            values = (
+                s["name"], str(s["count"]), f"{s['wall'] * 1e3:.1f}", f"{s['wall'] / s['count'] * 1e3:.1f}",
+                f"{s['max_wall'] * 1e3:.1f}", f"{s['cpu'] * 1e3:.1f}", _format_bytes(s["py_heap_peak"]),
+                f"{s['size'][0]}x{s['size'][1]}" if s["size"] else "", s["mode"] or "",
+            )
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(value)
+                if column:
+                    item.setTextAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+                self.table.setItem(row, column, item)
+
+    def clear(self):
+        recorder.clear()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export trace", "trace.json", "Chrome trace (*.json)")
+        if not path:
+            return
+        try:
+            recorder.export(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Could not export trace: {e}")
+            return
+        logging.info("exported %d events to %s", len(recorder.events()), path)
@@ -1,5 +1,7 @@
 import logging
-from PyQt6.QtWidgets import QDialog, QGridLayout, QLineEdit, QPushButton, QLabel
+from PyQt6.QtWidgets import QDialog, QGridLayout, QLineEdit, QPushButton, QLabel, QComboBox, QCheckBox
+
+from ..resample import DEFAULT_REDUCING_GAP, DEFAULT_RESAMPLE, RESAMPLING
 
 class ResizeForm(QDialog):
     def __init__(self, parent=None):
@@ -15,8 +17,28 @@ class ResizeForm(QDialog):
         self.height_input = QLineEdit()
         grid.addWidget(self.height_input, 1, 1)
 
+        # quality/speed trade-off, see resample.py
+        grid.addWidget(QLabel("Resampling:"), 2, 0)
+        self.resample_input = QComboBox()
+        for name in RESAMPLING:
+            self.resample_input.addItem(name.capitalize(), name)
+        self.resample_input.setCurrentIndex(list(RESAMPLING).index(DEFAULT_RESAMPLE))
+        grid.addWidget(self.resample_input, 2, 1)
+
+        self.fast_input = QCheckBox("Fast large reductions")
+        self.fast_input.setChecked(True)
+        grid.addWidget(self.fast_input, 3, 0, 1, 2)
+
         self.button = QPushButton("Resize")
-        grid.addWidget(self.button, 2, 0, 1, 2)
+        grid.addWidget(self.button, 4, 0, 1, 2)
         # noinspection PyTypeChecker
         self.setLayout(grid)
-        logging.debug("resize form initialized")
\ No newline at end of file
+        logging.debug("resize form initialized")
+
+    @property
+    def resample(self) -> str:
+        return self.resample_input.currentData()
+
+    @property
+    def reducing_gap(self) -> float | None:
+        return DEFAULT_REDUCING_GAP if self.fast_input.isChecked() else None
@@ -0,0 +1,172 @@
+import logging
+
+import numpy as np
+from PyQt6 import sip
+from PyQt6.QtCore import QRectF
+from PyQt6.QtGui import QImage, QPainter
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem
+
+from ..colorspace import convert, display_mode
+from .pyramid import TilePyramid, DEFAULT_TILE_BUDGET
+
+# PIL mode -> (QImage format, channels). Other modes are converted to the smallest of these, see colorspace.py
+_FORMATS = {
+    "L": (QImage.Format.Format_Grayscale8, 1),
+    "RGB": (QImage.Format.Format_RGB888, 3),
+    "RGBA": (QImage.Format.Format_RGBA8888, 4),
+}
+
+
+def prepare_region(image, box=None):
+    """
+    Pixels of box (the whole image when None) in display layout, as (box, array).
+    Safe to run on a worker thread; DisplayBuffer.apply() then only copies the array in.
+    Full frames get rows padded to 4 bytes so the buffer can adopt them without a copy,
+    they are read-only views of the encoded bytes.
+    """
+    full = (0, 0) + image.size
+    box = full if box is None else box
+    region = image if box == full else image.crop(box)
+    mode = display_mode(image)
+    if region.mode != mode:
+        region = convert(region, mode)
+    channels = _FORMATS[mode][1]
+    width, height = region.size
+    if box != full:
+        return box, np.asarray(region).reshape(height, width, channels)
+    # QImage wants every scanline 32-bit aligned. the raw encoder writes the padded rows
+    # itself, which is several times faster than np.asarray() plus a copy on big images.
+    # the array keeps the bytes alive, DisplayBuffer copies them only if an edit writes into them
+    stride = (width * channels + 3) & ~3
+    data = region.tobytes("raw", mode, stride)
+    storage = np.frombuffer(data, dtype=np.uint8).reshape(height, stride)
+    return box, storage[:, :width * channels].reshape(height, width, channels)
+
+
+def _adoptable(array) -> bool:
+    # rows of packed pixels starting on 4 byte boundaries. read-only memory is fine, the buffer
+    # makes its own copy before writing into it
+    channels = array.shape[2]
+    return array.strides[1:] == (channels, 1) and array.strides[0] % 4 == 0 and array.ctypes.data % 4 == 0
+
+
+def _padded(height: int, width: int, channels: int) -> np.ndarray:
+    # new writable (height, width, channels) array with rows padded to 4 bytes
+    stride = (width * channels + 3) & ~3
+    return np.empty((height, stride), dtype=np.uint8)[:, :width * channels].reshape(height, width, channels)
+
+
+class DisplayBuffer:
+    """
+    One persistent pixel buffer shared by NumPy and a QImage.
+
+    The QImage wraps the buffer memory directly, so painting never converts or copies
+    the image. Edits copy only their dirty rectangle into the buffer, and full frame
+    updates prepared on a worker are adopted as the new buffer as is. Those are read-only,
+    the first edit that only covers part of the frame copies them once.
+    """
+
+    def __init__(self):
+        self.pixels = None  # (height, width, channels) view into the row-padded storage
+        self.mode = None
+        self.qimage = QImage()
+
+    @property
+    def size(self):
+        if self.pixels is None:
+            return 0, 0
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        # row padding included
+        if self.pixels is None:
+            return 0
+        return self.pixels.strides[0] * self.pixels.shape[0]
+
+    def set_image(self, image, box=None):
+        return self.apply(*prepare_region(image, box))
+
+    def apply(self, box, array):
+        # returns the box that changed
+        x0, y0, x1, y1 = box
+        channels = array.shape[2]
+        mode = next(m for m, (_, c) in _FORMATS.items() if c == channels)
+        full = (x0, y0) == (0, 0) and (x1 - x0, y1 - y0) == (array.shape[1], array.shape[0])
+        if full and _adoptable(array):
+            # full frame from prepare_region: take its storage over instead of copying
+            self._adopt(array, mode)
+        elif full and (x1, y1) == self.size and mode == self.mode:
+            if not self.pixels.flags.writeable:
+                self._adopt(_padded(*array.shape), mode)
+            self.pixels[...] = array
+        elif self.pixels is not None and mode == self.mode:
+            if not self.pixels.flags.writeable:
+                pixels = _padded(*self.pixels.shape)
+                pixels[...] = self.pixels
+                self._adopt(pixels, mode)
+            self.pixels[y0:y1, x0:x1] = array
+        else:
+            raise ValueError(f"region {box} doesn't fit the display buffer {self.size}")
+        return box
+
+    def _adopt(self, pixels, mode):
+        height, width = pixels.shape[:2]
+        self.pixels = pixels
+        self.mode = mode
+        # QImage keeps a pointer, self.pixels keeps the memory alive
+        self.qimage = QImage(sip.voidptr(pixels.ctypes.data), width, height, pixels.strides[0], _FORMATS[mode][0])
+        logging.debug("display buffer adopted %dx%d %s", width, height, mode)
+
+
+class ImageCanvasItem(QGraphicsItem):
+    """
+    Paints a DisplayBuffer straight from its QImage, without a QPixmap in between.
+    update_region() repaints just the rectangle an edit touched.
+    A scale < 1 buffer (a preview proxy) is drawn scaled up so scene coordinates
+    stay in full-resolution image pixels.
+
+    Zoomed out, the buffer is drawn from a TilePyramid level matching the view
+    scale, and only the tiles in the exposed area, so panning and zooming a huge
+    image never rescales the whole of it.
+    """
+
+    def __init__(self, parent=None, tile_budget: int = DEFAULT_TILE_BUDGET):
+        super().__init__(parent)
+        self.buffer = None
+        self.pyramid = TilePyramid(tile_budget)
+        self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def set_buffer(self, buffer: DisplayBuffer, factor: float = 1.0):
+        self.prepareGeometryChange()
+        self.buffer = buffer
+        self.pyramid.reset(None)
+        self.setScale(1 / factor)
+        self.update()
+
+    def update_region(self, box):
+        x0, y0, x1, y1 = box
+        self.pyramid.invalidate(box)
+        self.update(QRectF(x0, y0, x1 - x0, y1 - y0))
+
+    def boundingRect(self):
+        width, height = self.buffer.size if self.buffer else (0, 0)
+        return QRectF(0, 0, width, height)
+
+    def paint(self, painter, option: QStyleOptionGraphicsItem, widget=None):
+        if self.buffer is None or self.buffer.qimage.isNull():
+            return
+        if self.pyramid.source is not self.buffer.qimage:
+            # the buffer adopted a new frame
+            self.pyramid.reset(self.buffer.qimage)
+        rect = option.exposedRect.intersected(self.boundingRect())
+        # buffer pixels per device pixel
+        scale = QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        level = self.pyramid.level_for(scale)
+        # smooth when scaling down, sharp pixels when zoomed in
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, scale < 1.0)
+        if level == 0:
+            painter.drawImage(rect, self.buffer.qimage, rect)
+            return
+        for area, tile in self.pyramid.visible(level, rect):
+            painter.drawImage(QRectF(area), tile)
@@ -0,0 +1,35 @@
+from ..documents import Document
+from ..tools import Editor
+from .display import DisplayBuffer
+from .worker import EditQueue, PreviewRenderer
+
+
+class DocumentTab(Document):
+    # one open image in the window: its editor, the workers editing it and what's on screen for it
+    def __init__(self, parent=None, editor: Editor = None):
+        super().__init__(editor or Editor(parallel=True))
+        self.edit_queue = EditQueue(self.editor, parent=parent)
+        self.preview_renderer = PreviewRenderer(self.editor, parent=parent)
+        # the full resolution image and the current proxy preview, painted directly by MainWindow.image_item
+        self.display_buffer = DisplayBuffer()
+        self.preview_buffer = DisplayBuffer()
+        # the view's zoom and scroll position while another tab is shown, None to fit
+        self.transform = None
+        self.scroll = (0, 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.editor.nbytes + self.display_buffer.nbytes + self.preview_buffer.nbytes
+
+    @property
+    def busy(self) -> bool:
+        return self.edit_queue.busy
+
+    def hibernate(self) -> int:
+        freed = self.editor.hibernate()
+        if freed:
+            # rebuilt from the reloaded pixels when the tab is shown again
+            freed += self.display_buffer.nbytes + self.preview_buffer.nbytes
+            self.display_buffer = DisplayBuffer()
+            self.preview_buffer = DisplayBuffer()
+        return freed
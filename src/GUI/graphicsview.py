@@ -1,8 +1,12 @@
 from PyQt6.QtWidgets import QRubberBand, QGraphicsView, QGraphicsTextItem
-from PyQt6.QtCore import QRect, QPoint, Qt
+from PyQt6.QtCore import QRect, QPoint, QSize, Qt
 from PyQt6.QtGui import QCursor, QColor, QFont
 import logging
 
+# zoom factor per wheel notch, and how far in/out the view may go
+ZOOM_STEP = 1.25
+MIN_ZOOM = 0.01
+MAX_ZOOM = 32.0
 
 class GraphicsView(QGraphicsView):
     def __init__(self, scene, parent=None):
@@ -14,11 +18,19 @@ class GraphicsView(QGraphicsView):
         self.placing_text = None
         self.place_text_font = None
         self.text_color = QColor(230,230,230)
+        # wheel zoom keeps the point under the cursor fixed, left drag pans
+        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+        self.setResizeAnchor(QGraphicsView.ViewportAnchor.AnchorViewCenter)
+        self.setDragMode(QGraphicsView.DragMode.ScrollHandDrag)
+        self.setOptimizationFlag(QGraphicsView.OptimizationFlag.DontSavePainterState)
+        # True until the user zooms, while set the image follows the window size
+        self.fit_to_window = True
 
     def set_selection_mode(self, enabled):
         logging.debug(f"Setting selection mode to {enabled}")
         self.selection_mode = enabled
         self.setInteractive(enabled)
+        self.setDragMode(QGraphicsView.DragMode.NoDrag if enabled else QGraphicsView.DragMode.ScrollHandDrag)
         if enabled:
             self.setCursor(QCursor(Qt.CursorShape.CrossCursor))
         else:
@@ -67,9 +79,15 @@ class GraphicsView(QGraphicsView):
                             color_rgb = (r, g, b)
                         except Exception:
                             color_rgb = "white"
-                        editor.add_text(self.placing_text, (int(scene_point.x()), int(scene_point.y())), font_size, color_rgb)
-                        if hasattr(parent, "renderImage"):
-                            parent.renderImage()
+                        position = (int(scene_point.x()), int(scene_point.y()))
+                        if hasattr(parent, "applyOperation"):
+                            # runs in the background with a preview, see MainWindow.applyOperation
+                            parent.applyOperation("add_text", text=self.placing_text, position=position,
+                                                  font_size=font_size, color=color_rgb)
+                        else:
+                            editor.add_text(self.placing_text, position, font_size, color_rgb)
+                            if hasattr(parent, "renderImage"):
+                                parent.renderImage()
             except Exception:
                 pass
 
@@ -79,9 +97,36 @@ class GraphicsView(QGraphicsView):
             self.setCursor(Qt.CursorShape.ArrowCursor)
             return
 
+        if self.selection_mode and event.button() == Qt.MouseButton.LeftButton:
+            # start of a selection drag, finished in mouseReleaseEvent
+            self.origin = event.pos()
+            self.rubber_band.setGeometry(QRect(self.origin, QSize()))
+            self.rubber_band.show()
+            return
+
         # default behavior
         super().mousePressEvent(event)
 
+    def zoom(self) -> float:
+        return self.transform().m11()
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if not steps:
+            super().wheelEvent(event)
+            return
+        factor = ZOOM_STEP ** steps
+        zoom = min(max(self.zoom() * factor, MIN_ZOOM), MAX_ZOOM)
+        factor = zoom / self.zoom()
+        # only the transform changes, the canvas item redraws the visible tiles of the matching level
+        self.scale(factor, factor)
+        self.fit_to_window = False
+        event.accept()
+
+    def fit_item(self, item):
+        self.fitInView(item, Qt.AspectRatioMode.KeepAspectRatio)
+        self.fit_to_window = True
+
     def mouseMoveEvent(self, event):
         if self.selection_mode and not self.origin.isNull():
             self.rubber_band.setGeometry(QRect(self.origin, event.pos()).normalized())
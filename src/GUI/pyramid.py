@@ -0,0 +1,137 @@
+import logging
+import math
+from collections import OrderedDict
+
+from PyQt6.QtCore import QRect, QRectF, Qt
+from PyQt6.QtGui import QImage, QPainter
+
+TILE_SIZE = 256
+DEFAULT_TILE_BUDGET = 128 * 1024 * 1024  # bytes of cached tiles
+
+
+class TilePyramid:
+    """
+    Mipmapped tiles of a full-resolution QImage, for drawing it zoomed out.
+
+    Level k is the image at 1/2**k, cut into TILE_SIZE tiles. Tiles are built on
+    demand when the view first needs them: a level 1 tile is a smooth 2x downscale
+    of the source, every higher one is stitched from its four children of the level
+    below, so zooming out never rescales more than twice the tile area. Built tiles
+    are kept in an LRU capped at budget_bytes. Level 0 is the source itself and is
+    drawn directly.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_TILE_BUDGET, tile_size: int = TILE_SIZE):
+        self.budget_bytes = budget_bytes
+        self.tile_size = tile_size
+        self.source = None
+        self._tiles = OrderedDict()  # (level, tx, ty) -> QImage
+        self._bytes = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def reset(self, source: QImage | None):
+        self.source = source
+        self._tiles.clear()
+        self._bytes = 0
+
+    @property
+    def max_level(self) -> int:
+        # first level whose whole image fits in one tile
+        if self.source is None or self.source.isNull():
+            return 0
+        longest = max(self.source.width(), self.source.height())
+        return max(0, math.ceil(math.log2(longest / self.tile_size)))
+
+    def level_for(self, scale: float) -> int:
+        # finest level that is still drawn at >= 1:1, so tiles are only ever scaled down (at most 2x)
+        if scale >= 1.0:
+            return 0
+        return min(int(math.floor(math.log2(1.0 / scale))), self.max_level)
+
+    def tile_rect(self, level: int, tx: int, ty: int) -> QRect:
+        # area of the source a tile covers, in source pixels
+        span = self.tile_size << level
+        return QRect(tx * span, ty * span, span, span).intersected(self.source.rect())
+
+    def visible(self, level: int, rect: QRectF):
+        # (rect in source pixels, tile image) of every tile of level intersecting rect
+        span = self.tile_size << level
+        rect = rect.intersected(QRectF(self.source.rect()))
+        if rect.isEmpty():
+            return
+        for ty in range(int(rect.top()) // span, int(math.ceil(rect.bottom())) // span + 1):
+            for tx in range(int(rect.left()) // span, int(math.ceil(rect.right())) // span + 1):
+                area = self.tile_rect(level, tx, ty)
+                if not area.isEmpty():
+                    yield area, self.tile(level, tx, ty)
+
+    def tile(self, level: int, tx: int, ty: int) -> QImage:
+        key = (level, tx, ty)
+        image = self._tiles.get(key)
+        if image is not None:
+            self._tiles.move_to_end(key)
+            return image
+        image = self._build(level, tx, ty)
+        self._tiles[key] = image
+        self._bytes += image.sizeInBytes()
+        self._evict()
+        return image
+
+    def _build(self, level: int, tx: int, ty: int) -> QImage:
+        area = self.tile_rect(level, tx, ty)
+        width = max(1, math.ceil(area.width() / (1 << level)))
+        height = max(1, math.ceil(area.height() / (1 << level)))
+        if level == 1:
+            source = self.source.copy(area)
+        else:
+            # stitch the four children, each already half the resolution of the source area
+            child = self.tile_size
+            source = QImage(2 * child, 2 * child, _tile_format(self.source))
+            source.fill(Qt.GlobalColor.transparent)
+            painter = QPainter(source)
+            used_w = used_h = 0
+            for dy in range(2):
+                for dx in range(2):
+                    if self.tile_rect(level - 1, 2 * tx + dx, 2 * ty + dy).isEmpty():
+                        continue
+                    part = self.tile(level - 1, 2 * tx + dx, 2 * ty + dy)
+                    painter.drawImage(dx * child, dy * child, part)
+                    used_w = max(used_w, dx * child + part.width())
+                    used_h = max(used_h, dy * child + part.height())
+            painter.end()
+            source = source.copy(0, 0, used_w, used_h)
+        image = source.scaled(width, height, Qt.AspectRatioMode.IgnoreAspectRatio,
+                              Qt.TransformationMode.SmoothTransformation)
+        return image.convertToFormat(_tile_format(self.source))
+
+    def invalidate(self, box=None):
+        # drop the tiles of every level that cover box (x0, y0, x1, y1), all of them when None
+        if box is None:
+            self._tiles.clear()
+            self._bytes = 0
+            return
+        for key in [k for k in self._tiles if _covers(k, box, self.tile_size)]:
+            self._bytes -= self._tiles.pop(key).sizeInBytes()
+
+    def _evict(self):
+        while self._bytes > self.budget_bytes and len(self._tiles) > 1:
+            key, image = self._tiles.popitem(last=False)
+            self._bytes -= image.sizeInBytes()
+            logging.debug("tile pyramid evicted %s", key)
+
+
+def _tile_format(source: QImage):
+    # premultiplied 32 bit is what QPainter draws fastest
+    if source.hasAlphaChannel():
+        return QImage.Format.Format_ARGB32_Premultiplied
+    return QImage.Format.Format_RGB32
+
+
+def _covers(key, box, tile_size) -> bool:
+    level, tx, ty = key
+    span = tile_size << level
+    x0, y0, x1, y1 = box
+    return tx * span < x1 and x0 < (tx + 1) * span and ty * span < y1 and y0 < (ty + 1) * span
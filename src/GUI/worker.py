@@ -0,0 +1,260 @@
+import logging
+import threading
+import traceback
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from .display import prepare_region
+
+
+class Cancelled(Exception):
+    pass
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int, str)  # percent, message
+    finished = pyqtSignal(object)  # result of the job
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class EditWorker(QRunnable):
+    # runs fn(worker, *args, **kwargs) on a QThreadPool thread and reports back through signals.
+    # fn can call worker.report() for progress and worker.check_cancelled() between steps
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def report(self, percent: int, message: str = ""):
+        self.signals.progress.emit(percent, message)
+
+    def run(self):
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except Cancelled:
+            logging.debug("background job cancelled")
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            logging.error("background job failed: %s\n%s", e, traceback.format_exc())
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
+class EditQueue(QObject):
+    """
+    Runs Editor operations off the GUI thread, one job at a time.
+
+    Operations submitted while a job runs are queued, and the whole queue is drained
+    into the next job so the image is converted and repainted once per batch instead
+    of once per operation. Only the region the batch changed (Editor.dirty_box) is
+    converted, and handed over ready for DisplayBuffer.apply(). A queued operation
+    submitted with a key is replaced by a later submission with the same key (e.g. a
+    slider firing many values).
+
+    Every operation still records its own history state. Cancelling stops before the
+    next operation and undoes the ones the job already applied, so the undo stack
+    looks as if the job never ran.
+    """
+
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(object)  # (box, array) of the changed region, None if nothing changed
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, editor, pool: QThreadPool | None = None, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.pool = pool or QThreadPool.globalInstance()
+        self._running = []  # (op, kwargs) of the current job
+        self._queued = []  # (op, kwargs, key)
+        self._worker = None
+
+    @property
+    def busy(self) -> bool:
+        return self._worker is not None
+
+    def operations(self) -> list:
+        # running and queued operations in order, as (op, kwargs)
+        return self._running + [(op, kwargs) for op, kwargs, _ in self._queued]
+
+    def submit(self, op: str, kwargs: dict, key=None):
+        if key is not None and self._queued and self._queued[-1][2] == key:
+            logging.debug("coalescing queued %s into %s", self._queued[-1][0], op)
+            self._queued[-1] = (op, kwargs, key)
+        else:
+            self._queued.append((op, kwargs, key))
+        if not self.busy:
+            self._start()
+
+    def cancel(self):
+        self._queued = []
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def _start(self):
+        self._running = [(op, kwargs) for op, kwargs, _ in self._queued]
+        self._queued = []
+        self._worker = EditWorker(self._run, list(self._running))
+        self._worker.signals.progress.connect(self.progress)
+        self._worker.signals.finished.connect(self._on_finished)
+        self._worker.signals.failed.connect(self._on_failed)
+        self._worker.signals.cancelled.connect(self._on_cancelled)
+        self.pool.start(self._worker)
+
+    def _run(self, worker, operations):
+        # operations that change nothing push no state, so the rollback goes by history position
+        start = self.editor.history_position
+        try:
+            for i, (op, kwargs) in enumerate(operations):
+                worker.check_cancelled()
+                worker.report(int(i * 100 / len(operations)), f"{op} ({i + 1}/{len(operations)})")
+                # not under edit_lock, the editor publishes each finished state for previews itself
+                getattr(self.editor, op)(**kwargs)
+            # a cancel that arrived during the last operation still counts
+            worker.check_cancelled()
+        except Exception:
+            self._rollback(start)
+            raise
+        worker.report(100, "rendering")
+        # peek only: if more operations were queued meanwhile this result is dropped and the
+        # next job converts the union of both dirty regions
+        box = self.editor.dirty_box
+        return prepare_region(self.editor.display_image(), box) if box else None
+
+    def _rollback(self, position: int):
+        # back to the state before the job. the redo entries that leaves are the job's own
+        # operations, anything redoable from before was already dropped by their pushes
+        if self.editor.history_position <= position:
+            return
+        while self.editor.history_position > position and self.editor.undo():
+            pass
+        self.editor.discard_redo()
+
+    def _done(self):
+        self._worker = None
+        self._running = []
+
+    def _on_finished(self, region):
+        self._done()
+        if self._queued:
+            self._start()
+            return
+        self.editor.take_dirty_box()
+        self.finished.emit(region)
+
+    def _on_failed(self, message):
+        self._done()
+        self._queued = []
+        self.failed.emit(message)
+
+    def _on_cancelled(self):
+        self._done()
+        self.cancelled.emit()
+        # operations submitted after cancel() still run
+        if self._queued:
+            self._start()
+
+
+class PreviewRenderer(QObject):
+    """
+    Renders throwaway previews of operations on the editor's downscaled proxy.
+
+    Only one render runs at a time. A request arriving while one is in flight
+    replaces any request still waiting, and results of renders that went stale
+    in the meantime are dropped, so a dragged slider only ever shows its latest value.
+    Nothing here touches the editor image or history.
+
+    request_opened() shows a just opened image the same way, with each of the
+    Editor.quick_previews as it comes in.
+    """
+
+    # (box, array) from prepare_region, factor (preview size / full size)
+    ready = pyqtSignal(object, float)
+    _partial = pyqtSignal(object)  # (generation, region, factor), emitted on the worker thread
+
+    def __init__(self, editor, pool: QThreadPool | None = None, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.pool = pool or QThreadPool.globalInstance()
+        self._generation = 0
+        self._worker = None
+        self._waiting = None  # (generation, operations or None for the quick previews, max_size)
+        self._partial.connect(self._on_partial)
+
+    def request(self, operations: list, max_size):
+        self._queue(list(operations), max_size)
+
+    def request_opened(self, max_size):
+        self._queue(None, max_size)
+
+    def _queue(self, operations, max_size):
+        self._generation += 1
+        self._waiting = (self._generation, operations, tuple(max_size))
+        if self._worker is None:
+            self._start()
+
+    def cancel(self):
+        # drop the waiting request and whatever is in flight
+        self._generation += 1
+        self._waiting = None
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def _start(self):
+        generation, operations, max_size = self._waiting
+        self._waiting = None
+        self._worker = EditWorker(self._render, generation, operations, max_size)
+        self._worker.signals.finished.connect(self._on_finished)
+        self._worker.signals.failed.connect(self._on_done)
+        self._worker.signals.cancelled.connect(self._on_done)
+        self.pool.start(self._worker)
+
+    def _render(self, worker, generation, operations, max_size):
+        def check():
+            # a newer request makes this render stale, stop between operations
+            # instead of finishing it
+            if generation != self._generation:
+                raise Cancelled()
+            worker.check_cancelled()
+
+        if operations is None:
+            # each one is better than the last, show them as they come instead of the best only
+            for image, factor in self.editor.quick_previews(max_size):
+                check()
+                self._partial.emit((generation, prepare_region(image), factor))
+            return generation, None, 1.0
+        image, factor = self.editor.render_preview(operations, max_size, check)
+        check()
+        return generation, prepare_region(image) if image is not None else None, factor
+
+    def _on_finished(self, result):
+        generation, region, factor = result
+        if generation == self._generation and region is not None:
+            self.ready.emit(region, factor)
+        self._on_done()
+
+    def _on_partial(self, result):
+        generation, region, factor = result
+        if generation == self._generation:
+            self.ready.emit(region, factor)
+
+    def _on_done(self, *args):
+        self._worker = None
+        if self._waiting is not None:
+            self._start()
@@ -0,0 +1,340 @@
+"""
+Headless batch processing: applies one operation recipe to many images.
+
+    python -m src.batch recipe.json "photos/**/*.jpg" -o out/ --format png
+
+A recipe is a JSON or YAML file with a list of operations named after the
+Editor methods, using the same argument names:
+
+    {"operations": [
+        {"op": "resize", "width": 800, "height": 600},
+        {"op": "apply_blur", "intensity": 2},
+        {"op": "apply_filter", "filter_name": "sharpen"},
+        {"op": "apply_blur", "intensity": 8, "box": [0, 0, 200, 100]},
+        {"op": "add_text", "text": "(c) me", "position": [10, 10], "font_size": 24, "color": "white"}
+    ]}
+
+Outputs are encoded with the --preset speed/size trade-off (see saving.py), on a
+thread that overlaps with processing the next file. With --cache-dir, results of
+earlier runs of the same (or a prefix of the same) recipe are reused, see resultcache.py.
+Macros recorded in the GUI (see macro.py) are recipes too: steps marked "relative"
+give positions as fractions of the image size, resolved per image.
+
+--thumbnails 1024 256 64 writes a ladder of thumbnails of every result instead,
+named photo_1024.jpg etc., all made in one pass (see resample.ladder).
+
+Nothing in here imports Qt. Finished inputs are appended to a journal in the
+output dir, so re-running the same command after a crash skips them.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from .macro import to_absolute
+from .resultcache import DEFAULT_CACHE_BUDGET, ResultCache, cacheable, chain_keys, image_key
+from .saving import PRESETS, save_image
+from .tools import Editor
+
+# Editor methods a recipe may call
+OPERATIONS = ("resize", "crop", "apply_blur", "apply_filter", "add_text")
+DEFAULT_CHUNK_SIZE = 4
+
+
+def load_recipe(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.lower().endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("YAML recipes need PyYAML installed (pip install pyyaml)")
+        recipe = yaml.safe_load(text)
+    else:
+        recipe = json.loads(text)
+    # a bare list of operations is accepted as well
+    operations = recipe["operations"] if isinstance(recipe, dict) else recipe
+    return validate_operations(operations)
+
+
+def validate_operations(operations) -> list:
+    if not isinstance(operations, list):
+        raise ValueError("recipe operations must be a list")
+    for i, step in enumerate(operations):
+        if not isinstance(step, dict) or step.get("op") not in OPERATIONS:
+            raise ValueError(f"recipe step {i}: 'op' must be one of {', '.join(OPERATIONS)}")
+    return operations
+
+
+def _step_kwargs(step: dict, size=None) -> dict:
+    # size is the image size at this step, needed to resolve relative (macro) steps
+    kwargs = {k: v for k, v in step.items() if k not in ("op", "relative")}
+    for key in ("position", "box", "color"):
+        if isinstance(kwargs.get(key), list):
+            # JSON/YAML have no tuples
+            kwargs[key] = tuple(kwargs[key])
+    if step.get("relative"):
+        kwargs = to_absolute(step["op"], kwargs, size)
+    return kwargs
+
+
+def apply_operations(editor: Editor, operations: list, cache: ResultCache | None = None) -> Editor:
+    # with a cache, the longest already computed prefix of operations is loaded instead of
+    # recomputed, and the result after every remaining step is stored for later runs
+    if cache is None or editor.deferred or not cacheable(operations):
+        for step in operations:
+            getattr(editor, step["op"])(**_step_kwargs(step, editor.image.size))
+        return editor
+
+    editor.load()
+    keys = chain_keys(image_key(editor.image), operations)
+    done = cache.longest_prefix(keys)
+    cached = cache.get(keys[done - 1]) if done else None
+    if cached is not None:
+        logging.debug("result cache: reusing %d/%d operations", done, len(operations))
+        editor.set_image(cached)
+    else:
+        done = 0  # nothing cached, or evicted since longest_prefix looked
+    for step, key in zip(operations[done:], keys[done:]):
+        getattr(editor, step["op"])(**_step_kwargs(step, editor.image.size))
+        cache.put(key, editor.image)
+    return editor
+
+
+_caches = {}
+
+
+def get_cache(cache_dir: str | None, budget_bytes: int = DEFAULT_CACHE_BUDGET) -> ResultCache | None:
+    # one ResultCache per worker process and dir, opening one scans the whole dir
+    if cache_dir is None:
+        return None
+    key = (cache_dir, budget_bytes)
+    if key not in _caches:
+        _caches[key] = ResultCache(cache_dir, budget_bytes)
+    return _caches[key]
+
+
+def recipe_hash(recipe) -> str:
+    # recipe is anything JSON-able: the operations, or them together with the output settings
+    normalized = json.dumps(recipe, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def expand_inputs(patterns: list) -> list:
+    paths = set()
+    for pattern in patterns:
+        paths.update(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def output_path(src: str, base_dir: str, out_dir: str, fmt: str | None) -> str:
+    # keep the directory layout below the common input dir so equal file names don't collide
+    rel = os.path.relpath(src, base_dir)
+    if fmt:
+        rel = os.path.splitext(rel)[0] + "." + fmt.lower().lstrip(".")
+    return os.path.join(out_dir, rel)
+
+
+def thumbnail_path(dst: str, size: int) -> str:
+    root, ext = os.path.splitext(dst)
+    return f"{root}_{size}{ext}"
+
+
+def render_file(src: str, dst: str, operations: list, cache: ResultCache | None = None,
+                thumbnails: list | None = None) -> tuple:
+    # decode src and apply operations. Returns ([(image, output path), ...], megapixels processed)
+    editor = Editor(history_dir=None, track_history=False)
+    editor.open(src)
+    megapixels = editor.image.width * editor.image.height / 1e6
+    apply_operations(editor, operations, cache)
+    editor.commit()
+    if thumbnails:
+        # a JPEG without operations is only decoded at the scale the biggest thumbnail needs
+        images = editor.thumbnails(thumbnails)
+        return [(image, thumbnail_path(dst, size)) for image, size in zip(images, thumbnails)], megapixels
+    return [(editor.image, dst)], megapixels
+
+
+def save_outputs(outputs: list, preset: str | None = None):
+    # save_image writes next to the target and renames, so a crash never leaves a half written output behind
+    for image, path in outputs:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        save_image(image, path, preset)
+
+
+def process_file(src: str, dst: str, operations: list, preset: str | None = None,
+                 cache: ResultCache | None = None, thumbnails: list | None = None) -> tuple:
+    # Returns (src, megapixels processed)
+    outputs, megapixels = render_file(src, dst, operations, cache, thumbnails)
+    save_outputs(outputs, preset)
+    return src, megapixels
+
+
+def process_chunk(jobs: list, operations: list, preset: str | None = None, cache_dir: str | None = None,
+                  cache_budget: int = DEFAULT_CACHE_BUDGET, thumbnails: list | None = None) -> list:
+    """
+    Runs in a worker process: renders and saves every (src, dst) of jobs.
+    The encode of one file runs on a thread while the next one is decoded and
+    processed (PIL releases the GIL in both), at most one encode is in flight so
+    no more than two images are held at once.
+    Returns [(src, megapixels, error or None), ...].
+    """
+    results = []
+    cache = get_cache(cache_dir, cache_budget)
+
+    def finish(src, megapixels, future):
+        try:
+            future.result()
+        except Exception as e:
+            return src, 0.0, str(e)
+        return src, megapixels, None
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode") as encoder:
+        in_flight = None
+        for src, dst in jobs:
+            queued = None
+            try:
+                outputs, megapixels = render_file(src, dst, operations, cache, thumbnails)
+                queued = (src, megapixels, encoder.submit(save_outputs, outputs, preset))
+            except Exception as e:
+                results.append((src, 0.0, str(e)))
+            if in_flight is not None:
+                results.append(finish(*in_flight))
+            in_flight = queued
+        if in_flight is not None:
+            results.append(finish(*in_flight))
+    return results
+
+
+class Journal:
+    # append-only list of finished inputs for one recipe, used to resume interrupted runs.
+    # settings holds everything else that changes the output files, a run with other settings
+    # starts a journal of its own
+    def __init__(self, out_dir: str, operations: list, settings: dict | None = None):
+        self.path = os.path.join(out_dir, f".batch-{recipe_hash([operations, settings or {}])}.done")
+        self.done = set()
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        os.makedirs(out_dir, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def mark(self, src: str):
+        self._file.write(src + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_batch(operations: list, inputs: list, out_dir: str, fmt: str | None = None,
+              workers: int | None = None, resume: bool = True, preset: str | None = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, cache_dir: str | None = None,
+              cache_budget: int = DEFAULT_CACHE_BUDGET, thumbnails: list | None = None, progress=None,
+              mp_context=None) -> dict:
+    # progress(done, total) is called as files finish, it may raise to stop: queued chunks are
+    # dropped, running ones finish first. mp_context picks how workers start, e.g. spawn
+    # when called from a process that has threads running (the GUI)
+    workers = workers or os.cpu_count() or 1
+    # runs of the same recipe with another format, preset or thumbnail set write other files
+    journal = Journal(out_dir, operations, {"format": fmt, "preset": preset, "thumbnails": thumbnails})
+    if not resume:
+        journal.done = set()
+    pending = [src for src in inputs if src not in journal.done]
+    skipped = len(inputs) - len(pending)
+    if skipped:
+        logging.info("resuming: skipping %d already processed files", skipped)
+    base_dir = os.path.commonpath([os.path.dirname(p) for p in inputs]) if inputs else "."
+
+    # files go to the workers in small chunks so each worker can overlap encoding with
+    # processing, but not so big that some workers sit idle at the end
+    chunk_size = max(1, min(chunk_size, math.ceil(len(pending) / workers)))
+    jobs = [(src, output_path(src, base_dir, out_dir, fmt)) for src in pending]
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+    stats = {"processed": 0, "failed": 0, "skipped": skipped, "megapixels": 0.0, "seconds": 0.0}
+    start = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+            futures = {pool.submit(process_chunk, chunk, operations, preset, cache_dir, cache_budget, thumbnails): chunk
+                       for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # the worker process itself died, every file of the chunk counts as failed
+                    results = [(src, 0.0, str(e)) for src, _ in futures[future]]
+                for src, megapixels, error in results:
+                    if error is not None:
+                        stats["failed"] += 1
+                        logging.error("failed: %s: %s", src, error)
+                        continue
+                    journal.mark(src)
+                    stats["processed"] += 1
+                    stats["megapixels"] += megapixels
+                    done = stats["processed"] + stats["failed"]
+                    if done % 100 == 0:
+                        elapsed = time.perf_counter() - start
+                        logging.info("%d/%d files, %.1f files/s", done, len(pending), stats["processed"] / elapsed)
+                if progress is not None:
+                    try:
+                        progress(stats["processed"] + stats["failed"], len(pending))
+                    except BaseException:
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise
+    finally:
+        journal.close()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.batch", description="Apply an operation recipe to many images")
+    parser.add_argument("recipe", help="JSON or YAML recipe file")
+    parser.add_argument("inputs", nargs="+", help="input files or glob patterns (** is recursive)")
+    parser.add_argument("-o", "--output-dir", required=True)
+    parser.add_argument("-f", "--format", help="output format extension, e.g. png or jpg (default: keep)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-resume", action="store_true", help="reprocess files finished in an earlier run")
+    parser.add_argument("-p", "--preset", choices=PRESETS, default=None,
+                        help="encoder speed/size trade-off (default: PIL's defaults)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="files per worker task, encoding overlaps processing within a chunk")
+    parser.add_argument("--cache-dir", default=None,
+                        help="reuse results (and shared prefixes) of earlier runs stored here")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_BUDGET // (1024 * 1024),
+                        help="cache size cap in MiB, least recently used results are evicted")
+    parser.add_argument("--thumbnails", type=int, nargs="+", default=None, metavar="SIZE",
+                        help="write thumbnails fitting SIZE x SIZE of every result instead of the result")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] - %(message)s',
+        level=logging.DEBUG if args.verbose else logging.INFO
+    )
+    operations = load_recipe(args.recipe)
+    inputs = expand_inputs(args.inputs)
+    if not inputs:
+        logging.error("no input files matched")
+        return 1
+
+    stats = run_batch(operations, inputs, args.output_dir, args.format, args.workers, not args.no_resume,
+                      args.preset, args.chunk_size, args.cache_dir, args.cache_size * 1024 * 1024, args.thumbnails)
+    seconds = max(stats["seconds"], 1e-9)
+    print(
+        f"processed {stats['processed']} files ({stats['failed']} failed, {stats['skipped']} skipped) "
+        f"in {stats['seconds']:.2f}s: {stats['processed'] / seconds:.1f} files/s, "
+        f"{stats['megapixels'] / seconds:.1f} MP/s"
+    )
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Benchmarks for Editor operations and the display path.
+
+    python -m src.bench -o before.json --sizes 1 4 16 --modes RGB L
+    python -m src.bench -o after.json --sizes 1 4 16 --modes RGB L
+    python -m src.bench compare before.json after.json
+
+Every case runs on a synthetic image made from a fixed seed, so runs on different
+commits see the same pixels. Each (size, mode) group runs in a fresh process, and
+peak RSS is measured per case where the OS allows resetting it (Linux), else it's
+the peak of the group process. Qt runs on the offscreen platform, no display needed.
+--only takes fnmatch patterns over case names, e.g. --only "apply_filter:*" "save:*".
+"""
+import argparse
+import fnmatch
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+from PIL import Image
+
+DEFAULT_SIZES = (1, 4, 16, 50, 100)  # megapixels
+DEFAULT_MODES = ("RGB", "RGBA", "L")
+DEFAULT_REPEAT = 3
+BLUR_RADII = (1, 5, 20)
+SAVE_FORMATS = ("png", "jpg", "webp", "tif", "bmp")
+SEED = 1234
+# a case that got this much slower (ratio of medians) is flagged by compare
+REGRESSION_THRESHOLD = 1.10
+
+
+def synthetic_image(megapixels: float, mode: str):
+    # 3:2 image of smooth gradients plus mild noise: compresses like a photo, not like flat colour
+    width = max(1, round((megapixels * 1e6 * 1.5) ** 0.5))
+    height = max(1, round(megapixels * 1e6 / width))
+    rng = np.random.default_rng(SEED)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    base = np.empty((height, width, 4), dtype=np.uint8)
+    noise = rng.integers(-12, 13, size=(height, width), dtype=np.int16)
+    for c, plane in enumerate((x + 0 * y, y + 0 * x, (x + y) / 2, 255 - y + 0 * x)):
+        base[:, :, c] = np.clip(plane + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(base, "RGBA").convert(mode)
+
+
+def _reset_peak_rss() -> bool:
+    # Linux only: reset VmHWM so the next reading is the peak of the next case
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss() -> int | None:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None  # windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+_app = None
+
+
+def _qt_app():
+    # to_qpixmap and the display buffer need a QGuiApplication, offscreen so it runs headless.
+    # kept in a global, Qt breaks once the python object is collected
+    global _app
+    if _app is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from PyQt6.QtWidgets import QApplication
+        _app = QApplication.instance() or QApplication([])
+    return _app
+
+
+def _editor(image):
+    from .tools import Editor
+    editor = Editor(history_dir=None)
+    editor.set_image(image.copy())
+    return editor
+
+
+def build_cases(image, workdir: str) -> list:
+    """
+    (name, setup, run) for every benchmark. setup() builds fresh state outside the
+    timing and returns the argument of run(), which is the part that is timed.
+    """
+    from .filters import FILTER_REGISTRY
+    from .resample import RESAMPLING
+    from .tools import FILTERS, Editor
+
+    cases = []
+    width, height = image.size
+
+    # JPEG has no alpha, those cases only run for RGB and L
+    jpeg_ok = image.mode in ("RGB", "L")
+    for fmt in ("png", "jpg"):
+        if fmt == "jpg" and not jpeg_ok:
+            continue
+        path = os.path.join(workdir, f"source.{fmt}")
+        image.save(path)
+        cases.append((f"open:{fmt}", lambda p=path: p, lambda p: Editor(history_dir=None).open(p)))
+        cases.append((f"load:{fmt}", lambda p=path: Editor(history_dir=None).open(p), lambda e: e.load()))
+
+    cases.append(("resize:half", lambda: _editor(image), lambda e: e.resize(width // 2, height // 2)))
+    for resample in RESAMPLING:
+        cases.append((f"resize:{resample}", lambda: _editor(image),
+                      lambda e, r=resample: e.resize(width // 8, height // 8, resample=r)))
+    cases.append(("resize:exact", lambda: _editor(image),
+                  lambda e: e.resize(width // 8, height // 8, reducing_gap=None)))
+    cases.append(("thumbnails", lambda: _editor(image), lambda e: e.thumbnails([1024, 512, 256, 128])))
+    for radius in BLUR_RADII:
+        cases.append((f"apply_blur:{radius}", lambda: _editor(image), lambda e, r=radius: e.apply_blur(r)))
+    for name in list(FILTERS) + list(FILTER_REGISTRY):
+        cases.append((f"apply_filter:{name}", lambda: _editor(image), lambda e, n=name: e.apply_filter(n)))
+    cases.append(("add_text", lambda: _editor(image),
+                  lambda e: e.add_text("Benchmark 2024", (width // 10, height // 10), font_size=max(12, height // 20))))
+
+    def edited():
+        editor = _editor(image)
+        editor.apply_filter("sharpen")
+        return editor
+
+    def undone():
+        editor = edited()
+        editor.undo()
+        return editor
+
+    cases.append(("undo", edited, lambda e: e.undo()))
+    cases.append(("redo", undone, lambda e: e.redo()))
+
+    for fmt in SAVE_FORMATS:
+        if fmt == "jpg" and not jpeg_ok:
+            continue
+        path = os.path.join(workdir, f"out.{fmt}")
+        cases.append((f"save:{fmt}", lambda: _editor(image), lambda e, p=path: e.save(p)))
+
+    def qt_editor():
+        _qt_app()
+        return _editor(image)
+
+    def display_source():
+        _qt_app()
+        return image
+
+    def display(img):
+        from .GUI.display import DisplayBuffer
+        DisplayBuffer().set_image(img)
+
+    cases.append(("to_qpixmap", qt_editor, lambda e: e.to_qpixmap()))
+    cases.append(("display:full", display_source, display))
+    return cases
+
+
+def run_group(megapixels: float, mode: str, repeat: int, only: list | None) -> list:
+    # runs in a fresh process: every case of one (size, mode), returns result dicts
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] - %(message)s', level=logging.INFO)
+    Image.MAX_IMAGE_PIXELS = None
+    image = synthetic_image(megapixels, mode)
+    results = []
+    with tempfile.TemporaryDirectory(prefix="image-editor-bench-") as workdir:
+        for name, setup, run in build_cases(image, workdir):
+            if only and not any(fnmatch.fnmatch(name, pattern) for pattern in only):
+                continue
+            result = {"case": name, "megapixels": megapixels, "mode": mode,
+                      "width": image.width, "height": image.height}
+            seconds = []
+            peak = None
+            try:
+                for _ in range(repeat):
+                    state = setup()
+                    _reset_peak_rss()
+                    start = time.perf_counter()
+                    run(state)
+                    seconds.append(time.perf_counter() - start)
+                    del state
+                    # without a per case reset this is the peak of the group process so far
+                    peak = max(peak or 0, _peak_rss() or 0) or None
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+                logging.warning("%s %sMP %s: %s", name, megapixels, mode, result["error"])
+            if seconds:
+                result.update(seconds=seconds, min=min(seconds), median=statistics.median(seconds),
+                              peak_rss_bytes=peak)
+            results.append(result)
+            logging.info("%-28s %5sMP %-5s %s", name, megapixels, mode,
+                         f"{result['median'] * 1000:10.1f} ms" if seconds else "  failed")
+    return results
+
+
+def metadata() -> dict:
+    import PIL
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run_benchmarks(sizes, modes, repeat: int = DEFAULT_REPEAT, only: list | None = None) -> dict:
+    results = []
+    # spawn, not fork, so every group starts from a clean heap and its own peak RSS
+    context = get_context("spawn")
+    for megapixels in sizes:
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results.extend(pool.submit(run_group, megapixels, mode, repeat, only).result())
+    return {"meta": metadata(), "results": results}
+
+
+def compare(before: dict, after: dict, threshold: float = REGRESSION_THRESHOLD) -> int:
+    # prints per case median ratios, returns the number of regressions
+    def index(report):
+        return {(r["case"], r["megapixels"], r["mode"]): r for r in report["results"] if "median" in r}
+
+    old, new = index(before), index(after)
+    regressions = 0
+    print(f"{'case':28} {'MP':>6} {'mode':5} {'before ms':>11} {'after ms':>11} {'ratio':>7}")
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key]["median"] / max(old[key]["median"], 1e-9)
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  slower"
+        elif ratio < 1 / threshold:
+            flag = "  faster"
+        case, megapixels, mode = key
+        print(f"{case:28} {megapixels:>6} {mode:5} {old[key]['median'] * 1000:11.1f} "
+              f"{new[key]['median'] * 1000:11.1f} {ratio:7.2f}{flag}")
+    print(f"{regressions} regressions over {threshold:.2f}x "
+          f"({before['meta'].get('commit')} -> {after['meta'].get('commit')})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] - %(message)s', level=logging.INFO)
+    if argv[:1] == ["compare"]:
+        parser = argparse.ArgumentParser(prog="python -m src.bench compare", description="Compare two benchmark runs")
+        parser.add_argument("before")
+        parser.add_argument("after")
+        parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+        args = parser.parse_args(argv[1:])
+        with open(args.before, encoding="utf-8") as f:
+            before = json.load(f)
+        with open(args.after, encoding="utf-8") as f:
+            after = json.load(f)
+        return 1 if compare(before, after, args.threshold) else 0
+
+    parser = argparse.ArgumentParser(prog="python -m src.bench", description="Benchmark Editor operations")
+    parser.add_argument("-o", "--output", required=True, help="JSON results file")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="image sizes in megapixels")
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES, help="PIL modes, e.g. RGB RGBA L")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--only", nargs="+", default=None, help="case name patterns to run")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.modes, args.repeat, args.only)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    failed = sum(1 for r in report["results"] if "error" in r)
+    print(f"{len(report['results'])} cases written to {args.output} ({failed} failed)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
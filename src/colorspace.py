@@ -0,0 +1,155 @@
+"""
+Which pixel mode an image is worked on and shown in.
+
+Images stay in the mode they were opened in for as long as that is correct, and are
+converted only at the boundary of an operation that can't handle it: a palette image
+is expanded to RGB(A) before it's blurred or resized (PIL would refuse, or fall back
+to nearest neighbour and produce garbage), a bilevel image becomes L before
+filtering, and so on. The result stays in the working mode, converting back to P or 1
+would quantize every edit.
+
+For display, modes Qt can't show directly go to the smallest mode it can: L for
+grayscale of any depth, RGB unless there is alpha. 16-bit and float images are scaled
+down to 8 bits rather than clipped.
+"""
+import logging
+
+import numpy as np
+from PIL import Image, ImageColor
+
+# modes each operation handles correctly as they are. None: any mode
+NATIVE_MODES = {
+    "crop": None,
+    # P and 1 would be resampled nearest neighbour only
+    "resize": {"L", "LA", "La", "RGB", "RGBA", "RGBa", "CMYK", "I", "I;16", "F"},
+    # high bit depth grayscale is blurred in float, see filters.blur_filter
+    "apply_blur": {"L", "LA", "La", "RGB", "RGBA", "RGBa", "CMYK", "I", "I;16", "F"},
+    # PIL kernels (FILTERS and apply_kernel). 1 would be thresholded after every pass
+    "apply_kernel": {"L", "LA", "RGB", "RGBA", "CMYK", "I", "I;16"},
+    # see filters._COLOR_BANDS
+    "array_filter": {"L", "LA", "RGB", "RGBA"},
+    # antialiased glyphs are blended in, which means nothing for palette indices
+    "add_text": {"L", "LA", "RGB", "RGBA", "CMYK", "I", "I;16", "F"},
+}
+# modes the display buffer takes as they are
+DISPLAY_MODES = ("L", "RGB", "RGBA")
+
+
+def has_alpha(image) -> bool:
+    return image.mode in ("LA", "La", "PA", "RGBA", "RGBa") or "transparency" in image.info
+
+
+def promoted_mode(image) -> str:
+    # the smallest of L, LA, RGB, RGBA that holds image without losing colour or alpha
+    mode = image.mode
+    if mode in ("L", "LA", "RGB", "RGBA"):
+        return mode
+    if mode in ("1", "I", "F") or mode.startswith("I;16"):
+        return "L"
+    if mode == "La":
+        return "LA"
+    if mode == "P":
+        palette_mode = image.palette.mode if image.palette else "RGB"
+        if palette_mode.startswith("L") and "transparency" not in image.info:
+            return "L"
+    return "RGBA" if has_alpha(image) else "RGB"
+
+
+def working_mode(image, op: str) -> str:
+    native = NATIVE_MODES[op]
+    if native is None or image.mode in native:
+        return image.mode
+    return promoted_mode(image)
+
+
+def _to_8bit(image, mode: str):
+    # high bit depth grayscale scaled into 0..255, Image.convert would clip at 255
+    pixels = np.asarray(image)
+    if image.mode == "F":
+        low, high = float(pixels.min()), float(pixels.max())
+        # [0, 1] floats are the usual convention, anything else is stretched to fit
+        if low >= 0 and high <= 1:
+            low, high = 0.0, 1.0
+        scaled = (pixels - low) * (255 / max(high - low, 1e-12))
+    elif image.mode == "I" and pixels.max() <= 255 and pixels.min() >= 0:
+        scaled = pixels
+    else:
+        # I;16 and 16-bit data in I
+        scaled = np.clip(pixels, 0, 65535) >> 8
+    gray = Image.fromarray(np.clip(scaled, 0, 255).astype(np.uint8), "L")
+    return gray.convert(mode) if mode != "L" else gray
+
+
+def ink(image, color):
+    """
+    color (a PIL color name, hex string or 8-bit (r, g, b[, a]) tuple) as a fill value for
+    image's mode. Single band modes get its luminance, 16-bit and float images scaled
+    into the range their pixels are shown from (see _to_8bit), so the text looks the
+    colour it was picked in. Plain numbers are taken to be in the image's units already.
+    """
+    if isinstance(color, (int, float)):
+        return color
+    if isinstance(color, str):
+        color = ImageColor.getcolor(color, "RGBA")
+    color = tuple(color)
+    rgba = color + (255,) if len(color) == 3 else color
+    if image.mode in ("I", "F") or image.mode.startswith("I;16"):
+        gray = Image.new("RGBA", (1, 1), rgba).convert("L").getpixel((0, 0))
+        if image.mode == "F":
+            low, high = image.getextrema()
+            if low >= 0 and high <= 1:
+                low, high = 0.0, 1.0
+            return low + gray / 255 * (high - low)
+        if image.mode == "I":
+            low, high = image.getextrema()
+            if low >= 0 and high <= 255:
+                return gray
+        return gray * 257
+    return Image.new("RGBA", (1, 1), rgba).convert(image.mode).getpixel((0, 0))
+
+
+def convert(image, mode: str):
+    if image.mode == mode:
+        return image
+    if image.mode in ("I", "F") or image.mode.startswith("I;16"):
+        return _to_8bit(image, mode)
+    return image.convert(mode)
+
+
+def to_working(image, op: str):
+    # image in the mode op should run in, image itself when it already is
+    mode = working_mode(image, op)
+    if mode == image.mode:
+        return image
+    logging.debug("%s: converting %s to %s", op, image.mode, mode)
+    return convert(image, mode)
+
+
+def display_mode(image) -> str:
+    if image.mode in DISPLAY_MODES:
+        return image.mode
+    mode = promoted_mode(image)
+    # Qt has no grayscale + alpha format
+    return "RGBA" if mode == "LA" else mode
+
+
+class DisplayCache:
+    # the image converted for display, kept until the editor's revision changes.
+    # images already in a display mode are returned as they are, nothing is held
+    def __init__(self):
+        self._key = None
+        self._image = None
+
+    def get(self, image, revision: int):
+        mode = display_mode(image)
+        if mode == image.mode:
+            return image
+        key = (id(image), revision, mode)
+        if key != self._key:
+            self._image = convert(image, mode)
+            self._key = key
+        return self._image
+
+    def clear(self):
+        self._key = None
+        self._image = None
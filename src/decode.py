@@ -0,0 +1,64 @@
+"""
+Cheap looks at an image file before (or instead of) decoding it in full.
+
+JPEGs carry a small EXIF thumbnail that can be shown right away, and libjpeg can
+decode at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients (PIL's draft
+mode), which is several times faster than a full decode plus a downscale.
+Other formats have neither and return nothing here.
+"""
+import io
+import logging
+
+from PIL import ExifTags, Image
+
+# EXIF IFD1 tags locating the embedded JPEG thumbnail
+_THUMBNAIL_OFFSET = 0x0201
+_THUMBNAIL_LENGTH = 0x0202
+
+
+def exif_thumbnail(image):
+    # the embedded EXIF thumbnail of an opened (not yet decoded) image, or None
+    raw = image.info.get("exif")
+    if not raw:
+        return None
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1.get(_THUMBNAIL_OFFSET), ifd1.get(_THUMBNAIL_LENGTH)
+        if not offset or not length:
+            return None
+        # offsets count from the TIFF header, which follows the 6 byte "Exif\0\0" marker
+        start = offset + 6 if raw.startswith(b"Exif\x00\x00") else offset
+        thumbnail = Image.open(io.BytesIO(raw[start:start + length]))
+        thumbnail.load()
+    except Exception as e:
+        logging.debug("no usable exif thumbnail: %s", e)
+        return None
+    return thumbnail
+
+
+def draft_decode(image, max_size):
+    # an opened JPEG decoded in place at the smallest DCT scale still covering max_size, or None
+    # for other formats. the caller owns image and closes it
+    if image.format != "JPEG":
+        return None
+    mode = "L" if image.mode == "L" else "RGB"
+    image.draft(mode, tuple(max_size))
+    image.load()
+    return image
+
+
+def quick_previews(path: str, full_size, max_size):
+    """
+    Yields (image, factor) previews of the file at path, each better than the last:
+    the EXIF thumbnail, then a draft decode. factor is preview width / full width,
+    as in Editor.render_preview. Yields nothing for formats without a fast path.
+    """
+    # one open for both, leaving the with block closes the file but keeps decoded pixels
+    with Image.open(path) as image:
+        thumbnail = exif_thumbnail(image)
+        if thumbnail is not None:
+            yield thumbnail, thumbnail.width / full_size[0]
+        draft = draft_decode(image, max_size)
+    if draft is not None:
+        logging.debug("draft decoded %s at %s", path, draft.size)
+        yield draft, draft.width / full_size[0]
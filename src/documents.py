@@ -0,0 +1,90 @@
+"""
+Several open images sharing one memory budget.
+
+Every Document owns an Editor with its own history. The MemoryGovernor adds up what
+all of them hold in RAM and, once that is over budget, frees memory of the least
+recently used documents first: their undo history moves to the scratch dir, then
+their pixels (Editor.hibernate). The active document is never touched and recently
+used ones go last, so switching back to them stays instant. A hibernated document
+comes back on its next load(), like a freshly opened file.
+"""
+import logging
+import os
+
+DEFAULT_MEMORY_BUDGET = 2 * 1024 * 1024 * 1024  # bytes of pixels and history across all documents
+
+
+class Document:
+    def __init__(self, editor, title: str = None):
+        self.editor = editor
+        self._title = title
+
+    @property
+    def title(self) -> str:
+        if self._title:
+            return self._title
+        return os.path.basename(self.editor.path) if self.editor.path else "Untitled"
+
+    @property
+    def nbytes(self) -> int:
+        return self.editor.nbytes
+
+    @property
+    def busy(self) -> bool:
+        # documents with work in flight are left alone
+        return False
+
+    def release_history(self) -> int:
+        return self.editor.release_history()
+
+    def hibernate(self) -> int:
+        return self.editor.hibernate()
+
+
+class MemoryGovernor:
+    def __init__(self, budget_bytes: int = DEFAULT_MEMORY_BUDGET):
+        self.budget_bytes = budget_bytes
+        # least recently used first, the active document is the last one
+        self._documents = []
+
+    @property
+    def documents(self) -> list:
+        return list(self._documents)
+
+    @property
+    def active(self):
+        return self._documents[-1] if self._documents else None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(doc.nbytes for doc in self._documents)
+
+    def add(self, doc):
+        self._documents.append(doc)
+
+    def remove(self, doc):
+        if doc in self._documents:
+            self._documents.remove(doc)
+
+    def touch(self, doc):
+        # doc became the active document
+        self.remove(doc)
+        self._documents.append(doc)
+
+    def enforce(self) -> int:
+        # free memory of inactive documents until the total fits the budget, returns the bytes freed
+        total = self.nbytes
+        if total <= self.budget_bytes:
+            return 0
+        freed = 0
+        for doc in self._documents[:-1]:
+            if doc.busy:
+                continue
+            # history first, it's the cheaper one to do without
+            for release in (doc.release_history, doc.hibernate):
+                if total - freed <= self.budget_bytes:
+                    break
+                freed += release()
+        logging.debug("memory governor: %d of %d bytes over budget, freed %d",
+                      total - self.budget_bytes, self.budget_bytes, freed)
+        return freed
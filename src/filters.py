@@ -0,0 +1,345 @@
+"""
+Registry of NumPy-backed filters, applied through Editor.apply_filter(name, **params).
+
+Filters work on float32 arrays of shape (height, width, channels) and never loop
+over pixels in Python: blurs are separable 1D passes, the box blur uses an integral
+image so its cost doesn't depend on the radius, and tone filters are lookup tables.
+Lookup table filters take the uint8 pixels as they are, and filters PIL has in C
+(median) run through PIL on 8-bit images, their array version stays for float data.
+Alpha is carried through untouched, except by the blurs which treat it like any
+other channel (same as PIL's GaussianBlur).
+
+New filters register themselves with the @register_filter decorator.
+"""
+import math
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+# modes the array filters understand, and which of their bands are colour (not alpha)
+_COLOR_BANDS = {"L": 1, "LA": 1, "RGB": 3, "RGBA": 3}
+# modes Image.frombuffer can wrap without copying
+_ZERO_COPY_MODES = ("L", "RGBA")
+# high bit depth modes FloatGaussianBlur handles, PIL only blurs 8-bit images
+_FLOAT_BLUR_MODES = ("I", "I;16", "F")
+
+
+class Param:
+    # a numeric filter parameter, the GUI builds a slider from it
+    def __init__(self, name: str, default, minimum, maximum, step=1, spatial: bool = False, label: str = None):
+        self.name = name
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        # spatial params are sizes in pixels, previews on a downscaled proxy scale them
+        self.spatial = spatial
+        self.label = label or name.replace("_", " ").capitalize()
+
+
+class FilterSpec:
+    def __init__(self, name: str, fn, params=(), halo=None, color_only: bool = False, extra=(),
+                 uint8: bool = False, native=None):
+        self.name = name
+        self.fn = fn  # fn(array, **params) -> array
+        # uint8 filters get the 8-bit pixels instead of a float32 copy
+        self.uint8 = uint8
+        # native(image, **params) -> image does the same on a PIL image, used for 8-bit images
+        self.native = native
+        self.params = tuple(params)
+        # keyword arguments that aren't sliders (e.g. curve points), accepted from code and recipes
+        self.extra = tuple(extra)
+        self._halo = halo  # halo(**params) -> rows of context needed, for strip/band processing
+        # color_only filters leave alpha as it is
+        self.color_only = color_only
+
+    def defaults(self) -> dict:
+        return {p.name: p.default for p in self.params}
+
+    def halo(self, **params) -> int:
+        if self._halo is None:
+            return 0
+        return self._halo(**{**self.defaults(), **params})
+
+
+FILTER_REGISTRY = {}
+
+
+def register_filter(name: str, params=(), halo=None, color_only: bool = False, extra=(), uint8: bool = False,
+                    native=None):
+    def decorator(fn):
+        FILTER_REGISTRY[name] = FilterSpec(name, fn, params, halo, color_only, extra, uint8, native)
+        return fn
+    return decorator
+
+
+def to_array(image, dtype=np.float32) -> np.ndarray:
+    # (height, width, channels) copy of the pixels, float32 unless asked for uint8
+    if image.mode not in _COLOR_BANDS:
+        raise ValueError(f"array filters don't support {image.mode} images")
+    array = np.asarray(image, dtype=dtype)
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    return array
+
+
+def from_array(array: np.ndarray, mode: str):
+    # round back to 8 bit. L and RGBA buffers are wrapped without another copy
+    if array.dtype == np.uint8:
+        data = array
+    else:
+        data = np.clip(np.rint(array), 0, 255).astype(np.uint8)
+    if data.shape[2] == 1:
+        data = data[:, :, 0]
+    data = np.ascontiguousarray(data)
+    height, width = data.shape[:2]
+    if mode in _ZERO_COPY_MODES:
+        # PIL marks these read-only and copies on the first in place edit (e.g. add_text)
+        return Image.frombuffer(mode, (width, height), data, "raw", mode, 0, 1)
+    return Image.fromarray(data, mode)
+
+
+class ArrayFilter:
+    """
+    A registered filter bound to its parameters. Has the same halo/apply surface
+    the strip and band code uses for PIL filters (see tiled.run_filter).
+    """
+
+    def __init__(self, name: str, **params):
+        if name not in FILTER_REGISTRY:
+            raise ValueError(f"unknown filter: {name}")
+        self.spec = FILTER_REGISTRY[name]
+        unknown = set(params) - {p.name for p in self.spec.params} - set(self.spec.extra)
+        if unknown:
+            raise ValueError(f"{name} has no parameters {', '.join(sorted(unknown))}")
+        self.params = {**self.spec.defaults(), **params}
+
+    @property
+    def halo(self) -> int:
+        return self.spec.halo(**self.params)
+
+    def apply(self, image):
+        if self.spec.native is not None and image.mode in _COLOR_BANDS:
+            return self._apply_native(image)
+        array = to_array(image, np.uint8 if self.spec.uint8 else np.float32)
+        color = _COLOR_BANDS[image.mode]
+        if self.spec.color_only and array.shape[2] > color:
+            result = array.copy()
+            result[:, :, :color] = self.spec.fn(array[:, :, :color], **self.params)
+        else:
+            result = self.spec.fn(array, **self.params)
+        return from_array(result, image.mode)
+
+    def _apply_native(self, image):
+        color = _COLOR_BANDS[image.mode]
+        if self.spec.color_only and len(image.getbands()) > color:
+            *bands, alpha = image.split()
+            filtered = self.spec.native(Image.merge("L" if color == 1 else "RGB", bands), **self.params)
+            return Image.merge(image.mode, [*filtered.split(), alpha])
+        return self.spec.native(image, **self.params)
+
+    def __repr__(self):
+        return f"ArrayFilter({self.spec.name}, {self.params})"
+
+
+class FloatGaussianBlur:
+    """
+    Gaussian blur of high bit depth grayscale (I;16, I, F) in float32, so it doesn't
+    lose the precision an 8-bit round trip would. Same halo/apply surface as ArrayFilter,
+    the result is rounded back into the source mode.
+    """
+
+    def __init__(self, radius):
+        self.radius = radius
+
+    @property
+    def halo(self) -> int:
+        return math.ceil(3 * self.radius)
+
+    def apply(self, image):
+        pixels = np.asarray(image)
+        blurred = gaussian_blur(pixels.astype(np.float32)[:, :, np.newaxis], self.radius)[:, :, 0]
+        if np.issubdtype(pixels.dtype, np.integer):
+            limits = np.iinfo(pixels.dtype)
+            blurred = np.clip(np.rint(blurred), limits.min, limits.max)
+        # same dtype (byte order included) gives back the same mode
+        return Image.fromarray(blurred.astype(pixels.dtype))
+
+    def __repr__(self):
+        return f"FloatGaussianBlur({self.radius})"
+
+
+def blur_filter(mode: str, radius):
+    # the gaussian blur filter for images of mode: float for high bit depth, PIL's for the rest
+    if mode in _FLOAT_BLUR_MODES:
+        return FloatGaussianBlur(radius)
+    return ImageFilter.GaussianBlur(radius=radius)
+
+
+# building blocks
+
+def _along(array, axis, start, length):
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(start, start + length)
+    return array[tuple(index)]
+
+
+def _pad(array, axis, before, after):
+    pad = [(0, 0)] * array.ndim
+    pad[axis] = (before, after)
+    return np.pad(array, pad, mode="edge")
+
+
+def convolve_axis(array, kernel, axis):
+    # 1D convolution along one axis with edge replication, one vectorized pass per tap
+    radius = len(kernel) // 2
+    padded = _pad(array, axis, radius, radius)
+    length = array.shape[axis]
+    out = np.zeros_like(array, dtype=np.float32)
+    for i, weight in enumerate(kernel):
+        if weight:
+            out += np.float32(weight) * _along(padded, axis, i, length)
+    return out
+
+
+def convolve_separable(array, kernel_y, kernel_x):
+    return convolve_axis(convolve_axis(array, kernel_y, 0), kernel_x, 1)
+
+
+def box_sum_axis(array, radius, axis):
+    # moving sum over 2 * radius + 1 samples from an integral image, O(1) per pixel for any radius
+    padded = _pad(array, axis, radius + 1, radius)
+    integral = np.cumsum(padded, axis=axis, dtype=np.float64)
+    length = array.shape[axis]
+    window = 2 * radius + 1
+    return (_along(integral, axis, window, length) - _along(integral, axis, 0, length)).astype(np.float32)
+
+
+def gaussian_kernel(sigma: float) -> np.ndarray:
+    radius = max(1, math.ceil(3 * sigma))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    kernel = np.exp(-(x * x) / (2 * sigma * sigma))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+def tone_lut(array, lut):
+    # apply a 256 entry lookup table to 0..255 data by indexing, no per pixel python.
+    # uint8 data is indexed as is and comes back as uint8
+    if array.dtype == np.uint8:
+        return np.clip(np.rint(lut), 0, 255).astype(np.uint8)[array]
+    index = np.clip(np.rint(array), 0, 255).astype(np.uint8)
+    return lut.astype(np.float32)[index]
+
+
+# filters
+
+@register_filter(
+    "gaussian_blur",
+    params=[Param("radius", 2.0, 0.5, 50.0, 0.5, spatial=True)],
+    halo=lambda radius: math.ceil(3 * radius),
+)
+def gaussian_blur(array, radius=2.0):
+    kernel = gaussian_kernel(radius)
+    return convolve_separable(array, kernel, kernel)
+
+
+@register_filter(
+    "box_blur",
+    params=[Param("radius", 5, 1, 200, spatial=True)],
+    halo=lambda radius: int(radius),
+)
+def box_blur(array, radius=5):
+    radius = int(radius)
+    window = 2 * radius + 1
+    return box_sum_axis(box_sum_axis(array, radius, 0), radius, 1) / np.float32(window * window)
+
+
+@register_filter(
+    "unsharp_mask",
+    params=[
+        Param("radius", 2.0, 0.5, 20.0, 0.5, spatial=True),
+        Param("amount", 1.5, 0.0, 5.0, 0.1),
+        Param("threshold", 3, 0, 255),
+    ],
+    halo=lambda radius, **_: math.ceil(3 * radius),
+    color_only=True,
+)
+def unsharp_mask(array, radius=2.0, amount=1.5, threshold=3):
+    blurred = gaussian_blur(array, radius)
+    detail = array - blurred
+    # only sharpen where the difference is above the threshold, keeps noise in flat areas down
+    mask = np.abs(detail) >= threshold
+    return array + np.float32(amount) * detail * mask
+
+
+def _median_image(image, size=3):
+    # PIL's rank filter replicates the edges too, so it gives the same result as median()
+    return image.filter(ImageFilter.MedianFilter(int(size) | 1))
+
+
+@register_filter(
+    "median",
+    params=[Param("size", 3, 3, 9, 2, spatial=True)],
+    halo=lambda size: int(size) // 2,
+    color_only=True,
+    native=_median_image,
+)
+def median(array, size=3):
+    size = int(size) | 1  # odd windows only
+    radius = size // 2
+    padded = np.pad(array, ((radius, radius), (radius, radius), (0, 0)), mode="edge")
+    out = np.empty_like(array)
+    # the window view is free, the median over it materializes size * size values per pixel,
+    # so go in row chunks to keep that bounded. the window count is odd, so the middle element
+    # after a partial sort is the median
+    windows = np.lib.stride_tricks.sliding_window_view(padded, (size, size), axis=(0, 1))
+    chunk = max(1, (16 * 1024 * 1024) // max(1, array.shape[1] * array.shape[2] * size * size))
+    middle = size * size // 2
+    for y in range(0, array.shape[0], chunk):
+        block = windows[y:y + chunk].reshape(windows[y:y + chunk].shape[:3] + (-1,))
+        out[y:y + chunk] = np.partition(block, middle, axis=-1)[..., middle]
+    return out
+
+
+@register_filter("edge_detect", halo=lambda: 1, color_only=True)
+def edge_detect(array):
+    # sobel gradient magnitude, both kernels separable
+    smooth = np.array([1, 2, 1], dtype=np.float32)
+    derive = np.array([-1, 0, 1], dtype=np.float32)
+    gx = convolve_separable(array, smooth, derive)
+    gy = convolve_separable(array, derive, smooth)
+    return np.sqrt(gx * gx + gy * gy)
+
+
+@register_filter(
+    "levels",
+    params=[
+        Param("black", 0, 0, 254),
+        Param("white", 255, 1, 255),
+        Param("gamma", 1.0, 0.1, 5.0, 0.1),
+    ],
+    color_only=True,
+    uint8=True,
+)
+def levels(array, black=0, white=255, gamma=1.0):
+    white = max(white, black + 1)
+    x = np.clip((np.arange(256, dtype=np.float64) - black) / (white - black), 0.0, 1.0)
+    return tone_lut(array, 255.0 * x ** (1.0 / gamma))
+
+
+@register_filter(
+    "curves",
+    params=[Param("contrast", 0.25, 0.0, 1.0, 0.05)],
+    color_only=True,
+    extra=("points",),
+    uint8=True,
+)
+def curves(array, contrast=0.25, points=None):
+    # points: [(input, output), ...] control points in 0..255, interpolated linearly.
+    # without points an S-curve of the given contrast is used
+    if points is None:
+        lift = 64 * contrast
+        points = [(0, 0), (64, 64 - lift), (192, 192 + lift), (255, 255)]
+    points = sorted((float(x), float(y)) for x, y in points)
+    xs, ys = zip(*points)
+    return tone_lut(array, np.interp(np.arange(256), xs, ys))
@@ -0,0 +1,150 @@
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_FONT_FAMILY = "arial"
+# tried in order when the requested family isn't installed
+FALLBACK_FAMILIES = ("arial", "helvetica", "dejavusans", "liberationsans", "freesans", "notosans", "verdana")
+FONT_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+MAX_CACHED_FONTS = 32
+MAX_CACHED_STAMPS = 256
+
+
+def font_dirs() -> list:
+    home = os.path.expanduser("~")
+    if sys.platform.startswith("win"):
+        return [os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts"),
+                os.path.join(os.environ.get("LOCALAPPDATA", home), "Microsoft", "Windows", "Fonts")]
+    if sys.platform == "darwin":
+        return ["/System/Library/Fonts", "/System/Library/Fonts/Supplemental", "/Library/Fonts",
+                os.path.join(home, "Library", "Fonts")]
+    return ["/usr/share/fonts", "/usr/local/share/fonts", os.path.join(home, ".fonts"),
+            os.path.join(home, ".local", "share", "fonts")]
+
+
+def _family_key(name: str) -> str:
+    # "DejaVu Sans", "DejaVuSans.ttf" and "dejavusans" all map to "dejavusans"
+    name = os.path.basename(name)
+    if name.lower().endswith(FONT_EXTENSIONS):
+        name = os.path.splitext(name)[0]
+    return "".join(c for c in name.lower() if c.isalnum())
+
+
+class FontManager:
+    """
+    Resolves and caches fonts for Editor.add_text.
+
+    System font dirs are scanned once. Loaded FreeTypeFont objects are kept in an
+    LRU keyed by (family, size), and rendered text masks ("stamps") in another LRU
+    keyed by (text, family, size), so stamping the same caption or watermark on many
+    images costs one masked paste per image instead of a font load and a rasterization.
+    """
+
+    def __init__(self, max_fonts: int = MAX_CACHED_FONTS, max_stamps: int = MAX_CACHED_STAMPS):
+        self.max_fonts = max_fonts
+        self.max_stamps = max_stamps
+        self._index = None  # family key -> font file path
+        self._fonts = OrderedDict()
+        self._stamps = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _scan(self) -> dict:
+        index = {}
+        for directory in font_dirs():
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.lower().endswith(FONT_EXTENSIONS):
+                        index.setdefault(_family_key(name), os.path.join(root, name))
+        logging.debug("font index: %d fonts", len(index))
+        return index
+
+    def resolve(self, family: str = DEFAULT_FONT_FAMILY) -> str | None:
+        # path of the font file for family, or of the first installed fallback
+        if os.path.isfile(family):
+            return family
+        with self._lock:
+            if self._index is None:
+                self._index = self._scan()
+            index = self._index
+        for key in (_family_key(family),) + FALLBACK_FAMILIES:
+            if key in index:
+                return index[key]
+        return None
+
+    def get_font(self, family: str = DEFAULT_FONT_FAMILY, size: int = 40):
+        key = (family, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                return font
+        path = self.resolve(family)
+        font = None
+        if path:
+            try:
+                font = ImageFont.truetype(path, size)
+            except OSError as e:
+                logging.debug("can't load font %s: %s", path, e)
+        if font is None:
+            # bundled font, honours the size on pillow >= 10.1
+            try:
+                font = ImageFont.load_default(size)
+            except TypeError:
+                font = ImageFont.load_default()
+        with self._lock:
+            self._fonts[key] = font
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+        return font
+
+    def get_stamp(self, text: str, family: str = DEFAULT_FONT_FAMILY, size: int = 40):
+        # (mask, (dx, dy)): the text rasterized as an L mask and its offset from the text origin
+        key = (text, family, size)
+        with self._lock:
+            stamp = self._stamps.get(key)
+            if stamp is not None:
+                self._stamps.move_to_end(key)
+                return stamp
+        font = self.get_font(family, size)
+        left, top, right, bottom = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+        mask = Image.new("L", (max(1, right - left), max(1, bottom - top)))
+        ImageDraw.Draw(mask).text((-left, -top), text, fill=255, font=font)
+        stamp = (mask, (left, top))
+        with self._lock:
+            self._stamps[key] = stamp
+            while len(self._stamps) > self.max_stamps:
+                self._stamps.popitem(last=False)
+        return stamp
+
+    def draw_text(self, image, position, text: str, fill, family: str = DEFAULT_FONT_FAMILY, size: int = 40):
+        # same pixels as ImageDraw.text at integer positions, but from the cached stamp.
+        # returns the box that was drawn into, clipped to the image (None if outside)
+        draw = ImageDraw.Draw(image)
+        x, y = position
+        if draw.fontmode != "L":
+            # 1/P/I/F images render glyphs without antialiasing, the L stamp doesn't apply
+            font = self.get_font(family, size)
+            draw.text(position, text, fill=fill, font=font)
+            box = draw.textbbox(position, text, font=font)
+        else:
+            mask, (dx, dy) = self.get_stamp(text, family, size)
+            x0, y0 = int(x) + dx, int(y) + dy
+            draw.bitmap((x0, y0), mask, fill=fill)
+            box = (x0, y0, x0 + mask.width, y0 + mask.height)
+        box = (max(0, int(box[0])), max(0, int(box[1])),
+               min(image.width, int(box[2]) + 1), min(image.height, int(box[3]) + 1))
+        return box if box[0] < box[2] and box[1] < box[3] else None
+
+    def clear(self):
+        with self._lock:
+            self._fonts.clear()
+            self._stamps.clear()
+
+
+# shared by every Editor in the process
+font_manager = FontManager()
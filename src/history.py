@@ -0,0 +1,377 @@
+import atexit
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+import zlib
+
+from PIL import Image, ImageChops
+
+DEFAULT_HISTORY_BUDGET = 512 * 1024 * 1024  # bytes of delta data kept in RAM for undo/redo
+DEFAULT_DISK_BUDGET = 8 * 1024 * 1024 * 1024  # bytes of delta data spilled to the scratch dir
+DEFAULT_SCRATCH_ROOT = os.path.join(tempfile.gettempdir(), "image-editor-history")
+
+# returned by _changed_box when the two states can't be diffed region-wise (size/mode/palette changed)
+_FULL_FRAME = "full"
+
+# scratch dirs of this process, removed at exit
+_live_scratch_dirs = weakref.WeakSet()
+
+
+def _changed_box(before, after):
+    # bounding box of the pixels that differ between two states.
+    # None means identical, _FULL_FRAME means the whole frame has to be stored.
+    if before.mode != after.mode or before.size != after.size:
+        return _FULL_FRAME
+    if before.mode == "P" and before.getpalette() != after.getpalette():
+        return _FULL_FRAME
+    try:
+        diff = ImageChops.difference(before, after)
+    except ValueError:
+        # modes like I;16 aren't supported by ImageChops, store the full frame instead
+        return (0, 0) + before.size
+    # fold every band into one mask, getbbox on RGBA would otherwise only look at alpha
+    bands = diff.split()
+    mask = bands[0]
+    for band in bands[1:]:
+        mask = ImageChops.lighter(mask, band)
+    return mask.getbbox()
+
+
+def image_nbytes(image) -> int:
+    # bytes PIL holds for the decoded pixels: 1, P and L take a byte per pixel, I;16 two,
+    # everything else (RGB included) is stored in 32-bit pixels
+    if image.mode in ("1", "L", "P"):
+        pixel = 1
+    elif image.mode.startswith("I;16"):
+        pixel = 2
+    else:
+        pixel = 4
+    return image.width * image.height * pixel
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill(pid, 0) would terminate the process on windows
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def cleanup_orphans(root: str = DEFAULT_SCRATCH_ROOT):
+    # remove scratch dirs left behind by editor processes that are no longer running (crashes, kills)
+    try:
+        entries = os.listdir(root)
+    except OSError:
+        return
+    for name in entries:
+        pid, _, _ = name.partition("-")
+        if not pid.isdigit() or _pid_alive(int(pid)):
+            continue
+        logging.debug("removing orphaned history scratch dir: %s", name)
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+@atexit.register
+def _cleanup_at_exit():
+    for scratch in list(_live_scratch_dirs):
+        scratch.cleanup()
+
+
+class ScratchDir:
+    # per-session directory for spilled history entries: <root>/<pid>-<token>/
+    def __init__(self, root: str = DEFAULT_SCRATCH_ROOT):
+        self.root = root
+        self.path = None
+        _live_scratch_dirs.add(self)
+
+    def new_file(self, suffix: str = ".delta") -> str:
+        if self.path is None:
+            self.path = os.path.join(self.root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+            os.makedirs(self.path, exist_ok=True)
+        return os.path.join(self.path, f"{uuid.uuid4().hex}{suffix}")
+
+    def cleanup(self):
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+class _Delta:
+    # one step of history. Holds the pixels of the "other side" of the step:
+    # before-state for undo entries, after-state for redo entries.
+    # box is None for full frame deltas (size or mode changed).
+    # data is None once the delta has been spilled to file_path.
+    __slots__ = ("box", "mode", "size", "palette", "data", "file_path", "nbytes", "tick")
+
+    def __init__(self, box, mode, size, palette, data):
+        self.box = box
+        self.mode = mode
+        self.size = size
+        self.palette = palette
+        self.data = data
+        self.file_path = None
+        self.nbytes = len(data)
+        self.tick = 0
+
+
+class HistoryStore:
+    """
+    Linear undo/redo history stored as compressed deltas.
+
+    Only the current state is kept as a full image (the anchor). Every step is a
+    delta holding the compressed pixels of the changed region, so a text stamp
+    costs a few KB instead of a full frame. Undo/redo swap the delta with the
+    anchor region in place, which turns an undo entry into a redo entry and back.
+
+    Deltas live in RAM up to budget_bytes. With a scratch dir, the least recently
+    used ones are spilled to disk beyond that, up to disk_budget_bytes, after which
+    the oldest steps are dropped.
+    """
+
+    def __init__(self, budget_bytes: int = DEFAULT_HISTORY_BUDGET, compress_level: int = 1,
+                 scratch_dir: str | None = None, disk_budget_bytes: int = DEFAULT_DISK_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self.compress_level = compress_level
+        self._scratch = ScratchDir(scratch_dir) if scratch_dir else None
+        self._anchor = None
+        # _deltas[i] is the transition between state i and i + 1
+        self._deltas = []
+        self._index = 0  # index of the current state
+        self._dropped = 0  # oldest states evicted so far, see position
+        self._bytes = 0  # resident delta bytes
+        self._disk_bytes = 0  # spilled delta bytes
+        self._tick = 0
+        # region the last undo/redo changed, None for the full frame
+        self.last_box = None
+        # suspend() dropped the anchor, resume() brings it back
+        self._suspended = False
+
+    @property
+    def nbytes(self) -> int:
+        # delta bytes held in RAM, the anchor frame is not counted
+        return self._bytes
+
+    @property
+    def disk_nbytes(self) -> int:
+        return self._disk_bytes
+
+    @property
+    def anchor_nbytes(self) -> int:
+        return image_nbytes(self._anchor) if self._anchor is not None else 0
+
+    @property
+    def position(self) -> int:
+        # number of the current state counted from the first one ever pushed. Unlike the index it
+        # doesn't move when old steps are evicted, so it can be compared across pushes
+        return self._dropped + self._index
+
+    def __len__(self):
+        # number of states in history
+        return len(self._deltas) + 1 if self._anchor is not None else 0
+
+    def reset(self, image):
+        self._suspended = False
+        self.clear()
+        if image is not None:
+            self._anchor = image.copy()
+
+    def clear(self):
+        self._anchor = None
+        self._deltas = []
+        self._index = 0
+        self._dropped = 0
+        self._bytes = 0
+        self._disk_bytes = 0
+        if self._scratch is not None:
+            self._scratch.cleanup()
+            cleanup_orphans(self._scratch.root)
+
+    def close(self):
+        self.clear()
+
+    def spill(self, keep_bytes: int = 0) -> int:
+        # move resident deltas to disk, least recently used first, until at most keep_bytes
+        # stay in RAM. Returns the bytes moved. Without a scratch dir nothing can move
+        if self._scratch is None:
+            return 0
+        before = self._bytes
+        for delta in sorted((d for d in self._deltas if d.data is not None), key=lambda d: d.tick):
+            if self._bytes <= keep_bytes:
+                break
+            self._spill(delta)
+        logging.debug("history: spilled %d bytes on request", before - self._bytes)
+        return before - self._bytes
+
+    def suspend(self) -> int:
+        # drop the anchor while the owner keeps an identical image elsewhere (e.g. on disk).
+        # nothing may be pushed, undone or redone until resume() hands it back
+        if self._anchor is None:
+            return 0
+        freed = self.anchor_nbytes
+        self._anchor = None
+        self._suspended = True
+        return freed
+
+    def resume(self, image):
+        if self._suspended:
+            self._anchor = image.copy()
+            self._suspended = False
+
+    def push(self, image, box=None) -> bool:
+        # record a new state. Returns False when nothing changed.
+        # box is a hint that only pixels inside it can have changed, so only that region is diffed
+        if image is None:
+            return False
+        if self._anchor is None:
+            self.reset(image)
+            return True
+
+        if box is not None and image.size == self._anchor.size and image.mode == self._anchor.mode:
+            inner = _changed_box(self._anchor.crop(box), image.crop(box))
+            if inner is not None and inner != _FULL_FRAME:
+                inner = (box[0] + inner[0], box[1] + inner[1], box[0] + inner[2], box[1] + inner[3])
+            box = inner
+        else:
+            box = _changed_box(self._anchor, image)
+        if box is None:
+            logging.debug("history: state unchanged, nothing pushed")
+            return False
+
+        # drop redo entries, the linear history branches here
+        self.truncate()
+
+        if box == _FULL_FRAME:
+            delta = self._encode(self._anchor, None)
+            self._anchor = image.copy()
+        else:
+            delta = self._encode(self._anchor, box)
+            self._anchor.paste(image.crop(box), box)
+        self._deltas.append(delta)
+        self._bytes += delta.nbytes
+        self._index = len(self._deltas)
+        self._evict()
+        logging.debug("history: pushed delta box=%s %d bytes, total %d bytes", delta.box, delta.nbytes, self._bytes)
+        return True
+
+    def truncate(self):
+        # drop all redo entries
+        for delta in self._deltas[self._index:]:
+            self._forget(delta)
+        del self._deltas[self._index:]
+
+    def can_undo(self) -> bool:
+        return self._index > 0
+
+    def can_redo(self) -> bool:
+        return self._index < len(self._deltas)
+
+    def undo(self):
+        # returns the previous state as a new image, or None
+        if not self.can_undo():
+            return None
+        self._index -= 1
+        self._deltas[self._index] = self._swap(self._deltas[self._index])
+        self._evict()
+        return self._anchor.copy()
+
+    def redo(self):
+        if not self.can_redo():
+            return None
+        self._deltas[self._index] = self._swap(self._deltas[self._index])
+        self._index += 1
+        self._evict()
+        return self._anchor.copy()
+
+    def _swap(self, delta):
+        # apply delta to the anchor and return the delta that reverts it
+        other = self._encode(self._anchor, delta.box)
+        restored = self._decode(delta)
+        self.last_box = delta.box
+        self._forget(delta)
+        if delta.box is None:
+            self._anchor = restored
+        else:
+            self._anchor.paste(restored, delta.box)
+        self._bytes += other.nbytes
+        return other
+
+    def _encode(self, image, box):
+        region = image if box is None else image.crop(box)
+        palette = image.getpalette() if image.mode == "P" else None
+        data = zlib.compress(region.tobytes(), self.compress_level)
+        delta = _Delta(box, region.mode, region.size, palette, data)
+        self._tick += 1
+        delta.tick = self._tick
+        return delta
+
+    def _decode(self, delta):
+        if delta.data is not None:
+            raw = zlib.decompress(delta.data)
+        else:
+            # map the spilled file instead of reading it into an intermediate bytes object
+            with open(delta.file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                raw = zlib.decompress(mapped)
+        image = Image.frombytes(delta.mode, delta.size, raw)
+        if delta.palette is not None:
+            image.putpalette(delta.palette)
+        return image
+
+    def _spill(self, delta):
+        path = self._scratch.new_file()
+        with open(path, "wb") as f:
+            f.write(delta.data)
+        delta.data = None
+        delta.file_path = path
+        self._bytes -= delta.nbytes
+        self._disk_bytes += delta.nbytes
+
+    def _forget(self, delta):
+        # release whatever a delta that is leaving the history holds
+        if delta.file_path is not None:
+            try:
+                os.remove(delta.file_path)
+            except OSError:
+                pass
+            self._disk_bytes -= delta.nbytes
+        else:
+            self._bytes -= delta.nbytes
+
+    def _evict(self):
+        if self._scratch is None:
+            over_budget = lambda: self._bytes > self.budget_bytes
+        else:
+            # spill least recently used deltas to disk while RAM is over budget
+            while self._bytes > self.budget_bytes:
+                resident = [d for d in self._deltas if d.data is not None]
+                if len(resident) <= 1:
+                    break
+                victim = min(resident, key=lambda d: d.tick)
+                self._spill(victim)
+                logging.debug("history: spilled delta to disk (%d bytes)", victim.nbytes)
+            over_budget = lambda: self._disk_bytes > self.disk_budget_bytes
+
+        # drop the oldest undo steps once nothing else fits. The newest step is always kept
+        # so a single undo works even when one delta is larger than the whole budget.
+        while self._index > 1 and over_budget():
+            delta = self._deltas.pop(0)
+            self._forget(delta)
+            self._index -= 1
+            self._dropped += 1
+            logging.debug("history: evicted oldest delta (%d bytes)", delta.nbytes)
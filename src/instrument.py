@@ -0,0 +1,149 @@
+"""
+Structured timing of Editor operations (and anything else decorated with @instrumented).
+
+Off by default: a disabled span is one attribute check before the real call. When
+enabled, every span records wall time, process CPU time, the size and mode of the
+image afterwards and, if allocation tracking is on, the peak of the Python heap
+(Python objects and NumPy arrays) during the span. That comes from tracemalloc, which
+doesn't see PIL's pixel buffers since those are allocated in C, so it is named
+py_heap_peak and is no measure of an operation's image memory. Tracking slows every
+allocation down, hence opt-in.
+
+Events go to a fixed size ring buffer, read by the GUI's Performance panel and
+exported as Chrome trace JSON (chrome://tracing, https://ui.perfetto.dev).
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+DEFAULT_CAPACITY = 4096  # events kept, older ones are dropped
+
+
+class Event:
+    __slots__ = ("name", "start", "wall", "cpu", "py_heap_peak", "size", "mode", "thread")
+
+    def __init__(self, name, start, wall, cpu, py_heap_peak, size, mode, thread):
+        self.name = name
+        self.start = start  # seconds since the recorder was created
+        self.wall = wall
+        self.cpu = cpu
+        # bytes of Python heap (not PIL's C buffers), None unless allocation tracking is on
+        self.py_heap_peak = py_heap_peak
+        self.size = size
+        self.mode = mode
+        self.thread = thread
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Recorder:
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self.enabled = False
+        self.track_allocations = False
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._started_tracemalloc = False
+
+    def enable(self, allocations: bool = False):
+        self.track_allocations = allocations
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.track_allocations = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def events(self) -> list:
+        with self._lock:
+            return list(self._events)
+
+    def span(self, name: str, fn, args, kwargs, image_of=None):
+        # run fn(*args, **kwargs) and record it. Only called while enabled
+        allocations = self.track_allocations and tracemalloc.is_tracing()
+        if allocations:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        cpu = time.process_time()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            py_heap_peak = None
+            if allocations:
+                # spans nest and threads overlap, so this is the peak of everything that ran meanwhile
+                py_heap_peak = max(0, tracemalloc.get_traced_memory()[1] - before)
+            image = image_of(args[0]) if image_of and args else None
+            size, mode = (tuple(image.size), image.mode) if image is not None else (None, None)
+            event = Event(name, start - self._origin, wall, cpu, py_heap_peak, size, mode, threading.get_ident())
+            with self._lock:
+                self._events.append(event)
+
+    def summary(self) -> list:
+        # per operation totals over the buffered events, slowest total first
+        stats = {}
+        for e in self.events():
+            s = stats.setdefault(e.name, {"name": e.name, "count": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0,
+                                          "py_heap_peak": None, "size": None, "mode": None})
+            s["count"] += 1
+            s["wall"] += e.wall
+            s["max_wall"] = max(s["max_wall"], e.wall)
+            s["cpu"] += e.cpu
+            if e.py_heap_peak is not None:
+                s["py_heap_peak"] = max(s["py_heap_peak"] or 0, e.py_heap_peak)
+            s["size"], s["mode"] = e.size, e.mode
+        return sorted(stats.values(), key=lambda s: s["wall"], reverse=True)
+
+    def to_chrome_trace(self) -> dict:
+        # "complete" (ph X) events in microseconds, nested spans show up as a flame graph per thread
+        pid = os.getpid()
+        trace = []
+        for e in self.events():
+            trace.append({
+                "name": e.name, "cat": e.name.partition(".")[0], "ph": "X", "pid": pid, "tid": e.thread,
+                "ts": round(e.start * 1e6, 3), "dur": round(e.wall * 1e6, 3),
+                "args": {"cpu_ms": round(e.cpu * 1e3, 3), "py_heap_peak": e.py_heap_peak,
+                         "size": e.size, "mode": e.mode},
+            })
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def export(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f)
+
+
+# the process wide recorder every @instrumented function reports to
+recorder = Recorder()
+
+
+def instrumented(name: str = None, image_of=None):
+    """
+    Decorator recording every call of a method while the recorder is enabled.
+    image_of(self) returns the image to report size and mode of (after the call).
+    """
+    def decorator(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not recorder.enabled:
+                return fn(*args, **kwargs)
+            return recorder.span(label, fn, args, kwargs, image_of)
+        return wrapper
+    return decorator
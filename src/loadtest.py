@@ -0,0 +1,132 @@
+"""
+Load test for the HTTP service (server.py), against a server already running on localhost.
+
+    python -m src.server -j 4 &
+    python -m src.loadtest photo.jpg --path "/resize?width=800&height=600" -c 16 -n 400
+    python -m src.loadtest photo.jpg --path "/blur?intensity=4" -c 32 -n 400 --no-cache
+
+Sends the same upload n times from c concurrent connections and reports throughput,
+latency percentiles of the successful requests and a count per status. 503s (the
+server's backpressure) are retried after their Retry-After and counted, --no-retry
+counts them as the request's result instead. Without --no-cache every request after
+the first is a response cache hit, which is the number to look at for cache
+throughput. --no-cache measures the worker pool.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+DEFAULT_URL = "http://127.0.0.1:8080"
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS = 100
+
+
+async def request(host: str, port: int, method: str, target: str, body: bytes = b"", headers: dict | None = None):
+    # (status, {lowercased header: value}, response body) of one request on its own connection
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        head = [f"{method} {target} HTTP/1.1", f"Host: {host}:{port}", f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    return int(lines[0].split()[1]), response_headers, payload
+
+
+async def run_load(url: str, path: str, body: bytes, concurrency: int, total: int, no_cache: bool = False,
+                   retry: bool = True) -> dict:
+    # with retry, a 503 is retried after its Retry-After like a well behaved client would, and the
+    # request's latency includes the wait. Without, it's counted as is
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    headers = {"Cache-Control": "no-cache"} if no_cache else None
+    latencies = []
+    statuses = Counter()
+    retried = 0
+    received = 0
+    remaining = total
+
+    async def client():
+        nonlocal remaining, received, retried
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            while True:
+                try:
+                    status, response_headers, payload = await request(host, port, "POST", path, body, headers)
+                except (ConnectionError, IndexError, ValueError) as e:
+                    status = type(e).__name__
+                    break
+                if status != 503 or not retry:
+                    break
+                retried += 1
+                await asyncio.sleep(float(response_headers.get("retry-after", 1)))
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                received += len(payload)
+
+    # fails with ConnectionRefusedError right away when there's no server
+    await request(host, port, "GET", "/stats")
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    _, _, stats = await request(host, port, "GET", "/stats")
+    return {"seconds": seconds, "latencies": latencies, "statuses": statuses, "retries": retried,
+            "received": received, "server": json.loads(stats)}
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p / 100 * (len(ordered) - 1)))]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.loadtest", description="Load test the image HTTP service")
+    parser.add_argument("image", help="file uploaded with every request")
+    parser.add_argument("--url", default=DEFAULT_URL, help="server address")
+    parser.add_argument("--path", default="/convert?format=png", help="endpoint and query string")
+    parser.add_argument("-c", "--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("-n", "--requests", type=int, default=DEFAULT_REQUESTS)
+    parser.add_argument("--no-cache", action="store_true", help="skip the server's response cache")
+    parser.add_argument("--no-retry", action="store_true", help="count 503s instead of retrying them")
+    args = parser.parse_args(argv)
+
+    with open(args.image, "rb") as f:
+        body = f.read()
+    try:
+        result = asyncio.run(run_load(args.url, args.path, body, args.concurrency, args.requests, args.no_cache,
+                                   not args.no_retry))
+    except ConnectionRefusedError:
+        print(f"no server at {args.url}, start one with python -m src.server", file=sys.stderr)
+        return 1
+
+    seconds = max(result["seconds"], 1e-9)
+    ok = result["latencies"]
+    print(f"{args.requests} requests, {args.concurrency} connections, {seconds:.2f}s: "
+          f"{len(ok) / seconds:.1f} ok/s, {result['received'] / seconds / 1e6:.1f} MB/s received")
+    print("status: " + ", ".join(f"{status} x{n}" for status, n in sorted(result["statuses"].items(), key=str))
+          + (f" ({result['retries']} retried after 503)" if result["retries"] else ""))
+    if ok:
+        print(f"latency ms: mean {statistics.mean(ok) * 1e3:.1f}, p50 {percentile(ok, 50) * 1e3:.1f}, "
+              f"p90 {percentile(ok, 90) * 1e3:.1f}, p99 {percentile(ok, 99) * 1e3:.1f}, max {max(ok) * 1e3:.1f}")
+    print("server: " + json.dumps(result["server"]))
+    return 0 if len(ok) == args.requests else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
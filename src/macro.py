@@ -0,0 +1,102 @@
+"""
+Recorded Editor operations, replayable on other images.
+
+A macro is a batch recipe (see batch.py): {"operations": [{"op": ..., **kwargs}, ...]}.
+Arguments that are positions in the image are recorded as fractions of the image
+size at that step and marked "relative": true, so a caption placed at the bottom
+left of a 6000 px photo lands at the bottom left of a 1200 px one too:
+
+    {"op": "add_text", "text": "(c) me", "position": [0.05, 0.92], "font_size": 0.04,
+     "color": [255, 255, 255], "relative": true}
+
+Relative are: add_text position and font size (a fraction of the height), and the
+box of crop and of region filters. Everything else, resize included, is recorded
+as given. apply_kernel isn't recorded, its Kernel has no JSON form.
+"""
+import json
+
+MACRO_VERSION = 1
+# Editor operations a macro can hold, same as batch.OPERATIONS
+RECORDED_OPERATIONS = ("resize", "crop", "apply_blur", "apply_filter", "add_text")
+
+
+def _scale_box(box, sx, sy):
+    x0, y0, x1, y1 = box
+    return [x0 * sx, y0 * sy, x1 * sx, y1 * sy]
+
+
+def to_relative(op: str, kwargs: dict, size) -> dict:
+    # kwargs in image pixels -> fractions of size. Returns a step dict ready for a macro
+    width, height = size
+    step = {"op": op, **kwargs}
+    relative = False
+    if op == "add_text":
+        x, y = kwargs["position"]
+        step["position"] = [x / width, y / height]
+        step["font_size"] = kwargs.get("font_size", 40) / height
+        relative = True
+    if kwargs.get("box") is not None:
+        step["box"] = _scale_box(kwargs["box"], 1 / width, 1 / height)
+        relative = True
+    if step.get("box", 0) is None:
+        # whole image ops don't carry a box=None around
+        del step["box"]
+    if relative:
+        step["relative"] = True
+    return step
+
+
+def to_absolute(op: str, kwargs: dict, size) -> dict:
+    # the reverse of to_relative for an image of size, kwargs without "op" and "relative"
+    width, height = size
+    kwargs = dict(kwargs)
+    if op == "add_text":
+        x, y = kwargs["position"]
+        kwargs["position"] = (round(x * width), round(y * height))
+        kwargs["font_size"] = max(1, round(kwargs.get("font_size", 40 / height) * height))
+    if kwargs.get("box") is not None:
+        kwargs["box"] = tuple(round(v) for v in _scale_box(kwargs["box"], width, height))
+    return kwargs
+
+
+class MacroRecorder:
+    # steps recorded by an Editor, see Editor.start_recording. Every history state the editor
+    # pushes keeps a copy of the steps at that point, and undo/redo go back to the copy of the
+    # state they land on. So the macro follows what's actually in the image: an operation that
+    # isn't recorded adds no step to undo, a deferred commit adds all of its steps as one state
+    def __init__(self, position: int = 0):
+        self.steps = []
+        # history position -> steps when that state was current
+        self._states = {position: ()}
+        self._position = position
+
+    def __len__(self):
+        return len(self.steps)
+
+    def record(self, op: str, kwargs: dict, size):
+        if op not in RECORDED_OPERATIONS:
+            return
+        self.steps.append(to_relative(op, kwargs, size))
+
+    def mark(self, position: int):
+        # the editor pushed a history state. states after it were the redo branch it replaced
+        self._states = {p: steps for p, steps in self._states.items() if p < position}
+        self._states[position] = tuple(self.steps)
+        self._position = position
+
+    def move_to(self, position: int):
+        # the editor undid or redid to position. states from before recording started have no steps
+        self.steps = list(self._states.get(position, ()))
+        self._position = position
+
+    def drop_pending(self, op: str):
+        # a deferred operation was dropped before it ran, forget its step if it has one
+        if op in RECORDED_OPERATIONS and len(self.steps) > len(self._states.get(self._position, ())):
+            self.steps.pop()
+
+    def to_dict(self) -> dict:
+        return {"version": MACRO_VERSION, "operations": list(self.steps)}
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
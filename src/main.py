@@ -1,16 +1,28 @@
 from src.GUI.MainWindow import MainWindow
+from src.instrument import recorder
 from PyQt6.QtWidgets import QApplication
+import os
 import sys
 import logging
 
 
-app = QApplication(sys.argv)
+def main():
+    app = QApplication(sys.argv)
 
-logging.basicConfig(
-    format='%(asctime)s [%(levelname)s] (%(filename)s:%(lineno)d) - %(message)s',
-    level = logging.DEBUG
-)
+    # IMAGE_EDITOR_LOG=DEBUG for the per operation debug log, it's too chatty (and not free) by default
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] (%(filename)s:%(lineno)d) - %(message)s',
+        level = os.environ.get("IMAGE_EDITOR_LOG", "INFO").upper()
+    )
+    # IMAGE_EDITOR_PROFILE=1 records operation timings from the start (see View > Performance)
+    if os.environ.get("IMAGE_EDITOR_PROFILE"):
+        recorder.enable()
 
-main_window = MainWindow()
-main_window.show()
-sys.exit(app.exec())
\ No newline at end of file
+    main_window = MainWindow()
+    main_window.show()
+    return app.exec()
+
+
+# guarded: macro replay starts worker processes, which import this module again
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+import logging
+import math
+
+
+class OpNode:
+    # one recorded Editor operation: the method name and its keyword arguments
+    __slots__ = ("op", "kwargs")
+
+    def __init__(self, op: str, **kwargs):
+        self.op = op
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        args = ", ".join(f"{k}={v!r}" for k, v in self.kwargs.items() if k != "kernel")
+        return f"{self.op}({args})"
+
+
+class OperationGraph:
+    """
+    Operations recorded by a deferred Editor, executed in one go on commit.
+
+    The graph is the chain of recorded nodes, run in order on commit. optimize() can
+    rewrite the chain into a cheaper one that gives close but not identical pixels,
+    only when asked for with approximate=True:
+      - consecutive downscales with the same resampling collapse into the last one
+      - consecutive gaussian blurs merge into one blur (radii add in quadrature)
+      - blur followed by a downscale runs the downscale first, with the blur radius
+        scaled to match, so the blur works on fewer pixels
+    Kernel filters aren't fused: PIL rounds and clamps after every pass, so a composed
+    kernel is off by a level or more for every kernel we have.
+    """
+
+    def __init__(self):
+        self.nodes = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, op: str, **kwargs):
+        self.nodes.append(OpNode(op, **kwargs))
+
+    def pop(self):
+        return self.nodes.pop()
+
+    def clear(self):
+        self.nodes = []
+
+    def optimize(self, size, approximate: bool = False) -> list:
+        # the nodes to run on an image of size. the recorded chain as it is unless approximate
+        nodes = [OpNode(n.op, **n.kwargs) for n in self.nodes]
+        if not approximate:
+            return nodes
+
+        changed = True
+        while changed:
+            changed = False
+            sizes = self._sizes(nodes, size)
+            for i in range(len(nodes) - 1):
+                a, b = nodes[i], nodes[i + 1]
+                if "box" in a.kwargs or "box" in b.kwargs:
+                    # region ops and crops don't commute or merge with whole image ops
+                    continue
+                if a.op == "resize" and b.op == "resize":
+                    # only two reductions: detail a downscale lost can't come back in the second
+                    # step, but an upscale after it would be computed from the original pixels
+                    w, h = sizes[i]
+                    a_w, a_h = a.kwargs["width"], a.kwargs["height"]
+                    if not (a_w <= w and a_h <= h and b.kwargs["width"] <= a_w and b.kwargs["height"] <= a_h):
+                        continue
+                    if any(a.kwargs.get(k) != b.kwargs.get(k) for k in ("resample", "reducing_gap")):
+                        # the merged node would silently use only the second step's filter
+                        continue
+                    nodes[i:i + 2] = [b]
+                elif a.op == "apply_blur" and b.op == "apply_blur":
+                    radius = math.hypot(a.kwargs["intensity"], b.kwargs["intensity"])
+                    nodes[i:i + 2] = [OpNode("apply_blur", intensity=radius)]
+                elif a.op == "apply_blur" and b.op == "resize":
+                    w, h = sizes[i]
+                    scale = max(b.kwargs["width"] / w, b.kwargs["height"] / h)
+                    if scale >= 1:
+                        continue
+                    nodes[i:i + 2] = [b, OpNode("apply_blur", intensity=a.kwargs["intensity"] * scale)]
+                else:
+                    continue
+                changed = True
+                break
+        logging.debug("approximated %s by %s", self.nodes, nodes)
+        return nodes
+
+    def output_size(self, size):
+        # image size after all nodes ran on an image of size
+        for node in self.nodes:
+            size = self._next_size(node, size)
+        return size
+
+    @staticmethod
+    def _next_size(node, size):
+        if node.op == "resize":
+            return node.kwargs["width"], node.kwargs["height"]
+        if node.op == "crop":
+            x0, y0, x1, y1 = node.kwargs["box"]
+            return min(size[0], x1) - max(0, x0), min(size[1], y1) - max(0, y0)
+        return size
+
+    @classmethod
+    def _sizes(cls, nodes, size) -> list:
+        # image size going into each node
+        sizes = []
+        for node in nodes:
+            sizes.append(size)
+            size = cls._next_size(node, size)
+        return sizes
@@ -0,0 +1,68 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .tiled import filter_halo, filter_strip, run_filter
+
+# below this many pixels splitting costs more than it saves
+MIN_PARALLEL_PIXELS = 1_000_000
+# bands thinner than this spend most of their time on the halo
+MIN_BAND_HEIGHT = 64
+
+_executor = None
+
+
+def _get_executor(workers: int | None):
+    # one shared pool. PIL releases the GIL inside filter(), so threads run the bands
+    # truly in parallel and read the source image in place, no pickling or copies between processes
+    global _executor
+    workers = workers or os.cpu_count() or 1
+    if _executor is None or _executor._max_workers != workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="band-filter")
+    return _executor
+
+
+def band_ranges(height: int, bands: int) -> list:
+    # split rows 0..height into up to `bands` contiguous (y0, y1) ranges of near equal height
+    bands = max(1, min(bands, height // MIN_BAND_HEIGHT or 1))
+    step, extra = divmod(height, bands)
+    ranges = []
+    y = 0
+    for i in range(bands):
+        h = step + (1 if i < extra else 0)
+        ranges.append((y, y + h))
+        y += h
+    return ranges
+
+
+def parallel_filter(image, filters: list, workers: int | None = None):
+    """
+    Apply filters (PIL or filters.ArrayFilter) to image split into horizontal bands, filtered concurrently.
+
+    Every band is filtered together with a halo of neighbouring rows wide enough for
+    the kernels (see tiled.filter_halo), so the stitched result is pixel-identical to
+    running the filters on the whole image.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or image.width * image.height < MIN_PARALLEL_PIXELS:
+        for f in filters:
+            image = run_filter(image, f)
+        return image
+
+    halo = sum(filter_halo(f) for f in filters)
+    ranges = band_ranges(image.height, workers)
+    logging.debug("parallel filter: %d bands, halo %d", len(ranges), halo)
+    # crop() loads lazily opened files, do it once before the threads read the image
+    image.load()
+    executor = _get_executor(workers)
+    futures = [executor.submit(filter_strip, image, filters, y0, y1, halo) for y0, y1 in ranges]
+    result = Image.new(image.mode, image.size)
+    if image.mode == "P":
+        result.putpalette(image.getpalette())
+    for (y0, _), future in zip(ranges, futures):
+        result.paste(future.result(), (0, y0))
+    return result
@@ -0,0 +1,90 @@
+import logging
+import math
+import threading
+
+from PIL import Image
+
+from .colorspace import to_working
+
+
+def proxy_factor(size, max_size) -> float:
+    # scale factor that fits size into max_size, never upscales
+    w, h = size
+    max_w, max_h = max_size
+    if w <= 0 or h <= 0 or max_w <= 0 or max_h <= 0:
+        return 1.0
+    return min(1.0, max_w / w, max_h / h)
+
+
+def scale_operation(op: str, kwargs: dict, factor: float) -> dict:
+    # adapt operation arguments given in full-resolution pixels to a proxy scaled by factor
+    kwargs = dict(kwargs)
+    if op == "resize":
+        kwargs["width"] = max(1, round(kwargs["width"] * factor))
+        kwargs["height"] = max(1, round(kwargs["height"] * factor))
+    elif op == "apply_blur":
+        kwargs["intensity"] = kwargs["intensity"] * factor
+    elif op == "apply_filter":
+        from .filters import FILTER_REGISTRY
+        spec = FILTER_REGISTRY.get(kwargs["filter_name"].lower())
+        for param in spec.params if spec else ():
+            if param.spatial and param.name in kwargs:
+                kwargs[param.name] = max(param.minimum, kwargs[param.name] * factor)
+    elif op == "add_text":
+        x, y = kwargs["position"]
+        kwargs["position"] = (round(x * factor), round(y * factor))
+        kwargs["font_size"] = max(1, round(kwargs.get("font_size", 40) * factor))
+    if kwargs.get("box") is not None:
+        # region ops and crops, grown outwards so the proxy region covers all of it
+        x0, y0, x1, y1 = kwargs["box"]
+        kwargs["box"] = (math.floor(x0 * factor), math.floor(y0 * factor),
+                         max(math.floor(x0 * factor) + 1, math.ceil(x1 * factor)),
+                         max(math.floor(y0 * factor) + 1, math.ceil(y1 * factor)))
+    # kernel filters and non spatial params are defined per pixel and stay as they are
+    return kwargs
+
+
+class ProxyCache:
+    """
+    Keeps one downsampled copy of an image for previews.
+
+    The proxy is rebuilt only when the source revision or the requested size
+    changes, so repeated previews (e.g. dragging a slider) only pay for the filter.
+    """
+
+    def __init__(self):
+        self._revision = None
+        self._max_size = None
+        self._proxy = None
+        self._factor = 1.0
+        # previews are rendered on worker threads, the GUI may ask for one at the same time
+        self._lock = threading.Lock()
+
+    def get(self, image, max_size, revision):
+        # returns (proxy, factor) where proxy size == image size * factor.
+        # revision identifies the pixels of image, see Editor.revision
+        with self._lock:
+            return self._get(image, max_size, revision)
+
+    def _get(self, image, max_size, revision):
+        if self._proxy is None or self._revision != revision or self._max_size != tuple(max_size):
+            factor = proxy_factor(image.size, max_size)
+            # palette and bilevel images would be shrunk nearest neighbour
+            image = to_working(image, "resize")
+            if factor < 1.0:
+                size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+                # reducing_gap lets PIL shrink in integer steps first, which is much faster on big images
+                proxy = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+            else:
+                proxy = image.copy()
+            logging.debug("built preview proxy %s (factor %.3f)", proxy.size, factor)
+            self._revision = revision
+            self._max_size = tuple(max_size)
+            self._proxy = proxy
+            self._factor = factor
+        return self._proxy, self._factor
+
+    def clear(self):
+        with self._lock:
+            self._revision = None
+            self._proxy = None
@@ -0,0 +1,195 @@
+"""
+Persistent, content-addressed cache of operation results.
+
+An entry is keyed by a hash of the source pixels chained with every operation
+applied so far: key(n) = hash(key(n - 1) + normalized operation n). Results are
+stored after every step, so a chain that shares a prefix with an earlier run
+(a re-export with a different watermark, an A/B of the last filter, a re-run
+after a crash) picks up from the longest cached prefix and only runs the rest.
+
+Keys include CACHE_VERSION, bump it when an operation's output or the entry format
+changes so results of older code are never served.
+
+Entries are zlib compressed raw pixels in one file each. The total size is capped,
+least recently used entries (by file mtime, touched on every hit) go first, down to
+3/4 of the budget so the cache dir isn't rescanned on every put. Several
+processes can share one cache dir: writes are atomic renames and entries that
+vanish under a reader are just misses.
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import uuid
+import zlib
+
+from PIL import Image, ImageFilter
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "image-editor-cache")
+DEFAULT_CACHE_BUDGET = 2 * 1024 * 1024 * 1024  # bytes on disk
+# operations whose result depends only on the input pixels and their arguments
+CACHEABLE_OPERATIONS = ("resize", "crop", "apply_blur", "apply_filter", "apply_kernel", "add_text")
+
+# part of every key, see the module docstring
+CACHE_VERSION = 1
+
+_ENTRY_SUFFIX = ".entry"
+
+
+def image_key(image) -> str:
+    # hash of the decoded pixels, so the same picture re-saved or renamed still hits
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"v{CACHE_VERSION}:{image.mode}:{image.width}x{image.height}:".encode())
+    if image.mode == "P":
+        h.update(bytes(image.getpalette() or ()))
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def _normalize(value):
+    # JSON-able, order independent form of an operation argument
+    if isinstance(value, ImageFilter.Kernel):
+        size, scale, offset, kernel = value.filterargs
+        return {"kernel": [list(size), scale, offset, list(kernel)]}
+    if isinstance(value, (tuple, list)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, float) and value.is_integer():
+        # blur radius 2 and 2.0 are the same operation
+        return int(value)
+    return value
+
+
+def operation_key(op: str, kwargs: dict) -> str:
+    kwargs = dict(kwargs)
+    if "filter_name" in kwargs:
+        kwargs["filter_name"] = kwargs["filter_name"].lower()
+    return json.dumps([op, _normalize(kwargs)], sort_keys=True, separators=(",", ":"))
+
+
+def chain_keys(source_key: str, operations: list) -> list:
+    # key of the result after each of operations ({"op": ..., **kwargs} like batch recipes)
+    keys = []
+    key = source_key
+    for step in operations:
+        kwargs = {k: v for k, v in step.items() if k != "op"}
+        step_key = f"v{CACHE_VERSION}|{key}|{operation_key(step['op'], kwargs)}"
+        key = hashlib.blake2b(step_key.encode(), digest_size=16).hexdigest()
+        keys.append(key)
+    return keys
+
+
+def cacheable(operations: list) -> bool:
+    return all(step["op"] in CACHEABLE_OPERATIONS for step in operations)
+
+
+class ResultCache:
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, budget_bytes: int = DEFAULT_CACHE_BUDGET,
+                 compress_level: int = 1):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.compress_level = compress_level
+        os.makedirs(root, exist_ok=True)
+        self._bytes = sum(size for _, size, _ in self._scan())
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def _path(self, key: str) -> str:
+        # two level fan-out keeps directories small
+        return os.path.join(self.root, key[:2], key + _ENTRY_SUFFIX)
+
+    def _scan(self) -> list:
+        # (path, size, mtime) of every entry
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(_ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        (header_len,) = struct.unpack_from("<I", data)
+        header = json.loads(data[4:4 + header_len])
+        image = Image.frombytes(header["mode"], tuple(header["size"]), zlib.decompress(data[4 + header_len:]))
+        if header["palette"] is not None:
+            image.putpalette(header["palette"])
+        self.hits += 1
+        return image
+
+    def put(self, key: str, image):
+        path = self._path(key)
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        header = json.dumps({
+            "mode": image.mode,
+            "size": list(image.size),
+            "palette": image.getpalette() if image.mode == "P" else None,
+        }).encode()
+        data = struct.pack("<I", len(header)) + header + zlib.compress(image.tobytes(), self.compress_level)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex[:8]}.partial"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._bytes += len(data)
+        if self._bytes > self.budget_bytes:
+            self._evict()
+
+    def _evict(self):
+        # other processes may have added or evicted entries, so go by what's on disk. drops least
+        # recently used entries down to 3/4 of the budget, so the next scan is a while away
+        entries = sorted(self._scan(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.budget_bytes * 3 // 4
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        self._bytes = total
+        logging.debug("result cache: evicted %d entries, down to %d bytes", evicted, total)
+
+    def clear(self):
+        for path, _, _ in self._scan():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._bytes = 0
+
+    def longest_prefix(self, keys: list) -> int:
+        # number of leading operations whose result is cached
+        for n in range(len(keys), 0, -1):
+            if keys[n - 1] in self:
+                return n
+        return 0
@@ -0,0 +1,102 @@
+"""
+Writing images: encoder presets per format and atomic, progress-reporting saves.
+
+Presets trade encode time for file size:
+    fast      quick to encode, bigger files (PNG level 1, JPEG without optimize, WebP method 0)
+    balanced  PIL's defaults where they are sensible, optimized JPEG huffman tables
+    small     slowest, smallest files (PNG level 9 + optimize, progressive JPEG, WebP method 6)
+"""
+import logging
+import os
+
+from PIL import Image
+
+PRESETS = ("fast", "balanced", "small")
+DEFAULT_PRESET = "balanced"
+
+SAVE_PRESETS = {
+    "PNG": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 6},
+        "small": {"compress_level": 9, "optimize": True},
+    },
+    "JPEG": {
+        "fast": {"quality": 90},
+        "balanced": {"quality": 90, "optimize": True},
+        "small": {"quality": 85, "optimize": True, "progressive": True},
+    },
+    "WEBP": {
+        "fast": {"quality": 85, "method": 0},
+        "balanced": {"quality": 85, "method": 4},
+        "small": {"quality": 80, "method": 6},
+    },
+    "TIFF": {
+        "fast": {},
+        "balanced": {"compression": "tiff_lzw"},
+        "small": {"compression": "tiff_adobe_deflate"},
+    },
+}
+
+
+def save_format(path: str) -> str:
+    # PIL format name from the file extension, e.g. "photo.jpg" -> "JPEG"
+    ext = os.path.splitext(path)[1].lower()
+    fmt = Image.registered_extensions().get(ext)
+    if fmt is None:
+        raise ValueError(f"unknown image format: {ext or path}")
+    return fmt
+
+
+def encoder_options(fmt: str, preset: str | None) -> dict:
+    # keyword arguments for Image.save, no preset means PIL's own defaults
+    if preset is None:
+        return {}
+    if preset not in PRESETS:
+        raise ValueError(f"unknown preset {preset}, expected one of {', '.join(PRESETS)}")
+    return dict(SAVE_PRESETS.get(fmt, {}).get(preset, {}))
+
+
+class _ProgressFile:
+    # file wrapper that reports the bytes written so far. It hides fileno() on purpose,
+    # PIL would otherwise hand the descriptor to the encoder and bypass write()
+    def __init__(self, f, progress):
+        self._f = f
+        self._progress = progress
+        self.written = 0
+
+    def write(self, data):
+        n = self._f.write(data)
+        self.written += len(data)
+        self._progress(self.written)
+        return n
+
+    def fileno(self):
+        raise AttributeError("fileno")
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def save_image(image, path: str, preset: str | None = None, progress=None, **options):
+    """
+    Encode image to path without ever leaving a half written file behind: it's written
+    to a .partial file next to path and renamed over path when complete.
+
+    preset picks encoder settings (see SAVE_PRESETS), explicit options override them.
+    progress(bytes_written) is called as the encoder produces output, it may raise to abort.
+    """
+    fmt = save_format(path)
+    options = {**encoder_options(fmt, preset), **options}
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.partial{ext}"
+    logging.debug("saving %s as %s %s", path, fmt, options)
+    try:
+        with open(tmp, "wb") as f:
+            target = _ProgressFile(f, progress) if progress else f
+            image.save(target, format=fmt, **options)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return path
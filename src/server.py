@@ -0,0 +1,621 @@
+"""
+Local HTTP service running Editor operations, no GUI needed.
+
+    python -m src.server --port 8080 -j 4
+    curl --data-binary @photo.jpg "http://127.0.0.1:8080/resize?width=800&height=600&format=webp" -o small.webp
+
+Every endpoint is a POST whose body is the image, in any format PIL reads. Its
+parameters go in the query string, named like the Editor arguments. Lists are
+comma separated, e.g. box=0,0,200,100 or color=255,255,255.
+
+    /resize   width, height, resample, reducing_gap
+    /blur     intensity, box
+    /filter   filter_name, box
+    /text     text, position, font_size, color
+    /crop     box
+    /convert  nothing, only re-encodes
+
+All of them also take format (output extension, default: the upload's format) and
+preset (see saving.py). GET /stats returns the server's counters as JSON.
+
+Parameters are checked before the upload is processed: a missing or malformed one
+is a 400, as is a box entirely outside the image. An error in processing itself is
+a 500.
+
+An asyncio front end reads each upload in chunks into a spool file, hashing as it
+goes, so it never holds a whole upload in memory. A bounded process pool then
+decodes, processes and encodes into another spool file, which is streamed back.
+At most --max-pending requests are admitted at a time. Any more get 503 with
+Retry-After as soon as their headers are read, before the body is sent (curl
+waits for the 100 Continue). Encoded responses are cached in memory, keyed by the
+upload's hash, the operation and the output format, so repeated requests skip the
+pool, and identical requests arriving together are processed once. Send "Cache-Control: no-cache" to skip the lookup.
+
+Worker memory is bounded by the image size limits:
+- uploads over --max-upload bytes are refused;
+- images over --max-pixels are refused from their header, before decoding;
+- resizes to more pixels than that are refused too;
+- a JPEG resized down is decoded at the smallest draft scale that's big enough (see Editor.resize).
+
+Workers are replaced after --max-tasks-per-child requests. Where the OS has
+rlimits, --worker-memory caps each worker's address space on top of that.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import uuid
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import Image, ImageColor, UnidentifiedImageError
+
+from .batch import apply_operations, get_cache
+from .colorspace import convert
+from .resample import resample_filter
+from .resultcache import operation_key
+from .saving import PRESETS, save_format, save_image
+from .filters import FILTER_REGISTRY
+from .tools import FILTERS, Editor
+
+DEFAULT_PORT = 8080
+DEFAULT_MAX_UPLOAD = 100 * 1024 * 1024  # bytes
+DEFAULT_MAX_PIXELS = 50_000_000  # per image, input and output
+DEFAULT_RESPONSE_CACHE = 256 * 1024 * 1024  # bytes of encoded responses
+DEFAULT_MAX_TASKS_PER_CHILD = 200
+CHUNK_SIZE = 64 * 1024
+HEADER_TIMEOUT = 10.0  # seconds for the request line and headers
+BODY_TIMEOUT = 30.0  # seconds without a single upload chunk arriving
+UPLOAD_TIMEOUT = 300.0  # seconds for a whole upload, so a slow trickle can't hold a slot forever
+MAX_HEADER_BYTES = 16 * 1024
+LINGER_SECONDS = 1.0  # how long an upload is still read after an error response
+
+
+# query parameter parsers raise ValueError for anything the Editor would refuse, so a
+# request fails with 400 here and not in a worker
+
+def _ints(value: str, count: int) -> tuple:
+    ints = tuple(int(v) for v in value.split(","))
+    if len(ints) != count:
+        raise ValueError(f"expected {count} comma separated integers")
+    return ints
+
+
+def _box(value: str) -> tuple:
+    x0, y0, x1, y1 = _ints(value, 4)
+    if x0 >= x1 or y0 >= y1:
+        raise ValueError("empty box")
+    return x0, y0, x1, y1
+
+
+def _position(value: str) -> tuple:
+    return _ints(value, 2)
+
+
+def _size(value: str) -> int:
+    size = int(value)
+    if size <= 0:
+        raise ValueError("must be positive")
+    return size
+
+
+def _radius(value: str) -> float:
+    radius = float(value)
+    if not 0 <= radius < math.inf:
+        raise ValueError("must be a finite number, 0 or more")
+    return radius
+
+
+def _color(value: str):
+    # a PIL color name or hex string, or r,g,b(,a)
+    if "," not in value:
+        ImageColor.getrgb(value)
+        return value
+    color = tuple(int(v) for v in value.split(","))
+    if len(color) not in (3, 4) or not all(0 <= v <= 255 for v in color):
+        raise ValueError("expected r,g,b or r,g,b,a in 0..255")
+    return color
+
+
+def _resample(value: str) -> str:
+    resample_filter(value)
+    return value
+
+
+def _optional_float(value: str):
+    if value.lower() in ("", "none"):
+        return None
+    gap = float(value)
+    if not 1 <= gap < math.inf:
+        raise ValueError("must be 1 or more")
+    return gap
+
+
+# path -> (Editor method or None, {query parameter: parser}, required parameters)
+ENDPOINTS = {
+    "/resize": ("resize", {"width": _size, "height": _size, "resample": _resample, "reducing_gap": _optional_float},
+                ("width", "height")),
+    "/blur": ("apply_blur", {"intensity": _radius, "box": _box}, ("intensity",)),
+    "/filter": ("apply_filter", {"filter_name": str, "box": _box}, ("filter_name",)),
+    "/text": ("add_text", {"text": str, "position": _position, "font_size": _size, "color": _color},
+              ("text", "position")),
+    "/crop": ("crop", {"box": _box}, ("box",)),
+    "/convert": (None, {}, ()),
+}
+# modes each output format can store, anything else is converted to the first one
+_FORMAT_MODES = {"JPEG": ("RGB", "L", "CMYK"), "BMP": ("RGB", "L", "1", "P")}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = "", headers: dict | None = None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class BadRegion(ValueError):
+    # a box that misses the uploaded image, only known once its header is read
+    pass
+
+
+def _init_worker(max_pixels: int, memory_bytes: int | None):
+    # PIL's own decompression bomb check as a second line behind the header check. Its warning
+    # for images just over the limit is noise, process_upload refuses them right after
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+    if memory_bytes:
+        try:
+            import resource
+        except ImportError:
+            logging.warning("--worker-memory needs rlimits, not available on this OS")
+            return
+        resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+
+
+def process_upload(src: str, spool_dir: str, op: str | None, kwargs: dict, fmt: str | None,
+                   preset: str | None, max_pixels: int, cache_dir: str | None = None) -> tuple:
+    # runs in a worker process: the image at src through op, encoded into spool_dir. Returns (path, PIL format)
+    editor = Editor(history_dir=None, track_history=False)
+    editor.open(src)
+    width, height = editor.image.size
+    if width * height > max_pixels:
+        raise ImageTooLarge(f"image is {width}x{height}, more than {max_pixels} pixels")
+    if op == "resize" and kwargs.get("width", 0) * kwargs.get("height", 0) > max_pixels:
+        raise ImageTooLarge(f"resize to more than {max_pixels} pixels")
+    if "box" in kwargs:
+        x0, y0, x1, y1 = kwargs["box"]
+        if x1 <= 0 or y1 <= 0 or x0 >= width or y0 >= height:
+            raise BadRegion(f"box {kwargs['box']} is outside the {width}x{height} image")
+    source_format = editor.image.format or "PNG"
+    operations = [{"op": op, **kwargs}] if op else []
+    apply_operations(editor, operations, get_cache(cache_dir))
+    editor.load()
+    editor.commit()
+    image = editor.image
+
+    if fmt:
+        path = os.path.join(spool_dir, f"{uuid.uuid4().hex}.{fmt.lower().lstrip('.')}")
+        pil_format = save_format(path)
+    else:
+        pil_format = source_format
+        ext = next(e for e, f in Image.registered_extensions().items() if f == pil_format)
+        path = os.path.join(spool_dir, uuid.uuid4().hex + ext)
+    modes = _FORMAT_MODES.get(pil_format)
+    if modes and image.mode not in modes:
+        image = convert(image, modes[0])
+    save_image(image, path, preset)
+    return path, pil_format
+
+
+class ResponseCache:
+    # encoded responses, least recently used dropped once over budget
+    def __init__(self, budget_bytes: int = DEFAULT_RESPONSE_CACHE):
+        self.budget_bytes = budget_bytes
+        # an entry over a quarter of the budget would push most others out
+        self.max_entry = budget_bytes // 4
+        self._entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, data: bytes, content_type: str):
+        if len(data) > self.max_entry or key in self._entries:
+            return
+        self._entries[key] = (data, content_type)
+        self.nbytes += len(data)
+        while self.nbytes > self.budget_bytes:
+            _, (old, _) = self._entries.popitem(last=False)
+            self.nbytes -= len(old)
+
+
+def parse_params(path: str, query: str):
+    # (Editor method, kwargs, output format, preset) of a request, HTTPError 4xx if they're wrong
+    if path not in ENDPOINTS:
+        raise HTTPError(404, f"unknown endpoint {path}, expected one of {', '.join(ENDPOINTS)}")
+    op, parsers, required = ENDPOINTS[path]
+    kwargs = {}
+    fmt = preset = None
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name == "format":
+            fmt = value
+        elif name == "preset":
+            if value not in PRESETS:
+                raise HTTPError(400, f"preset must be one of {', '.join(PRESETS)}")
+            preset = value
+        elif name in parsers:
+            try:
+                kwargs[name] = parsers[name](value)
+            except ValueError as e:
+                raise HTTPError(400, f"bad value for {name}: {value!r} ({e})") from None
+        else:
+            raise HTTPError(400, f"unknown parameter {name} for {path}")
+    missing = [name for name in required if name not in kwargs]
+    if missing:
+        raise HTTPError(400, f"{path} needs {', '.join(missing)}")
+    if "filter_name" in kwargs and kwargs["filter_name"].lower() not in (*FILTERS, *FILTER_REGISTRY):
+        # the Editor skips unknown filters, a service should say so
+        raise HTTPError(400, f"unknown filter {kwargs['filter_name']}, expected one of "
+                             f"{', '.join((*FILTERS, *FILTER_REGISTRY))}")
+    if fmt:
+        try:
+            save_format("x." + fmt.lower().lstrip("."))
+        except ValueError as e:
+            raise HTTPError(400, str(e)) from None
+    return op, kwargs, fmt, preset
+
+
+async def read_head(reader) -> tuple:
+    # (method, target, {lowercased header: value}) of the next request
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT)
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431) from None
+    except asyncio.TimeoutError:
+        raise HTTPError(408) from None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(400, "malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+def _read_timeout(deadline: float) -> float:
+    # BODY_TIMEOUT for the next read, or less when the upload's deadline is closer
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise HTTPError(408, "upload took too long")
+    return min(BODY_TIMEOUT, remaining)
+
+
+async def _read_exactly(reader, n: int, deadline: float) -> bytes:
+    try:
+        return await asyncio.wait_for(reader.readexactly(n), _read_timeout(deadline))
+    except asyncio.TimeoutError:
+        raise HTTPError(408) from None
+    except asyncio.IncompleteReadError:
+        raise HTTPError(400, "upload ended early") from None
+
+
+async def body_chunks(reader, headers: dict, max_bytes: int):
+    # yields the request body in chunks of at most CHUNK_SIZE, plain or chunked transfer encoding.
+    # every read waits at most BODY_TIMEOUT, the whole body at most UPLOAD_TIMEOUT
+    deadline = time.monotonic() + UPLOAD_TIMEOUT
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        total = 0
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readuntil(b"\r\n"), _read_timeout(deadline))
+                size = int(line.split(b";")[0], 16)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                raise HTTPError(400, "malformed chunked upload") from None
+            if size == 0:
+                try:
+                    # no trailers expected, just the empty line ending the body
+                    await asyncio.wait_for(reader.readuntil(b"\r\n"), _read_timeout(deadline))
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    raise HTTPError(400, "malformed chunked upload") from None
+                return
+            total += size
+            if total > max_bytes:
+                raise HTTPError(413, f"upload over {max_bytes} bytes")
+            while size:
+                data = await _read_exactly(reader, min(size, CHUNK_SIZE), deadline)
+                size -= len(data)
+                yield data
+            await _read_exactly(reader, 2, deadline)
+    else:
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HTTPError(411) from None
+        if length < 0:
+            raise HTTPError(400, "negative Content-Length")
+        if length > max_bytes:
+            raise HTTPError(413, f"upload over {max_bytes} bytes")
+        while length:
+            data = await _read_exactly(reader, min(length, CHUNK_SIZE), deadline)
+            length -= len(data)
+            yield data
+
+
+async def send_response(writer, status: int, body: bytes = b"", content_type: str = "text/plain; charset=utf-8",
+                        headers: dict | None = None, file_path: str | None = None):
+    # one response per connection, file_path is streamed instead of body
+    length = os.path.getsize(file_path) if file_path else len(body)
+    head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+            f"Content-Length: {length}", "Connection: close"]
+    head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+    if file_path:
+        with open(file_path, "rb") as f:
+            while data := f.read(CHUNK_SIZE):
+                writer.write(data)
+                # waits while the client is slower than the disk, so a slow reader doesn't buffer the file
+                await writer.drain()
+    else:
+        writer.write(body)
+    await writer.drain()
+
+
+async def _discard_rest(reader, writer):
+    # a client that sent its upload without waiting for 100 Continue gets a reset instead of
+    # the error response if the socket is closed with its upload unread, so read a bit of it first
+    writer.write_eof()
+    deadline = time.monotonic() + LINGER_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            if not await asyncio.wait_for(reader.read(CHUNK_SIZE), deadline - time.monotonic()):
+                break
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+
+
+class ImageServer:
+    def __init__(self, workers: int | None = None, max_pending: int | None = None,
+                 max_upload: int = DEFAULT_MAX_UPLOAD, max_pixels: int = DEFAULT_MAX_PIXELS,
+                 cache_bytes: int = DEFAULT_RESPONSE_CACHE, cache_dir: str | None = None,
+                 max_tasks_per_child: int | None = DEFAULT_MAX_TASKS_PER_CHILD, worker_memory: int | None = None,
+                 spool_dir: str | None = None):
+        self.workers = workers or os.cpu_count() or 1
+        # a request waiting for a worker is cheap, an idle worker isn't, so a couple queue per worker
+        self.max_pending = max_pending or self.workers * 2
+        self.max_upload = max_upload
+        self.max_pixels = max_pixels
+        self.cache = ResponseCache(cache_bytes)
+        self.cache_dir = cache_dir
+        self.max_tasks_per_child = max_tasks_per_child
+        self.worker_memory = worker_memory
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="image-server-")
+        self.pending = 0
+        # cache key -> future of a request being processed, see _process
+        self._in_flight = {}
+        self.stats = {"processed": 0, "failed": 0, "rejected": 0, "seconds": 0.0}
+        self.pool = None
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, max_tasks_per_child=self.max_tasks_per_child,
+                                   initializer=_init_worker, initargs=(self.max_pixels, self.worker_memory))
+
+    async def start(self, host: str = "127.0.0.1", port: int = DEFAULT_PORT):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.pool = self._new_pool()
+        return await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def stats_dict(self) -> dict:
+        return {**self.stats, "pending": self.pending, "max_pending": self.max_pending, "workers": self.workers,
+                "cache_hits": self.cache.hits, "cache_misses": self.cache.misses, "cache_bytes": self.cache.nbytes}
+
+    async def handle(self, reader, writer):
+        start = time.perf_counter()
+        target = "?"
+        try:
+            method, target, headers = await read_head(reader)
+            url = urlsplit(target)
+            if method == "GET" and url.path == "/stats":
+                await send_response(writer, 200, json.dumps(self.stats_dict()).encode(), "application/json")
+                return
+            if method != "POST":
+                raise HTTPError(405, headers={"Allow": "POST"})
+            params = parse_params(url.path, url.query)
+            if self.pending >= self.max_pending:
+                # backpressure: refused before the body is read, the client retries later
+                self.stats["rejected"] += 1
+                raise HTTPError(503, "server busy", {"Retry-After": "1"})
+            self.pending += 1
+            try:
+                await self._process(reader, writer, headers, *params)
+            finally:
+                self.pending -= 1
+            logging.debug("%s %s in %.1f ms", method, target, (time.perf_counter() - start) * 1e3)
+        except HTTPError as e:
+            if e.status >= 500 and e.status != 503:
+                self.stats["failed"] += 1
+            logging.debug("%s %s: %d %s", target, e, e.status, HTTPStatus(e.status).phrase)
+            try:
+                await send_response(writer, e.status, (str(e) + "\n").encode(), headers=e.headers)
+                await _discard_rest(reader, writer)
+            except ConnectionError:
+                pass
+        except ConnectionError:
+            logging.debug("client of %s went away", target)
+        finally:
+            writer.close()
+
+    async def _process(self, reader, writer, headers, op, kwargs, fmt, preset):
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+        src = os.path.join(self.spool_dir, uuid.uuid4().hex)
+        digest = hashlib.blake2b(digest_size=16)
+        outputs = []
+        try:
+            with open(src, "wb") as f:
+                async for data in body_chunks(reader, headers, self.max_upload):
+                    digest.update(data)
+                    f.write(data)
+            key = f"{digest.hexdigest()}|{operation_key(op or 'convert', kwargs)}|{fmt}|{preset}"
+            use_cache = "no-cache" not in headers.get("cache-control", "")
+            cached = self.cache.get(key) if use_cache else None
+            if cached is None and use_cache and key in self._in_flight:
+                # the same request is being processed right now, wait for its result instead of redoing it
+                cached = await asyncio.shield(self._in_flight[key])
+            if cached is not None:
+                data, content_type = cached
+                await send_response(writer, 200, data, content_type, {"X-Cache": "hit"})
+                return
+
+            # waiters get (data, content type), or None when the result isn't cacheable or failed and they run it themselves
+            shared = asyncio.get_running_loop().create_future() if use_cache else None
+            if shared is not None:
+                self._in_flight[key] = shared
+            try:
+                start = time.perf_counter()
+                path, pil_format = await self._run(src, op, kwargs, fmt, preset)
+                outputs.append(path)
+                self.stats["processed"] += 1
+                self.stats["seconds"] += time.perf_counter() - start
+                content_type = Image.MIME.get(pil_format, "application/octet-stream")
+                data = None
+                if os.path.getsize(path) <= self.cache.max_entry:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    self.cache.put(key, data, content_type)
+                    if shared is not None:
+                        shared.set_result((data, content_type))
+            finally:
+                if shared is not None:
+                    if not shared.done():
+                        shared.set_result(None)
+                    if self._in_flight.get(key) is shared:
+                        del self._in_flight[key]
+            if data is not None:
+                await send_response(writer, 200, data, content_type, {"X-Cache": "miss"})
+            else:
+                await send_response(writer, 200, content_type=content_type, headers={"X-Cache": "miss"},
+                                    file_path=path)
+        finally:
+            for path in [src] + outputs:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    async def _run(self, src, op, kwargs, fmt, preset) -> tuple:
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.pool, process_upload, src, self.spool_dir, op, kwargs, fmt,
+                                              preset, self.max_pixels, self.cache_dir)
+        except ImageTooLarge as e:
+            raise HTTPError(413, str(e)) from None
+        except UnidentifiedImageError:
+            # its message names the spool file, which is no business of the client
+            raise HTTPError(415, "not an image format this server reads") from None
+        except Image.DecompressionBombError as e:
+            raise HTTPError(413, str(e)) from None
+        except MemoryError:
+            raise HTTPError(413, "image too large for the worker memory limit") from None
+        except BadRegion as e:
+            # anything else wrong with the arguments is caught by parse_params, other errors are ours
+            raise HTTPError(400, str(e)) from None
+        except BrokenProcessPool:
+            # a worker died (e.g. killed for memory), the pool is unusable from now on
+            logging.error("worker pool broke, starting a new one")
+            old, self.pool = self.pool, self._new_pool()
+            old.shutdown(wait=False, cancel_futures=True)
+            raise HTTPError(500, "worker died") from None
+        except Exception as e:
+            logging.error("processing failed: %s", e)
+            raise HTTPError(500, str(e)) from None
+
+
+async def serve(server: ImageServer, host: str, port: int):
+    listener = await server.start(host, port)
+    try:
+        # a plain kill stops the server like Ctrl+C, so the spool dir is cleaned up
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # windows
+    logging.info("serving on http://%s:%d with %d workers, %d pending requests at most",
+                 host, port, server.workers, server.max_pending)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.server", description="Serve Editor operations over HTTP")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="requests admitted at once, more get 503 (default: 2 per worker)")
+    parser.add_argument("--max-upload", type=int, default=DEFAULT_MAX_UPLOAD // (1024 * 1024), help="MiB per upload")
+    parser.add_argument("--max-pixels", type=float, default=DEFAULT_MAX_PIXELS / 1e6,
+                        help="megapixels per input or output image")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_RESPONSE_CACHE // (1024 * 1024),
+                        help="MiB of encoded responses kept in memory, 0 disables")
+    parser.add_argument("--cache-dir", default=None,
+                        help="also keep decoded results on disk here, shared by the workers (see resultcache.py)")
+    parser.add_argument("--max-tasks-per-child", type=int, default=DEFAULT_MAX_TASKS_PER_CHILD,
+                        help="requests a worker serves before it's replaced")
+    parser.add_argument("--worker-memory", type=int, default=None, help="address space cap per worker in MiB")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] - %(message)s',
+        level=logging.DEBUG if args.verbose else logging.INFO
+    )
+    server = ImageServer(
+        args.workers, args.max_pending, args.max_upload * 1024 * 1024, int(args.max_pixels * 1e6),
+        args.cache_size * 1024 * 1024, args.cache_dir, args.max_tasks_per_child,
+        args.worker_memory * 1024 * 1024 if args.worker_memory else None,
+    )
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
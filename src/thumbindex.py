@@ -0,0 +1,159 @@
+"""
+Persistent index of folder thumbnails.
+
+One SQLite file holds a small JPEG (PNG with alpha) per image, keyed by its path and
+valid while the file's mtime and size are unchanged, so a folder that was browsed
+before shows its thumbnails without decoding anything. Entries of changed files are
+replaced the next time they're asked for, least recently used ones are dropped once
+the index goes over budget.
+
+Thumbnails are made from the EXIF thumbnail when it's big enough, else from a JPEG
+draft decode (1/2 to 1/8 scale straight from the DCT), else from a full decode.
+"""
+import io
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+from .colorspace import convert, display_mode
+from .decode import draft_decode, exif_thumbnail
+
+DEFAULT_INDEX_PATH = os.path.join(tempfile.gettempdir(), "image-editor-thumbnails.sqlite")
+DEFAULT_INDEX_BUDGET = 256 * 1024 * 1024  # bytes of thumbnail data
+THUMBNAIL_SIZE = 192  # longest side in pixels
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp", ".gif")
+
+
+def file_key(path: str):
+    # (mtime_ns, size) of path, what a cached thumbnail has to match. None if it's gone
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def list_images(folder: str) -> dict:
+    # {path: file_key} of the images directly in folder
+    images = {}
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return images
+    for entry in entries:
+        if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+        except OSError:
+            continue
+        images[entry.path] = (st.st_mtime_ns, st.st_size)
+    return images
+
+
+def make_thumbnail(path: str, size: int = THUMBNAIL_SIZE):
+    # (thumbnail image, full image size) for the file at path
+    with Image.open(path) as image:
+        full_size = image.size
+        thumbnail = exif_thumbnail(image)
+        if thumbnail is None or max(thumbnail.size) < size:
+            # formats without a draft mode are decoded in full, still from the file opened above
+            thumbnail = draft_decode(image, (size, size)) or image
+        # decodes inside the with block, the pixels outlive the file
+        thumbnail.thumbnail((size, size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return convert(thumbnail, display_mode(thumbnail)), full_size
+
+
+def encode_thumbnail(image) -> bytes:
+    buffer = io.BytesIO()
+    if image.mode == "RGBA":
+        image.save(buffer, format="PNG", compress_level=1)
+    else:
+        image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ThumbnailIndex:
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, budget_bytes: int = DEFAULT_INDEX_BUDGET,
+                 size: int = THUMBNAIL_SIZE):
+        self.path = path
+        self.budget_bytes = budget_bytes
+        self.size = size
+        # one connection shared by the browser's worker threads, sqlite calls are serialized by the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS thumbnails ("
+                " path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, thumb_size INTEGER,"
+                " width INTEGER, height INTEGER, data BLOB, used REAL)"
+            )
+            self._bytes = self._db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM thumbnails").fetchone()[0]
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, path: str, key=None):
+        # (encoded thumbnail, full image size) if the index has a current one for path, else None
+        key = key or file_key(path)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT mtime_ns, size, thumb_size, width, height, data FROM thumbnails WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None or (row[0], row[1]) != tuple(key) or row[2] != self.size:
+                return None
+            with self._db:
+                self._db.execute("UPDATE thumbnails SET used = ? WHERE path = ?", (time.time(), path))
+        return row[5], (row[3], row[4])
+
+    def put(self, path: str, key, data: bytes, full_size):
+        with self._lock:
+            with self._db:
+                old = self._db.execute("SELECT LENGTH(data) FROM thumbnails WHERE path = ?", (path,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, key[0], key[1], self.size, full_size[0], full_size[1], data, time.time()),
+                )
+            self._bytes += len(data) - (old[0] if old else 0)
+            if self._bytes > self.budget_bytes:
+                self._evict()
+
+    def thumbnail(self, path: str):
+        # (encoded thumbnail, full image size) from the index, made and stored first if needed
+        key = file_key(path)
+        if key is None:
+            raise FileNotFoundError(path)
+        cached = self.get(path, key)
+        if cached is not None:
+            return cached
+        image, full_size = make_thumbnail(path, self.size)
+        data = encode_thumbnail(image)
+        self.put(path, key, data, full_size)
+        return data, full_size
+
+    def _evict(self):
+        # drop least recently used entries down to 3/4 of the budget, so this doesn't run on every put
+        target = self.budget_bytes * 3 // 4
+        with self._db:
+            rows = self._db.execute("SELECT path, LENGTH(data) FROM thumbnails ORDER BY used").fetchall()
+            for path, nbytes in rows:
+                if self._bytes <= target:
+                    break
+                self._db.execute("DELETE FROM thumbnails WHERE path = ?", (path,))
+                self._bytes -= nbytes
+        logging.debug("thumbnail index: evicted down to %d bytes", self._bytes)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
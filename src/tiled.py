@@ -0,0 +1,351 @@
+"""
+Out-of-core filtering for images too large to hold in memory.
+
+    python -m src.tiled recipe.json huge_scan.tif out.tif --strip-height 512
+
+The source is read in horizontal strips, every strip is filtered together with a
+halo of neighbouring rows wide enough for the filter kernels, and the finished rows
+are streamed to the output. Peak memory is about (strip height + 2 * halo) rows.
+
+Strips are read straight from the file for uncompressed layouts (TIFF, BMP, PPM/PGM),
+for striped TIFFs only the file strips a band overlaps are read.
+Compressed formats (PNG, JPEG, LZW TIFF...) can't be decoded partially by PIL, so
+those are decoded once in full and only the filtering and writing stay tiled.
+Output is written as uncompressed TIFF or PPM/PGM, which can be streamed row by row.
+"""
+import argparse
+import bisect
+import logging
+import math
+import os
+import struct
+import sys
+
+from PIL import Image, ImageFilter
+
+DEFAULT_STRIP_HEIGHT = 512
+
+# operations that work on strips, resize/add_text need the whole image
+TILED_OPERATIONS = ("apply_blur", "apply_filter", "apply_kernel")
+
+
+def run_filter(image, image_filter):
+    # PIL filters go through Image.filter, array filters (filters.ArrayFilter) bring their own apply()
+    if hasattr(image_filter, "apply"):
+        return image_filter.apply(image)
+    return image.filter(image_filter)
+
+
+def filter_halo(image_filter) -> int:
+    # rows of context a filter needs around a strip so the strip comes out identical
+    if hasattr(image_filter, "halo") and not isinstance(image_filter, type):
+        return image_filter.halo
+    if isinstance(image_filter, type):
+        # builtin filters like ImageFilter.SHARPEN are passed around as classes
+        image_filter = image_filter()
+    if isinstance(image_filter, ImageFilter.GaussianBlur):
+        radius = image_filter.radius
+        if isinstance(radius, (tuple, list)):
+            radius = max(radius)
+        # PIL approximates gaussians with 3 box blur passes of about the same radius each
+        return 3 * (math.ceil(radius) + 1)
+    if isinstance(image_filter, ImageFilter.BoxBlur):
+        radius = image_filter.radius
+        if isinstance(radius, (tuple, list)):
+            radius = max(radius)
+        return math.ceil(radius) + 1
+    if isinstance(image_filter, ImageFilter.BuiltinFilter):
+        (width, height), _, _, _ = image_filter.filterargs
+        return max(width, height) // 2
+    if isinstance(image_filter, ImageFilter.RankFilter):
+        return image_filter.size // 2
+    raise ValueError(f"no known halo for filter {image_filter!r}")
+
+
+def operation_filters(operations: list) -> list:
+    # PIL filters for a list of {"op": ..., **kwargs} operations (the batch recipe format)
+    from .filters import ArrayFilter
+    from .tools import FILTERS
+    filters = []
+    for step in operations:
+        op = step["op"]
+        if "box" in step:
+            raise ValueError(f"{op} on a region can't run tiled, only whole image filters can")
+        if op == "apply_blur":
+            filters.append(ImageFilter.GaussianBlur(radius=step["intensity"]))
+        elif op == "apply_filter":
+            params = {k: v for k, v in step.items() if k not in ("op", "filter_name")}
+            f = FILTERS.get(step["filter_name"].lower())
+            filters.append(f if f is not None else ArrayFilter(step["filter_name"].lower(), **params))
+        elif op == "apply_kernel":
+            filters.append(step["kernel"])
+        else:
+            raise ValueError(f"{op} can't run tiled, supported: {', '.join(TILED_OPERATIONS)}")
+    return filters
+
+
+def filter_strip(image, filters: list, y0: int, y1: int, halo: int | None = None):
+    """
+    Filter rows y0..y1 of image using only rows y0 - halo .. y1 + halo.
+    image only needs to provide crop(), so it can be a TiledReader as well.
+    """
+    if halo is None:
+        halo = sum(filter_halo(f) for f in filters)
+    top = max(0, y0 - halo)
+    bottom = min(image.height, y1 + halo)
+    strip = image.crop((0, top, image.width, bottom))
+    for f in filters:
+        strip = run_filter(strip, f)
+    return strip.crop((0, y0 - top, strip.width, y1 - top))
+
+
+class TiledReader:
+    # reads row ranges of an image file without decoding the rest, when the layout allows it
+    def __init__(self, path: str):
+        self.path = path
+        with Image.open(path) as im:
+            self.mode = im.mode
+            self.size = im.size
+            self.info = dict(im.info)
+            self.palette = im.getpalette() if im.mode == "P" else None
+            self._layout = self._raw_layout(im)
+        self._full = None
+        if self._layout is None:
+            logging.info("%s: compressed layout, decoding the full image once", path)
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def streaming(self) -> bool:
+        return self._layout is not None
+
+    def _raw_layout(self, im):
+        # (strips, stride, rawmode, orientation) for images stored as uncompressed "raw" tiles that
+        # span the full width, strips being [(first row, end row, file offset)] top to bottom.
+        # multi-strip TIFFs have one tile per strip, BMP/PPM a single one for the whole frame
+        tiles = sorted(im.tile, key=lambda tile: tile[1][1])
+        if not tiles or any(tile[0] != "raw" or tile[3] != tiles[0][3] for tile in tiles):
+            return None
+        strips = []
+        row = 0
+        for tile in tiles:
+            x0, y0, x1, y1 = tile[1]
+            if (x0, x1, y0) != (0, im.width, row):
+                return None
+            strips.append((y0, y1, tile[2]))
+            row = y1
+        if row != im.height:
+            return None
+        args = tiles[0][3]
+        if isinstance(args, str):
+            rawmode, stride, orientation = args, 0, 1
+        else:
+            rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if orientation < 0 and len(strips) != 1:
+            return None
+        if not stride:
+            try:
+                stride = len(Image.new(im.mode, (im.width, 1)).tobytes("raw", rawmode))
+            except Exception:
+                return None
+        return strips, stride, rawmode, orientation
+
+    def read_rows(self, y0: int, y1: int):
+        if self._layout is None:
+            if self._full is None:
+                with Image.open(self.path) as im:
+                    self._full = im.copy()
+            return self._full.crop((0, y0, self.width, y1))
+
+        strips, stride, rawmode, orientation = self._layout
+        rows = y1 - y0
+        chunks = []
+        with open(self.path, "rb") as f:
+            if orientation < 0:
+                # bottom-up files (BMP) store the last row first
+                f.seek(strips[0][2] + (self.height - y1) * stride)
+                chunks.append(f.read(rows * stride))
+            else:
+                # only the strips the rows fall in are read
+                first = bisect.bisect_right(strips, y0, key=lambda strip: strip[0]) - 1
+                for top, bottom, offset in strips[first:]:
+                    if top >= y1:
+                        break
+                    start, end = max(y0, top), min(y1, bottom)
+                    f.seek(offset + (start - top) * stride)
+                    chunks.append(f.read((end - start) * stride))
+        strip = Image.frombytes(self.mode, (self.width, rows), b"".join(chunks), "raw", rawmode, stride,
+                                orientation)
+        if self.palette is not None:
+            strip.putpalette(self.palette)
+        return strip
+
+    def crop(self, box):
+        # only full width crops are supported, that's what filter_strip asks for
+        x0, y0, x1, y1 = box
+        strip = self.read_rows(y0, y1)
+        if (x0, x1) != (0, self.width):
+            strip = strip.crop((x0, 0, x1, strip.height))
+        return strip
+
+
+class StripWriter:
+    """
+    Writes an image strip by strip: uncompressed TIFF (.tif/.tiff) or PPM/PGM (.ppm/.pgm).
+    Strips have to arrive top to bottom and cover the whole height.
+    """
+
+    TIFF_MODES = {"L": (1, 1), "RGB": (3, 2), "RGBA": (4, 2)}  # mode: (samples, photometric)
+
+    def __init__(self, path: str, mode: str, size, strip_height: int = DEFAULT_STRIP_HEIGHT):
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.strip_height = strip_height
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".tif", ".tiff"):
+            if mode not in self.TIFF_MODES:
+                raise ValueError(f"can't stream {mode} images to TIFF, use L, RGB or RGBA")
+            self.format = "TIFF"
+        elif ext in (".ppm", ".pgm"):
+            if mode not in ("L", "RGB"):
+                raise ValueError(f"can't stream {mode} images to PPM/PGM, use L or RGB")
+            self.format = "PPM"
+        else:
+            raise ValueError(f"streaming output must be .tif/.tiff or .ppm/.pgm, got {ext}")
+        self._rows_written = 0
+        self._tmp = path + ".partial"
+        self._file = open(self._tmp, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        width, height = self.size
+        if self.format == "PPM":
+            magic = b"P6" if self.mode == "RGB" else b"P5"
+            self._file.write(magic + f"\n{width} {height}\n255\n".encode("ascii"))
+            return
+
+        samples, photometric = self.TIFF_MODES[self.mode]
+        row_bytes = width * samples
+        strips = max(1, math.ceil(height / self.strip_height))
+        entries = [
+            (256, 4, 1, width),  # ImageWidth
+            (257, 4, 1, height),  # ImageLength
+            (258, 3, samples, None),  # BitsPerSample, 8 per sample
+            (259, 3, 1, 1),  # Compression: none
+            (262, 3, 1, photometric),  # PhotometricInterpretation
+            (273, 4, strips, None),  # StripOffsets
+            (277, 3, 1, samples),  # SamplesPerPixel
+            (278, 4, 1, self.strip_height),  # RowsPerStrip
+            (279, 4, strips, None),  # StripByteCounts
+            (284, 3, 1, 1),  # PlanarConfiguration: chunky
+        ]
+        if self.mode == "RGBA":
+            entries.append((338, 3, 1, 2))  # ExtraSamples: unassociated alpha
+
+        # layout: header, IFD, out of line arrays, pixel data
+        ifd_offset = 8
+        ifd_size = 2 + 12 * len(entries) + 4
+        extra_offset = ifd_offset + ifd_size
+        bits_offset = extra_offset
+        offsets_offset = bits_offset + (2 * samples if samples > 2 else 0)
+        counts_offset = offsets_offset + (4 * strips if strips > 1 else 0)
+        data_offset = counts_offset + (4 * strips if strips > 1 else 0)
+
+        counts = [min(self.strip_height, height - i * self.strip_height) * row_bytes for i in range(strips)]
+        offsets = []
+        position = data_offset
+        for count in counts:
+            offsets.append(position)
+            position += count
+
+        out = bytearray(b"II*\x00" + struct.pack("<I", ifd_offset))
+        out += struct.pack("<H", len(entries))
+        for tag, typ, count, value in entries:
+            if tag == 258:
+                value = bits_offset if samples > 2 else 8
+            elif tag == 273:
+                value = offsets_offset if strips > 1 else offsets[0]
+            elif tag == 279:
+                value = counts_offset if strips > 1 else counts[0]
+            if typ == 3 and count == 1:
+                out += struct.pack("<HHIHH", tag, typ, count, value, 0)
+            else:
+                out += struct.pack("<HHII", tag, typ, count, value)
+        out += struct.pack("<I", 0)  # no next IFD
+        if samples > 2:
+            out += struct.pack(f"<{samples}H", *([8] * samples))
+        if strips > 1:
+            out += struct.pack(f"<{strips}I", *offsets)
+            out += struct.pack(f"<{strips}I", *counts)
+        self._file.write(out)
+
+    def write(self, strip):
+        if strip.mode != self.mode or strip.width != self.size[0]:
+            raise ValueError(f"strip {strip.mode} {strip.size} doesn't match output {self.mode} {self.size}")
+        self._file.write(strip.tobytes())
+        self._rows_written += strip.height
+
+    def close(self):
+        self._file.close()
+        if self._rows_written != self.size[1]:
+            os.remove(self._tmp)
+            raise ValueError(f"wrote {self._rows_written} of {self.size[1]} rows")
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+def process_tiled(src: str, dst: str, operations: list, strip_height: int = DEFAULT_STRIP_HEIGHT,
+                  progress=None):
+    """
+    Apply blur/filter operations to src and stream the result to dst, strip by strip.
+    operations use the batch recipe format: [{"op": "apply_blur", "intensity": 4}, ...].
+    progress, if given, is called with (rows done, total rows).
+    """
+    filters = operation_filters(operations)
+    halo = sum(filter_halo(f) for f in filters)
+    reader = TiledReader(src)
+    logging.debug("tiled: %s %s, strips of %d rows, halo %d", reader.size, reader.mode, strip_height, halo)
+    writer = StripWriter(dst, reader.mode, reader.size, strip_height)
+    try:
+        for y0 in range(0, reader.height, strip_height):
+            y1 = min(reader.height, y0 + strip_height)
+            writer.write(filter_strip(reader, filters, y0, y1, halo))
+            if progress:
+                progress(y1, reader.height)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def main(argv=None) -> int:
+    from .batch import load_recipe
+
+    parser = argparse.ArgumentParser(prog="python -m src.tiled", description="Filter huge images strip by strip")
+    parser.add_argument("recipe", help="JSON or YAML recipe with apply_blur/apply_filter operations")
+    parser.add_argument("input")
+    parser.add_argument("output", help=".tif/.tiff or .ppm/.pgm")
+    parser.add_argument("--strip-height", type=int, default=DEFAULT_STRIP_HEIGHT)
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] - %(message)s', level=logging.INFO)
+    # the whole point is huge images, PIL's decompression bomb check would refuse them
+    Image.MAX_IMAGE_PIXELS = None
+    process_tiled(args.input, args.output, load_recipe(args.recipe), args.strip_height)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
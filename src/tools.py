@@ -1,155 +1,579 @@
 import logging
+import os
+import threading
 
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageQt
-from PIL.ImageFilter import GaussianBlur
-from PyQt6.QtGui import QPixmap
-from PIL.ImageQt import ImageQt
+from PIL import Image, ImageFilter
+
+from .colorspace import DisplayCache, ink, to_working
+from .decode import quick_previews
+from .filters import ArrayFilter, FILTER_REGISTRY, blur_filter
+from .fonts import font_manager, DEFAULT_FONT_FAMILY
+from .history import HistoryStore, ScratchDir, DEFAULT_HISTORY_BUDGET, DEFAULT_SCRATCH_ROOT, image_nbytes
+from .instrument import instrumented
+from .macro import MacroRecorder
+from .opgraph import OperationGraph
+from .parallel import parallel_filter
+from .preview import ProxyCache, scale_operation
+from .resample import DEFAULT_REDUCING_GAP, DEFAULT_RESAMPLE, draft_size, ladder, resize_image
+from .saving import save_image
+from .tiled import filter_halo, run_filter
+
+# PIL kernel filters available through apply_filter, the NumPy ones live in filters.FILTER_REGISTRY
+FILTERS = {
+    "contour": ImageFilter.CONTOUR,
+    "detail": ImageFilter.DETAIL,
+    "sharpen": ImageFilter.SHARPEN,
+}
+# dirty marker for "the whole image changed"
+_FULL_FRAME = object()
+# reports the size/mode of the editor's image with every recorded operation (see instrument.py)
+_traced = instrumented(image_of=lambda editor: editor.image)
 
 class Editor:
-    def __init__(self, path: str = None):
+    def __init__(self, path: str = None, history_budget: int = DEFAULT_HISTORY_BUDGET,
+                 history_dir: str | None = DEFAULT_SCRATCH_ROOT, track_history: bool = True,
+                 deferred: bool = False, parallel: bool = False, workers: int | None = None):
         self.image = None
         self.path = path
-        # list of PIL.Image objects/snapshots of states
-        self._history = []
-        self._history_index = -1
-        self._history_limit = 20 # max number of states to keep in history
+        # undo/redo states, stored as compressed deltas against the current image.
+        # older deltas spill to history_dir once history_budget bytes of RAM are used, None keeps everything in RAM
+        self._history = HistoryStore(history_budget, scratch_dir=history_dir)
+        # headless/batch runs never undo, so they can skip diffing states altogether
+        self.track_history = track_history
+        # in deferred mode operations are only recorded, and run as one history step on commit/save/to_qpixmap
+        self.deferred = deferred
+        self._pending = OperationGraph()
+        self._committing = False
+        # parallel=True filters large images in horizontal bands on `workers` threads (default: all cores)
+        self.parallel = parallel
+        self.workers = workers
+        # bumped whenever the pixels change, lets caches of derived images know they are stale
+        self.revision = 0
+        # region changed since the last take_dirty_box(): None, a box, or _FULL_FRAME
+        self._dirty = None
+        self._proxy_cache = ProxyCache()
+        # the image in a mode Qt can show, for modes it can't (see colorspace.py)
+        self._display_cache = DisplayCache()
+        # open() only reads the header, pixels are decoded by load() when first needed
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # (image, revision, pending nodes) as of the last finished operation, what previews on other
+        # threads work from. swapped under edit_lock, which is never held while pixels are computed.
+        # operations don't change a published image in place, they replace it
+        self.edit_lock = threading.RLock()
+        self._published = (None, 0, ())
+        # hibernate() parks the pixels in a file here, load() brings them back
+        self._swap_dir = ScratchDir(history_dir) if history_dir else None
+        self._swap_path = None
+        # a MacroRecorder while recording, see start_recording()
+        self._macro = None
         if path:
             self.open(path)
 
-    def _push_history(self):
-        # append a snapshot of the image to history.
+    def _push_history(self, box=None):
+        # record the current image state in history. box is the region the edit changed, None for all of it.
         # Maintains the linear undo/redo behavior: truncates any redo history when new state is added.
-
         if not self.image:
             return
-        # magic trick
-        if self._history_index < len(self._history) - 1:
-            self._history = self._history[: self._history_index + 1]
-        # store a copy to avoid accidental shared-state mutation
-        try:
-            snapshot = self.image.copy()
-        except Exception:
-            # fallback:: create a new image from bytes
-            snapshot = self.image
-        self._history.append(snapshot)
+        self._mark_dirty(box)
+        if self._committing:
+            return
+        self.revision += 1
+        if self.track_history:
+            self._history.push(self.image, box)
+        if self._macro is not None:
+            self._macro.mark(self.history_position)
+        self._publish()
+
+    def _publish(self):
+        # make the current state the one render_preview sees
+        with self.edit_lock:
+            self._published = (self.image, self.revision, tuple(self._pending.nodes))
+
+    def _mark_dirty(self, box=None):
+        if box is None or self._dirty is _FULL_FRAME:
+            self._dirty = _FULL_FRAME
+        elif self._dirty is None:
+            self._dirty = box
+        else:
+            d = self._dirty
+            self._dirty = (min(d[0], box[0]), min(d[1], box[1]), max(d[2], box[2]), max(d[3], box[3]))
+
+    @property
+    def dirty_box(self):
+        # region changed since the last take_dirty_box(), for incremental display updates. None if nothing changed
+        if self._dirty is _FULL_FRAME:
+            return (0, 0) + self.image.size if self.image else None
+        return self._dirty
+
+    def take_dirty_box(self):
+        box = self.dirty_box
+        self._dirty = None
+        return box
+
+    def _working(self, op: str):
+        # convert at the operation boundary when op can't run (correctly) in the current mode.
+        # the image stays in the working mode afterwards, see colorspace.py
+        image = to_working(self.image, op)
+        if image is not self.image:
+            self.image = image
+            # the display mode may change along, so the whole frame is redrawn
+            self._mark_dirty()
+
+    def _region(self, box):
+        # box (x0, y0, x1, y1) as ints clipped to the image
+        x0, y0, x1, y1 = (int(round(v)) for v in box)
+        box = (max(0, x0), max(0, y0), min(self.image.width, x1), min(self.image.height, y1))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            raise ValueError(f"region {box} is outside the image")
+        return box
+
+    def _filter(self, image_filter, box=None):
+        # serial or band-parallel, both give the same pixels
+        if box is not None:
+            return self._filter_region(image_filter, box)
+        if self.parallel:
+            return parallel_filter(self.image, [image_filter], self.workers)
+        return run_filter(self.image, image_filter)
+
+    def _filter_region(self, image_filter, box):
+        # filter only box, plus a halo of context around it so the result inside box is
+        # the same as filtering the whole image. the rest of the image isn't touched
+        halo = filter_halo(image_filter)
+        x0, y0, x1, y1 = box
+        outer = (max(0, x0 - halo), max(0, y0 - halo),
+                 min(self.image.width, x1 + halo), min(self.image.height, y1 + halo))
+        region = run_filter(self.image.crop(outer), image_filter)
+        inner = (x0 - outer[0], y0 - outer[1], x1 - outer[0], y1 - outer[1])
+        # pasted into a copy, a preview may be reading the published image meanwhile
+        image = self.image.copy()
+        image.paste(region.crop(inner), box)
+        return image
+
+    def _defer(self, op: str, **kwargs) -> bool:
+        # records the operation instead of running it when in deferred mode.
+        # every operation passes through here first, so it's also where macros are recorded
+        if self._macro is not None and not self._committing and self.image:
+            self._macro.record(op, kwargs, self._pending.output_size(self.image.size))
+        if not self.deferred or self._committing or not self.image:
+            return False
+        # region ops keep their box, whole image ops don't carry a box=None around
+        if kwargs.get("box", 0) is None:
+            del kwargs["box"]
+        logging.debug("deferring %s: %s", op, kwargs)
+        self._pending.add(op, **kwargs)
+        self._publish()
+        return True
+
+    @property
+    def recording(self) -> bool:
+        return self._macro is not None
+
+    def start_recording(self):
+        # from now on every operation is added to a macro (see macro.py), stop_recording() returns it
+        self._macro = MacroRecorder(self.history_position)
+        return self
+
+    def stop_recording(self) -> MacroRecorder | None:
+        macro, self._macro = self._macro, None
+        return macro
 
-        # cut history if it grows too large
-        while len(self._history) > self._history_limit:
-            self._history.pop(0)
-        self._history_index = len(self._history) - 1
+    def has_pending(self) -> bool:
+        return len(self._pending) > 0
+
+    @_traced
+    def commit(self, approximate: bool = False):
+        # run all deferred operations and record a single history state. approximate lets
+        # OperationGraph.optimize rewrite the chain into a cheaper one that isn't pixel identical
+        if not self.has_pending() or not self.image:
+            return self
+        nodes = self._pending.optimize(self.image.size, approximate)
+        self._pending.clear()
+        self._committing = True
+        try:
+            for node in nodes:
+                getattr(self, node.op)(**node.kwargs)
+        finally:
+            self._committing = False
+        self._push_history()
+        return self
 
     def can_undo(self) -> bool:
-        return self._history_index > 0
+        if self.has_pending():
+            return True
+        return self._history.can_undo()
 
     def can_redo(self) -> bool:
-        # checks if there is snapshot before the current image state
-        return self._history_index < len(self._history) - 1
+        # checks if there is a state after the current image state.
+        # pending deferred operations start a new branch, so there is nothing to redo
+        return not self.has_pending() and self._history.can_redo()
 
+    @_traced
     def undo(self) -> bool:
+        if self.has_pending():
+            # pending operations haven't touched pixels yet, dropping the last one is enough
+            node = self._pending.pop()
+            logging.debug("undo: dropped pending %s", node)
+            if self._macro is not None:
+                self._macro.drop_pending(node.op)
+            self._publish()
+            return True
         if not self.can_undo():
             logging.debug("undo: nothing to undo")
             return False
-        self._history_index -= 1
-        # use a copy so that future mutations don't alter stored snapshot
-        self.image = self._history[self._history_index].copy()
-        logging.debug(f"undo: moved to history index {self._history_index}")
+        self.load()
+        # history hands out a fresh image so future mutations don't alter stored states
+        self.image = self._history.undo()
+        if self._macro is not None:
+            self._macro.move_to(self.history_position)
+        self.revision += 1
+        self._mark_dirty(self._history.last_box)
+        self._publish()
+        logging.debug("undo: history holds %d bytes", self._history.nbytes)
         return True
 
+    @_traced
     def redo(self) -> bool:
         if not self.can_redo():
             logging.debug("redo: nothing to redo")
             return False
-        self._history_index += 1
-        self.image = self._history[self._history_index].copy()
-        logging.debug(f"redo: moved to history index {self._history_index}")
+        self.load()
+        self.image = self._history.redo()
+        if self._macro is not None:
+            self._macro.move_to(self.history_position)
+        self.revision += 1
+        self._mark_dirty(self._history.last_box)
+        self._publish()
+        logging.debug("redo: history holds %d bytes", self._history.nbytes)
         return True
 
+    def close(self):
+        # drop the image and release history, including spilled scratch files
+        self.image = None
+        self._publish()
+        self._display_cache.clear()
+        self._history.close()
+        self._drop_swap()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def nbytes(self) -> int:
+        # RAM held for this image: decoded pixels plus history (its anchor copy and resident deltas)
+        pixels = image_nbytes(self.image) if self.image and self._loaded else 0
+        return pixels + self._history.anchor_nbytes + self._history.nbytes
+
+    def release_history(self) -> int:
+        # move undo/redo data out of RAM (to the history scratch dir), returns the bytes freed
+        return self._history.spill()
+
+    def hibernate(self) -> int:
+        """
+        Park the pixels in the scratch dir and drop them, and history's copy, from RAM.
+        They come back like a lazily opened file: on load(), which every operation calls.
+        Returns the bytes freed, 0 when there's no scratch dir or nothing to free.
+        """
+        if self._swap_dir is None or not self.image or not self._loaded:
+            return 0
+        self.commit()
+        before = self.nbytes
+        path = self._swap_dir.new_file(".tif")
+        with self._load_lock:
+            try:
+                # uncompressed TIFF: written at disk speed, every PIL mode we work in round trips
+                self.image.save(path, format="TIFF")
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("can't hibernate %s: %s", self.path, e)
+                if os.path.exists(path):
+                    os.remove(path)
+                return 0
+            self.image = Image.open(path)
+            self._loaded = False
+            self._swap_path = path
+        self._publish()
+        self._history.spill()
+        self._history.suspend()
+        self._proxy_cache.clear()
+        self._display_cache.clear()
+        # whatever showed the image has to be rebuilt from the reloaded pixels
+        self._mark_dirty()
+        logging.debug("hibernated %s to %s", self.path, path)
+        return before - self.nbytes
+
+    def _drop_swap(self):
+        if self._swap_path is not None:
+            try:
+                os.remove(self._swap_path)
+            except OSError:
+                pass
+            self._swap_path = None
+
+    @property
+    def history_position(self) -> int:
+        # see HistoryStore.position. Operations that change nothing don't move it
+        return self._history.position
+
+    def discard_redo(self):
+        # forget undone states, e.g. after rolling back a cancelled edit
+        self._history.truncate()
+
+    @_traced
     def open(self, path: str):
-        logging.debug(f"opening image: {path}")
-        self.image = Image.open(path)
-        self.path = path
-        # initialize history with the opened image state
-        self._history = []
-        self._history_index = -1
+        # lazy: only the header is read here, see load() and quick_previews()
+        logging.debug("opening image: %s", path)
+        with self._load_lock:
+            self.image = Image.open(path)
+            self.path = path
+            self._loaded = False
+            self._drop_swap()
+        self._pending.clear()
+        self.revision += 1
+        self._mark_dirty()
+        self._history.reset(None)
+        self._publish()
+        return self
+
+    @_traced
+    def load(self):
+        # decode the opened image in full and make it the first history state.
+        # every operation calls this first, call it directly to decode ahead of time (e.g. on a worker)
+        with self._load_lock:
+            if self._loaded or not self.image:
+                return self
+            self.image.load()
+            self._loaded = True
+            if self._swap_path is not None:
+                # back from hibernate(): history is intact, only its anchor has to be restored
+                self._history.resume(self.image)
+                self._drop_swap()
+                logging.debug("woke up %s", self.path)
+                return self
+            # initialize history with the opened image state
+            self._history.reset(self.image if self.track_history else None)
+            logging.debug("decoded %s: %s %s", self.path, self.image.size, self.image.mode)
+        return self
+
+    @_traced
+    def set_image(self, image):
+        # replace the pixels wholesale (e.g. with a cached result), recorded as one history step
+        self.load()
+        with self._load_lock:
+            self.image = image
+            self._loaded = True
         self._push_history()
         return self
 
-    def resize(self, width: int, height: int):
-        logging.debug(f"called resize function: {width}, {height}")
+    def quick_previews(self, max_size):
+        """
+        Yields (image, factor) previews that get better as they come, for showing a just
+        opened image before load() finishes: the EXIF thumbnail and a JPEG draft decode.
+        Once loaded this is just the preview proxy.
+        """
+        if not self.image:
+            return
+        if self._loaded or self._swap_path is not None:
+            # a hibernated image has edits the file at self.path doesn't
+            self.load()
+            yield self._proxy_cache.get(self.image, max_size, self.revision)
+            return
+        yield from quick_previews(self.path, self.image.size, max_size)
+
+    def _draft(self, size, reducing_gap):
+        # a JPEG that isn't decoded yet can be decoded straight at 1/2, 1/4 or 1/8 scale, as long as
+        # that still covers size * reducing_gap. Not with history, the first state would lose resolution
+        with self._load_lock:
+            if self._loaded or self.track_history or not reducing_gap or self.image.format != "JPEG":
+                return
+            target = draft_size(size, reducing_gap)
+            if target[0] * 2 > self.image.width or target[1] * 2 > self.image.height:
+                return
+            self.image.draft(None, target)
+            logging.debug("resize: drafted %s at %s", self.path, self.image.size)
+
+    @_traced
+    def resize(self, width: int, height: int, resample: str = DEFAULT_RESAMPLE,
+               reducing_gap: float | None = DEFAULT_REDUCING_GAP):
+        # resample is one of resample.RESAMPLING, reducing_gap=None disables the fast path for big reductions
+        logging.debug("called resize function: %s, %s %s", width, height, resample)
+        if self._defer("resize", width=width, height=height, resample=resample, reducing_gap=reducing_gap):
+            return self
         if self.image:
-            self.image = self.image.resize((width, height))
+            self._draft((width, height), reducing_gap)
+        self.load()
+        if self.image:
+            self._working("resize")
+            self.image = resize_image(self.image, (width, height), resample, reducing_gap)
             # push new state after mutation
             self._push_history()
         return self
 
-    def add_text(self, text: str, position, font_size=40, color="white"):
+    def thumbnails(self, sizes, resample: str = DEFAULT_RESAMPLE, reducing_gap: float | None = DEFAULT_REDUCING_GAP):
+        # thumbnails fitting each of sizes in one pass (see resample.ladder), self.image and history stay as they are
+        if not self.image:
+            return []
+        self.commit()
+        if sizes:
+            largest = max(((s, s) if isinstance(s, int) else tuple(s) for s in sizes), key=lambda s: s[0] * s[1])
+            self._draft(largest, reducing_gap)
+        self.load()
+        return ladder(to_working(self.image, "resize"), sizes, resample, reducing_gap)
+
+    @_traced
+    def add_text(self, text: str, position, font_size=40, color="white", font_family=DEFAULT_FONT_FAMILY):
         if not self.image:
             logging.debug("add text: no image")
             return self
+        if self._defer("add_text", text=text, position=position, font_size=font_size, color=color,
+                       font_family=font_family):
+            return self
+        self.load()
+        self._working("add_text")
 
-        draw = ImageDraw.Draw(self.image)
-        try:
-            font = ImageFont.truetype("arial.ttf", font_size)
-        except OSError:
-            font = ImageFont.load_default()
-
-        draw.text(position, text, fill=color, font=font)
-        logging.debug(f"Text '{text}' added at {position}")
+        # fonts and rendered text are cached process wide, repeated captions are a masked paste.
+        # drawn on a copy, a preview may be reading the published image meanwhile
+        image = self.image.copy()
+        box = font_manager.draw_text(image, position, text, ink(image, color), font_family, font_size)
+        logging.debug("Text '%s' added at %s", text, position)
+        if box is None:
+            # entirely outside the image, nothing changed
+            return self
+        self.image = image
         # push new state after mutation
-        self._push_history()
+        self._push_history(box)
         return self
 
-    def apply_blur(self, intensity: int):
+    @_traced
+    def apply_blur(self, intensity: int, box=None):
+        # box (x0, y0, x1, y1) limits the blur to that region, e.g. a selection
         if not self.image:
             logging.debug("apply_blur called without image")
             return self
-        logging.debug(f"apply_blur: {intensity}")
-        self.image = self.image.filter(GaussianBlur(radius=intensity))
-        # push new state after mutation
-        self._push_history()
+        logging.debug("apply_blur: %s %s", intensity, box)
+        if self._defer("apply_blur", intensity=intensity, box=box):
+            return self
+        self.load()
+        self._working("apply_blur")
+        box = self._region(box) if box is not None else None
+        self.image = self._filter(blur_filter(self.image.mode, intensity), box)
+        # push new state after mutation, only box needs diffing
+        self._push_history(box)
         return self
 
 
-    def apply_filter(self, filter_name: str):
+    @_traced
+    def apply_filter(self, filter_name: str, box=None, **params):
+        # filter_name is one of FILTERS (PIL kernels) or a registered array filter taking params.
+        # box limits the filter to a region, like in apply_blur
         if not self.image:
             logging.debug("apply_filter called without image")
             return self
-        logging.debug(f"apply_filter: {filter_name}")
-        filters = {
-            "contour": ImageFilter.CONTOUR,
-            "detail": ImageFilter.DETAIL,
-            "sharpen": ImageFilter.SHARPEN,
-        }
-        f = filters.get(filter_name.lower())
+        logging.debug("apply_filter: %s %s %s", filter_name, params, box)
+        name = filter_name.lower()
+        f = FILTERS.get(name)
+        if f is None and name in FILTER_REGISTRY:
+            f = ArrayFilter(name, **params)
         if f:
-            logging.debug(f"setting {f} filter")
-            self.image = self.image.filter(f)
+            if self._defer("apply_filter", filter_name=filter_name, box=box, **params):
+                return self
+            self.load()
+            self._working("array_filter" if isinstance(f, ArrayFilter) else "apply_kernel")
+            logging.debug("setting %s filter", f)
+            box = self._region(box) if box is not None else None
+            self.image = self._filter(f, box)
             # push new state after mutation
-            self._push_history()
+            self._push_history(box)
+        return self
+
+    @_traced
+    def apply_kernel(self, kernel: ImageFilter.Kernel, box=None):
+        # runs an arbitrary convolution kernel (an ImageFilter.Kernel)
+        if not self.image:
+            logging.debug("apply_kernel called without image")
+            return self
+        if self._defer("apply_kernel", kernel=kernel, box=box):
+            return self
+        self.load()
+        self._working("apply_kernel")
+        box = self._region(box) if box is not None else None
+        self.image = self._filter(kernel, box)
+        self._push_history(box)
+        return self
+
+    @_traced
+    def crop(self, box):
+        if not self.image:
+            logging.debug("crop called without image")
+            return self
+        logging.debug("crop: %s", box)
+        if self._defer("crop", box=box):
+            return self
+        self.load()
+        self.image = self.image.crop(self._region(box))
+        self._push_history()
         return self
 
 
-    def save(self, path: str = None):
-        logging.debug(f"saving image: {path}")
+    @_traced
+    def render_preview(self, operations: list, max_size, check=None):
+        """
+        Run operations on a downsampled proxy of the image, without touching
+        self.image or history. operations is a list of (op, kwargs) with arguments in
+        full-resolution pixels, pending deferred operations are included.
+        Works from the last published state, so it doesn't wait for an operation
+        running on another thread.
+        check, if given, is called before each operation and may raise to stop early.
+        Returns (preview image, factor), factor being preview size / full size.
+        """
+        with self.edit_lock:
+            image, revision, pending = self._published
+        if not image:
+            return None, 1.0
+        # a lazily opened image is decoded once, by whichever thread gets there first
+        self.load()
+        proxy, factor = self._proxy_cache.get(image, max_size, revision)
+        steps = [(node.op, node.kwargs) for node in pending] + list(operations)
+        scratch = Editor(history_dir=None, track_history=False)
+        scratch.image = proxy.copy() if steps else proxy
+        for op, kwargs in steps:
+            if check is not None:
+                check()
+            getattr(scratch, op)(**scale_operation(op, kwargs, factor))
+        return scratch.image, factor
+
+    @_traced
+    def save(self, path: str = None, preset: str | None = None, progress=None, **options):
+        # atomic write through a temp file, preset/options tune the encoder (see saving.py)
+        logging.debug("saving image: %s", path)
+        self.commit()
         if not self.image:
             logging.debug("save called, but self.image is None")
             return
         save_path = path or self.path
         if save_path:
-            self.image.save(save_path)
-            logging.debug(f"saved image: {save_path}")
+            save_image(self.image, save_path, preset, progress, **options)
+            logging.debug("saved image: %s", save_path)
+
+    def display_image(self):
+        # self.image in a mode the display takes (L, RGB or RGBA), converted once per revision
+        if not self.image:
+            return None
+        return self._display_cache.get(self.image, self.revision)
 
+    @_traced
     def to_qpixmap(self):
         logging.debug("converting image to QPixmap")
         if not self.image:
             logging.error("to_qpixmap called, but self.image is None")
             return None
+        self.commit()
+        # Qt is only imported here so the editor can run headless (see batch.py)
+        from PyQt6.QtGui import QPixmap
+        from PIL.ImageQt import ImageQt
 
-        # avoiding mutating self.image, using a temporary copy
-        img_for_qt = self.image
-        if img_for_qt.mode not in ("RGB", "RGBA"):
-            logging.debug("converting image mode from %s to RGBA", img_for_qt.mode)
-            img_for_qt = img_for_qt.convert("RGBA")
+        # L, RGB or RGBA, only converted when the pixels changed since the last call
+        img_for_qt = self.display_image()
 
         qimage = ImageQt(img_for_qt)
         # keep a reference to the qimage to avoid being thrown into shit pile by garbage collector while Qt uses it
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.opgraph import OperationGraph
+from src.tools import Editor
+
+CHAINS = [
+    [("apply_blur", {"intensity": 3}), ("resize", {"width": 90, "height": 60, "resample": "nearest"})],
+    [("apply_blur", {"intensity": 2}), ("resize", {"width": 100, "height": 70})],
+    [("apply_blur", {"intensity": 2}), ("apply_blur", {"intensity": 3})],
+    [("resize", {"width": 150, "height": 100}), ("resize", {"width": 75, "height": 50})],
+    [("apply_filter", {"filter_name": "sharpen"}), ("apply_filter", {"filter_name": "detail"})],
+    [("apply_filter", {"filter_name": "contour"}), ("apply_blur", {"intensity": 1}),
+     ("crop", {"box": (10, 10, 120, 90)}), ("apply_blur", {"intensity": 2, "box": (0, 0, 50, 50)})],
+]
+
+
+def _image():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (140, 200, 3), dtype=np.uint8))
+
+
+def _run(chain, deferred):
+    editor = Editor(history_dir=None, track_history=False, deferred=deferred)
+    editor.image = _image()
+    for op, kwargs in chain:
+        getattr(editor, op)(**kwargs)
+    editor.commit()
+    return np.asarray(editor.image)
+
+
+@pytest.mark.parametrize("chain", CHAINS)
+def test_commit_matches_running_each_operation(chain):
+    assert np.array_equal(_run(chain, deferred=True), _run(chain, deferred=False))
+
+
+def test_optimize_keeps_chain_unless_approximate():
+    graph = OperationGraph()
+    graph.add("apply_blur", intensity=2)
+    graph.add("apply_blur", intensity=3)
+    assert [n.op for n in graph.optimize((200, 140))] == ["apply_blur", "apply_blur"]
+    assert [n.op for n in graph.optimize((200, 140), approximate=True)] == ["apply_blur"]
+
+
+def test_approximate_keeps_resizes_with_different_resampling():
+    graph = OperationGraph()
+    graph.add("resize", width=100, height=70, resample="nearest", reducing_gap=None)
+    graph.add("resize", width=50, height=35, resample="lanczos", reducing_gap=None)
+    assert len(graph.optimize((200, 140), approximate=True)) == 2